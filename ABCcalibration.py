@@ -0,0 +1,254 @@
+import os
+import json
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import sweep
+import cycles
+import stopping
+from historical_data_visualization import x_data, h_data, l_data
+
+"""
+The calibrated parameters of the Model with the bounds of their uniform priors.
+"""
+PRIORS = {'killProb': (0.1, 0.9), 'breedProbHares': (0.01, 0.1), 'breedProbLynx': (0.005, 0.05),
+          'maximumHares': (3000.0, 12000.0), 'maximumLynx': (10.0, 60.0)}
+
+
+def observed_statistics(x_data=x_data, h_data=h_data, l_data=l_data):
+    """
+    The summary statistics of the historical series, see statistics, with the years
+    as timesteps.
+    """
+    detector = cycles.CycleDetector(haresMinDelta=0, lynxMinDelta=0)
+    for t, h, l in zip(x_data - x_data[0], h_data, l_data):
+        detector.add(t, l, h)
+    return statistics(detector.summary(), 1)
+
+
+def statistics(summary, stepsPerYear):
+    """
+    The statistics the calibration compares, from a cycles.CycleDetector summary:
+        period           the hare cycle period in years
+        amplitudeRatio   the hare amplitude relative to the mean hares, divided by
+                         the same for the lynx
+        lag              the phase lag of the lynx as a fraction of the period
+    They are nan when the cycle was not seen yet.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {'period': summary['haresPeriod'] / stepsPerYear,
+                'amplitudeRatio': (summary['haresAmplitude'] / summary['meanHares'])
+                                  / (summary['lynxAmplitude'] / summary['meanLynx']),
+                'lag': summary['phaseLag'] / summary['haresPeriod']}
+
+
+def distance(stats, observed):
+    """
+    The distance between simulated and observed statistics: the euclidean norm of
+    the log ratios of the period and the amplitude ratio and the difference of the
+    lag. inf when a statistic is missing.
+    """
+    with np.errstate(invalid='ignore', divide='ignore'):
+        d = np.sqrt(np.log(stats['period'] / observed['period']) ** 2
+                    + np.log(stats['amplitudeRatio'] / observed['amplitudeRatio']) ** 2
+                    + (stats['lag'] - observed['lag']) ** 2)
+    return float(d) if np.isfinite(d) else np.inf
+
+
+def simulate(params, timeSteps, seed, observed, epsilon, stepsPerYear=70, checkAt=0.5, earlyTolerance=1.5,
+             vectorized=True):
+    """
+    Runs the model with params and returns the distance of its statistics to observed
+    and the number of timesteps that were run. The run is rejected early, with an
+    infinite distance, when the lynx or the hares die out, or when after checkAt of
+    the timesteps the distance of the cycles so far is above earlyTolerance * epsilon.
+    A run whose cycles were not all seen yet at that point is not rejected early.
+    """
+    sim = sweep.make_model(params, seed, vectorized)
+    rule = stopping.StoppingRule()
+    rule.start(sim)
+    checkStep = int(checkAt * timeSteps)
+    for t in range(timeSteps):
+        if rule.check(*sim.update()) is not None:
+            return np.inf, t + 1
+        if t + 1 == checkStep and np.isfinite(epsilon):
+            partial = distance(statistics(rule.detector.summary(), stepsPerYear), observed)
+            if np.isfinite(partial) and partial > earlyTolerance * epsilon:
+                return np.inf, t + 1
+    return distance(statistics(rule.detector.summary(), stepsPerYear), observed), timeSteps
+
+
+def npz_name(fileName):
+    """
+    fileName with the .npz suffix np.savez adds, so save and load use the same file.
+    """
+    return fileName if fileName.endswith('.npz') else fileName + '.npz'
+
+
+def save(population, fileName):
+    """
+    Writes a population of particles, as returned by run_abc, to the .npz file fileName.
+    """
+    arrays = {name: population[name] for name in ('particles', 'weights', 'distances')}
+    meta = {name: value for name, value in population.items() if name not in arrays}
+    np.savez(npz_name(fileName), meta=np.array(json.dumps(meta)), **arrays)
+
+
+def load(fileName):
+    """
+    The population saved in fileName.
+    """
+    with np.load(npz_name(fileName)) as data:
+        population = json.loads(str(data['meta']))
+        population.update({name: data[name] for name in ('particles', 'weights', 'distances')})
+    return population
+
+
+def run_abc(nParticles=100, generations=5, timeSteps=2450, seed=1, processes=None, quantile=0.5, stepsPerYear=70,
+            checkAt=0.5, earlyTolerance=1.5, fixed=None, observed=None, fileName=None, resume=False,
+            vectorized=True, callback=None, maxProposals=None):
+    """
+    Approximate Bayesian computation of the posterior of the parameters in PRIORS with
+    sequential Monte Carlo (Toni et al. 2009, Beaumont et al. 2009). Generation 0 keeps
+    nParticles draws of the prior whose runs did not fail. Every next generation
+    resamples the particles by weight, moves them with a gaussian kernel with twice
+    their weighted covariance and keeps them when their distance (see distance) is at
+    most epsilon, the quantile of the distances of the previous generation.
+    The runs of a generation are spread over processes worker processes, with a few
+    per worker in flight, and are rejected early, see simulate. Proposals and their
+    seeds only depend on seed and the generation, and they are accepted in the order
+    they were proposed, so the result does not depend on the number of processes.
+    fixed holds other Model arguments of all runs, observed the statistics to match,
+    by default those of the historical data.
+    With fileName every generation is saved, see save, and with resume the run
+    continues from the population in fileName. callback, when given, is called with
+    every finished population. A generation that needs more than maxProposals
+    proposals, by default 100 * nParticles, raises a RuntimeError, so an epsilon that
+    rejects every run does not go on forever.
+    Returns the last population: a dict with the parameter names, the particles of
+    shape (nParticles, len(names)), their weights and distances, the epsilon and the
+    generation, and the number of proposals and timesteps it took.
+    """
+    names = list(PRIORS)
+    low = np.array([PRIORS[name][0] for name in names])
+    high = np.array([PRIORS[name][1] for name in names])
+    observed = observed_statistics() if observed is None else observed
+    fixed = fixed or {}
+    if resume and fileName is None:
+        raise ValueError('resume needs the fileName of the population to continue from')
+    if maxProposals is None:
+        maxProposals = 100 * nParticles
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    population = load(fileName) if resume else None
+    first = 0 if population is None else population['generation'] + 1
+    for generation in range(first, generations):
+        rng = np.random.default_rng([seed, generation])
+        if population is None:
+            epsilon = np.inf
+
+            def propose():
+                return low + rng.random(len(names)) * (high - low)
+        else:
+            epsilon = float(np.quantile(population['distances'], quantile))
+            parents = population['particles']
+            weights = population['weights']
+            covariance = 2 * np.atleast_2d(np.cov(parents.T, aweights=weights))
+
+            def propose():
+                while True:
+                    theta = rng.multivariate_normal(parents[rng.choice(len(parents), p=weights)], covariance)
+                    if np.all((theta >= low) & (theta <= high)):
+                        return theta
+
+        def job():
+            theta = propose()
+            params = dict(fixed, **dict(zip(names, theta.tolist())))
+            return theta, (params, timeSteps, int(rng.integers(2**63)), observed, epsilon, stepsPerYear, checkAt,
+                           earlyTolerance, vectorized)
+
+        particles, distances, proposals, steps = run_generation(job, nParticles, epsilon, processes, maxProposals)
+        if len(particles) < nParticles:
+            raise RuntimeError(f'generation {generation} accepted only {len(particles)} of {nParticles} particles '
+                               f'in {proposals} proposals with epsilon {epsilon}')
+
+        if population is None:
+            weights = np.ones(nParticles)
+        else:
+            """
+            The prior is uniform, so the weight is the inverse of the density of the
+            kernel mixture the particle was drawn from.
+            """
+            inverse = np.linalg.inv(covariance)
+            delta = particles[:, None, :] - parents[None, :, :]
+            kernel = np.exp(-0.5 * np.einsum('ijk,kl,ijl->ij', delta, inverse, delta))
+            weights = 1 / (kernel @ population['weights'])
+        population = {'names': names, 'generation': generation, 'epsilon': epsilon, 'proposals': proposals,
+                      'steps': steps, 'particles': particles, 'weights': weights / weights.sum(),
+                      'distances': distances}
+        if fileName is not None:
+            save(population, fileName)
+        if callback is not None:
+            callback(population)
+    return population
+
+
+def run_generation(job, nParticles, epsilon, processes, maxProposals=np.inf):
+    """
+    Evaluates the proposals of job until nParticles are accepted, or until
+    maxProposals were evaluated. Returns the accepted particles and distances, the
+    number of proposals that were evaluated and the timesteps that were run for them.
+    """
+    particles = []
+    distances = []
+    proposals = 0
+    steps = 0
+
+    def add(theta, result):
+        nonlocal proposals, steps
+        proposals += 1
+        steps += result[1]
+        if np.isfinite(result[0]) and result[0] <= epsilon:
+            particles.append(theta)
+            distances.append(result[0])
+
+    if processes == 1:
+        while len(particles) < nParticles and proposals < maxProposals:
+            theta, args = job()
+            add(theta, simulate(*args))
+        return np.array(particles), np.array(distances), proposals, steps
+
+    """
+    Keep a few proposals per worker in flight, the results are added in the order
+    of the proposals.
+    """
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        running = {}
+        done = {}
+        started = 0
+        added = 0
+        while len(particles) < nParticles and proposals < maxProposals:
+            while len(running) < 2 * processes and started < maxProposals:
+                theta, args = job()
+                running[pool.submit(simulate, *args)] = (started, theta)
+                started += 1
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index, theta = running.pop(future)
+                done[index] = (theta, future.result())
+            while added in done and len(particles) < nParticles and proposals < maxProposals:
+                add(*done.pop(added))
+                added += 1
+        for future in running:
+            future.cancel()
+    return np.array(particles), np.array(distances), proposals, steps
+
+
+if __name__ == '__main__':
+    population = run_abc(fileName='abc.npz')
+    for i, name in enumerate(population['names']):
+        values = population['particles'][:, i]
+        mean = np.average(values, weights=population['weights'])
+        low, high = np.quantile(values, [0.05, 0.95])
+        print(f'{name:<15} {mean:10.4f}  90% range {low:.4f} - {high:.4f}')
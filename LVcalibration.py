@@ -0,0 +1,238 @@
+import os
+import numpy as np
+import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+
+import LVmodel
+from historical_data_visualization import x_data, h_data, l_data
+
+"""
+The fitted parameters in the order of the parameter vectors, and the ranges the
+starting points are drawn from, log uniformly. The populations are in thousands,
+like the data, and the rates per year.
+"""
+PARAMETERS = ('alpha', 'beta', 'gamma', 'delta', 'H0', 'L0')
+START_RANGES = {'alpha': (0.1, 2.0), 'beta': (0.005, 0.1), 'gamma': (0.1, 2.0), 'delta': (0.005, 0.1),
+                'H0': (10.0, 100.0), 'L0': (1.0, 60.0)}
+
+"""
+The best fits found so far for every data set, used as extra starting points when
+the same data is fitted again.
+"""
+cache = {}
+
+
+def solve_sensitivities(theta, times, substeps=4):
+    """
+    Solves the Lotka-Volterra equations for a batch of parameter vectors theta of shape
+    (n, 6), ordered as PARAMETERS, together with their forward sensitivity equations
+        dS/dt = J S + dF/dtheta,  S(0) = dy0/dtheta
+    with J the analytic Jacobian of the equations to the populations. RK4 with
+    substeps equal steps between the times. Returns the populations at times, shape
+    (n, len(times), 2), and their derivatives to theta, shape (n, len(times), 2, 6).
+    """
+    n = theta.shape[0]
+    alpha, beta, gamma, delta = (theta[:, i] for i in range(4))
+    """
+    The state is the populations in column 0 followed by S, shape (n, 2, 7).
+    """
+    z = np.zeros((n, 2, 7))
+    z[:, :, 0] = theta[:, 4:6]
+    z[:, 0, 5] = 1
+    z[:, 1, 6] = 1
+    J = np.empty((n, 2, 2))
+
+    def f(z):
+        H = z[:, 0, 0]
+        L = z[:, 1, 0]
+        J[:, 0, 0] = alpha - beta * L
+        J[:, 0, 1] = -beta * H
+        J[:, 1, 0] = delta * L
+        J[:, 1, 1] = delta * H - gamma
+        dz = np.empty_like(z)
+        dz[:, :, 1:] = J @ z[:, :, 1:]
+        dz[:, 0, 0] = alpha * H - beta * H * L
+        dz[:, 1, 0] = delta * H * L - gamma * L
+        dz[:, 0, 1] += H
+        dz[:, 0, 2] -= H * L
+        dz[:, 1, 3] -= L
+        dz[:, 1, 4] += H * L
+        return dz
+
+    zs = np.empty((n, times.size, 2, 7))
+    zs[:, 0] = z
+    with np.errstate(over='ignore', invalid='ignore'):
+        for i in range(times.size - 1):
+            h = (times[i + 1] - times[i]) / substeps
+            for _ in range(substeps):
+                k1 = f(z)
+                k2 = f(z + h / 2 * k1)
+                k3 = f(z + h / 2 * k2)
+                k4 = f(z + h * k3)
+                z = z + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+            zs[:, i + 1] = z
+    return zs[..., 0], zs[..., 1:]
+
+
+def residuals(logTheta, times, data, substeps=4):
+    """
+    The residuals of the model against data, shape (len(times), 2), for a batch of
+    log parameter vectors, and their Jacobian to the log parameters from the
+    sensitivities. Returns arrays of shape (n, 2 * len(times)) and (n, 2 * len(times), 6).
+    """
+    with np.errstate(over='ignore'):
+        theta = np.exp(logTheta)
+    ys, Ss = solve_sensitivities(theta, times, substeps)
+    with np.errstate(over='ignore', invalid='ignore'):
+        r = (ys - data).reshape(theta.shape[0], -1)
+        jacobian = (Ss * theta[:, None, None, :]).reshape(theta.shape[0], -1, 6)
+    return r, jacobian
+
+
+def levenberg_marquardt(logTheta, times, data, substeps=4, maxIterations=200, tolerance=1e-8, cull=4.0):
+    """
+    Minimizes the sum of squared residuals from every row of logTheta at once with
+    Levenberg-Marquardt steps. Every iteration solves the trial points of all starts
+    that are not converged in one batch. The residuals and the Jacobian of the
+    current point of a start are kept until a step is accepted, so a rejected step
+    costs one solve. A start stops when an accepted step lowers its cost by less than
+    tolerance relative to it, or when its steps in the log parameters become smaller
+    than the square root of tolerance. When a start stopped, the starts whose cost is
+    more than cull times its cost are stopped as well.
+    Returns the log parameters and the costs.
+    """
+    logTheta = logTheta.copy()
+    n = logTheta.shape[0]
+    r, jacobian = residuals(logTheta, times, data, substeps)
+    cost = costs(r)
+    damping = np.full(n, 1e-3)
+    active = np.isfinite(cost)
+
+    for _ in range(maxIterations):
+        rows = np.flatnonzero(active)
+        if rows.size == 0:
+            break
+        J = jacobian[rows]
+        JtJ = np.transpose(J, (0, 2, 1)) @ J
+        gradient = np.einsum('nij,ni->nj', J, r[rows])
+        A = JtJ + damping[rows, None, None] * (np.diagonal(JtJ, axis1=1, axis2=2)[:, None, :] * np.eye(6) + 1e-12 * np.eye(6))
+        with np.errstate(invalid='ignore'):
+            step = np.linalg.solve(A, -gradient[:, :, None])[:, :, 0]
+        trial = logTheta[rows] + step
+        rTrial, jacobianTrial = residuals(trial, times, data, substeps)
+        costTrial = costs(rTrial)
+
+        better = costTrial < cost[rows]
+        accepted = rows[better]
+        converged = np.zeros(n, dtype=bool)
+        converged[rows] = ~(np.linalg.norm(step, axis=1) > np.sqrt(tolerance))
+        converged[accepted] |= cost[accepted] - costTrial[better] <= tolerance * cost[accepted]
+        logTheta[accepted] = trial[better]
+        r[accepted] = rTrial[better]
+        jacobian[accepted] = jacobianTrial[better]
+        cost[accepted] = costTrial[better]
+        damping[accepted] = np.maximum(damping[accepted] / 3, 1e-12)
+        damping[rows[~better]] *= 4
+        active &= ~converged & (damping < 1e12)
+
+        """
+        Once a start converged, the starts that are still far above its cost are
+        stuck in a worse minimum and are stopped.
+        """
+        finished = ~active & np.isfinite(cost)
+        if finished.any():
+            active &= cost <= cull * cost[finished].min()
+    return logTheta, cost
+
+
+def costs(r):
+    """
+    Half the sum of squared residuals of every row, inf for the rows that overflowed.
+    """
+    with np.errstate(over='ignore', invalid='ignore'):
+        return np.where(np.isfinite(r).all(axis=1), 0.5 * np.sum(r ** 2, axis=1), np.inf)
+
+
+def start_points(n, seed=1, extra=()):
+    """
+    n log parameter vectors drawn log uniformly from START_RANGES with a Latin
+    hypercube, after the rows of extra.
+    """
+    rng = np.random.default_rng(seed)
+    low = np.log([START_RANGES[name][0] for name in PARAMETERS])
+    high = np.log([START_RANGES[name][1] for name in PARAMETERS])
+    u = (np.argsort(rng.random((len(PARAMETERS), n)), axis=1).T + rng.random((n, len(PARAMETERS)))) / n
+    points = low + u * (high - low)
+    if len(extra):
+        points = np.vstack([np.log(np.asarray(extra, dtype=float)).reshape(-1, 6), points])
+    return points
+
+
+def fit(x_data=x_data, h_data=h_data, l_data=l_data, starts=32, seed=1, processes=1, substeps=4,
+        maxIterations=200, useCache=True):
+    """
+    Fits alpha, beta, gamma, delta and the initial populations of the Lotka-Volterra
+    equations to the hare and lynx series, by least squares on the populations, from
+    starts starting points (see start_points) plus the first data point. The time is
+    counted from the first year of x_data. The starting points are split over
+    processes worker processes, with processes=1 they are all run in this process,
+    None uses all CPUs. The gradients come from the sensitivity equations, see
+    solve_sensitivities. With useCache the best fits of earlier calls on the same
+    data are tried as well.
+    Returns a dict with the fitted values by name, the cost (half the sum of squared
+    residuals) and the parameters and costs of all starts as 'starts' and 'costs'.
+    """
+    times = np.asarray(x_data, dtype=float) - x_data[0]
+    data = np.stack([h_data, l_data], axis=1).astype(float)
+    key = (times.tobytes(), data.tobytes())
+    extra = [cache[key]] if useCache and key in cache else []
+    first = np.exp(np.mean(np.log([START_RANGES[name] for name in PARAMETERS[:4]]), axis=1))
+    extra.append(np.concatenate([first, data[0]]))
+    points = start_points(starts, seed, extra)
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes == 1:
+        logTheta, costs = levenberg_marquardt(points, times, data, substeps, maxIterations)
+    else:
+        chunks = np.array_split(points, min(processes, len(points)))
+        with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+            results = list(pool.map(levenberg_marquardt, chunks, [times] * len(chunks), [data] * len(chunks),
+                                    [substeps] * len(chunks), [maxIterations] * len(chunks)))
+        logTheta = np.vstack([result[0] for result in results])
+        costs = np.concatenate([result[1] for result in results])
+
+    best = int(np.argmin(costs))
+    theta = np.exp(logTheta[best])
+    cache[key] = theta
+    result = dict(zip(PARAMETERS, theta.tolist()))
+    result.update(cost=float(costs[best]), starts=np.exp(logTheta), costs=costs)
+    return result
+
+
+def predict(result, t):
+    """
+    The hares and lynxes of a fit at the times t, counted from the first year, see
+    LVmodel.solve_batch.
+    """
+    y0 = [result['H0'], result['L0']]
+    return LVmodel.solve_batch(y0, t, result['alpha'], result['beta'], result['gamma'], result['delta'],
+                               method='dopri5')
+
+
+if __name__ == '__main__':
+    result = fit()
+    print('Fitted parameters:', {name: round(result[name], 4) for name in PARAMETERS})
+    print('Cost:', result['cost'])
+
+    t = np.linspace(0, x_data[-1] - x_data[0], 500)
+    sol = predict(result, t)
+    plt.scatter(x_data, h_data, label='Hares Data Points', color='green')
+    plt.scatter(x_data, l_data, label='Lynx Data Points', color='red')
+    plt.plot(t + x_data[0], sol[:, 0], color='green', label='Fitted Lotka-Volterra Hares')
+    plt.plot(t + x_data[0], sol[:, 1], color='red', label='Fitted Lotka-Volterra Lynx')
+    plt.xlabel('Time Steps')
+    plt.ylabel('Population x1000')
+    plt.title('Lotka-Volterra Fit to Hare and Lynx Data')
+    plt.legend()
+    plt.show()
@@ -18,45 +18,219 @@ delta = 0.0002  # Predator growth rate by consuming prey
 y0 = [2000, 5]
 # Time grid
 t = np.linspace(0, 1000, 1000)
-# ODE system with the updated parameters
-sol = odeint(eqs, y0, t, args=(alpha, beta, gamma, delta))
-# Calculate mean values
-prey_mean = np.mean(sol[:, 0])
-predator_mean = np.mean(sol[:, 1])
-
-fig, ax1 = plt.subplots()
-
-color_prey = 'blue'
-ax1.set_xlabel('Time')
-ax1.set_ylabel('Hares Population', color=color_prey)
-ax1.plot(t, sol[:, 0], label='Hares', color=color_prey, linestyle='-')
-ax1.tick_params(axis='y', labelcolor=color_prey)
-ax1.axhline(prey_mean, color=color_prey, linestyle='--')  
-ax1.text(0, prey_mean, f' {prey_mean:.2f}', va='center', ha='right', color=color_prey, fontsize=10, backgroundcolor='white')
-
-ax2 = ax1.twinx()
-color_predator = 'red'
-ax2.set_ylabel('Lynx Population', color=color_predator)
-ax2.plot(t, sol[:, 1], label='Lynx', color=color_predator, linestyle='-')
-ax2.tick_params(axis='y', labelcolor=color_predator)
-ax2.axhline(predator_mean, color=color_predator, linestyle='--') 
-ax2.text(1000, predator_mean, f' {predator_mean:.2f}', va='center', ha='left', color=color_predator, fontsize=10, backgroundcolor='white')
-
-
-
-plt.tight_layout()
-plt.show()
-fig.legend(loc='upper right', bbox_to_anchor=(0.85, 0.85))
-
-plt.figure()
-H = sol[:, 0]
-L = sol[:, 1]
-plt.plot(H, L)
-plt.title('Hare/Lynx Phase Plot')
-plt.xlabel('Hare Population')
-plt.ylabel('Lynx Population')
-plt.grid(True)
-
-plt.tight_layout()
-plt.show()
 
+
+def solve(y0=y0, t=t, alpha=alpha, beta=beta, gamma=gamma, delta=delta):
+    """
+    Solves the Lotka-Volterra equations on the time grid t, returns an array with
+    the hares and lynxes at every time.
+    """
+    # ODE system with the updated parameters
+    return odeint(eqs, y0, t, args=(alpha, beta, gamma, delta))
+
+
+def plot(t, sol):
+    """
+    Plots the populations over time with their means, and the phase plot.
+    """
+    # Calculate mean values
+    prey_mean = np.mean(sol[:, 0])
+    predator_mean = np.mean(sol[:, 1])
+
+    fig, ax1 = plt.subplots()
+
+    color_prey = 'blue'
+    ax1.set_xlabel('Time')
+    ax1.set_ylabel('Hares Population', color=color_prey)
+    ax1.plot(t, sol[:, 0], label='Hares', color=color_prey, linestyle='-')
+    ax1.tick_params(axis='y', labelcolor=color_prey)
+    ax1.axhline(prey_mean, color=color_prey, linestyle='--')
+    ax1.text(0, prey_mean, f' {prey_mean:.2f}', va='center', ha='right', color=color_prey, fontsize=10, backgroundcolor='white')
+
+    ax2 = ax1.twinx()
+    color_predator = 'red'
+    ax2.set_ylabel('Lynx Population', color=color_predator)
+    ax2.plot(t, sol[:, 1], label='Lynx', color=color_predator, linestyle='-')
+    ax2.tick_params(axis='y', labelcolor=color_predator)
+    ax2.axhline(predator_mean, color=color_predator, linestyle='--')
+    ax2.text(1000, predator_mean, f' {predator_mean:.2f}', va='center', ha='left', color=color_predator, fontsize=10, backgroundcolor='white')
+
+
+
+    plt.tight_layout()
+    plt.show()
+    fig.legend(loc='upper right', bbox_to_anchor=(0.85, 0.85))
+
+    plt.figure()
+    H = sol[:, 0]
+    L = sol[:, 1]
+    plt.plot(H, L)
+    plt.title('Hare/Lynx Phase Plot')
+    plt.xlabel('Hare Population')
+    plt.ylabel('Lynx Population')
+    plt.grid(True)
+
+    plt.tight_layout()
+    plt.show()
+
+
+"""
+The Butcher tableau of the Dormand-Prince 5(4) pair: the nodes C, the stages A, the
+weights B of the fifth order solution and E, the difference with the fourth order one.
+"""
+DOPRI_C = np.array([0, 1/5, 3/10, 4/5, 8/9, 1, 1])
+DOPRI_A = [[],
+           [1/5],
+           [3/40, 9/40],
+           [44/45, -56/15, 32/9],
+           [19372/6561, -25360/2187, 64448/6561, -212/729],
+           [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+           [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]]
+DOPRI_B = np.array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84, 0])
+DOPRI_E = np.array([71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40])
+
+
+def derivatives(y, alpha, beta, gamma, delta):
+    """
+    The Lotka-Volterra equations for many systems at once, y has shape (n, 2) and
+    the parameters are scalars or arrays of length n.
+    """
+    H = y[:, 0]
+    L = y[:, 1]
+    return np.stack([alpha * H - beta * H * L, delta * H * L - gamma * L], axis=1)
+
+
+def solve_batch(y0=y0, t=t, alpha=alpha, beta=beta, gamma=gamma, delta=delta, method='rk4', substeps=4,
+                rtol=1e-6, atol=1e-6, maxSteps=1000000):
+    """
+    Solves many Lotka-Volterra systems at once on the time grid t. The parameters are
+    scalars or arrays and y0 has shape (..., 2), they are broadcast against each other,
+    so a grid of parameters is given as e.g. alpha=a[:, None], beta=b[None, :].
+    method is 'rk4', the classical Runge-Kutta method with substeps equal steps
+    between the times of t, or 'dopri5', the adaptive Dormand-Prince method with its
+    own step size for every system, controlled by rtol and atol.
+    Returns an array of shape (..., len(t), 2) with the hares and lynxes of every
+    system at every time, see summarize for the means, extrema and periods.
+    """
+    y0 = np.asarray(y0, dtype=float)
+    t = np.asarray(t, dtype=float)
+    shape = np.broadcast_shapes(y0.shape[:-1], np.shape(alpha), np.shape(beta), np.shape(gamma), np.shape(delta))
+    params = [np.broadcast_to(p, shape).ravel().astype(float) for p in (alpha, beta, gamma, delta)]
+    y = np.broadcast_to(y0, shape + (2,)).reshape(-1, 2).copy()
+
+    if method == 'rk4':
+        sol = rk4(y, t, params, substeps)
+    elif method == 'dopri5':
+        sol = dopri5(y, t, params, rtol, atol, maxSteps)
+    else:
+        raise ValueError(f"unknown method {method!r}, use 'rk4' or 'dopri5'")
+    return sol.reshape(shape + (t.size, 2))
+
+
+def rk4(y, t, params, substeps):
+    """
+    The classical fourth order Runge-Kutta method on all systems with the same steps.
+    """
+    sol = np.empty((y.shape[0], t.size, 2))
+    sol[:, 0] = y
+    for i in range(t.size - 1):
+        h = (t[i + 1] - t[i]) / substeps
+        for _ in range(substeps):
+            k1 = derivatives(y, *params)
+            k2 = derivatives(y + h / 2 * k1, *params)
+            k3 = derivatives(y + h / 2 * k2, *params)
+            k4 = derivatives(y + h * k3, *params)
+            y = y + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        sol[:, i + 1] = y
+    return sol
+
+
+def dopri5(y, t, params, rtol, atol, maxSteps):
+    """
+    The Dormand-Prince method with an adaptive step for every system. The steps of a
+    system are cut short at the next time of t, so the solution is computed at those
+    times instead of interpolated. Every iteration makes one step attempt for all
+    systems that did not reach the end yet.
+    """
+    n = y.shape[0]
+    sol = np.empty((n, t.size, 2))
+    sol[:, 0] = y
+    current = np.full(n, t[0])
+    index = np.ones(n, dtype=int)
+    h = np.full(n, (t[-1] - t[0]) / max(t.size - 1, 1))
+    params = np.array(params)
+
+    for _ in range(maxSteps):
+        active = np.flatnonzero(index < t.size)
+        if active.size == 0:
+            return sol
+        ya = y[active]
+        pa = params[:, active]
+        target = t[index[active]]
+        step = np.minimum(h[active], target - current[active])
+
+        k = [derivatives(ya, *pa)]
+        for stage in range(1, 7):
+            yi = ya + step[:, None] * sum(a * ki for a, ki in zip(DOPRI_A[stage], k))
+            k.append(derivatives(yi, *pa))
+        yNew = ya + step[:, None] * sum(b * ki for b, ki in zip(DOPRI_B, k))
+        error = step[:, None] * sum(e * ki for e, ki in zip(DOPRI_E, k))
+        scale = atol + rtol * np.maximum(np.abs(ya), np.abs(yNew))
+        norm = np.sqrt(np.mean((error / scale) ** 2, axis=1))
+
+        accept = norm <= 1
+        factor = np.clip(0.9 * np.maximum(norm, 1e-10) ** -0.2, 0.2, 5.0)
+        """
+        A step cut short at an output time says nothing against the longer step.
+        """
+        cut = step < h[active]
+        h[active] = np.where(accept & cut, np.maximum(step * factor, h[active]), step * factor)
+
+        done = active[accept]
+        y[done] = yNew[accept]
+        current[done] += step[accept]
+        reached = done[current[done] >= t[index[done]] - 1e-12 * (abs(t[-1]) + 1)]
+        current[reached] = t[index[reached]]
+        sol[reached, index[reached]] = y[reached]
+        index[reached] += 1
+    raise RuntimeError(f'dopri5 did not reach t={t[-1]} in {maxSteps} steps')
+
+
+def summarize(t, sol):
+    """
+    The mean, the minimum and the maximum of the hares and the lynxes of every system
+    of solve_batch, and the period: the mean time between the upward crossings of its
+    own mean, nan with fewer than two crossings. Returns a dict of arrays of the batch
+    shape of sol, with the keys meanHares, minHares, maxHares, periodHares and the same
+    for Lynx.
+    """
+    summary = {}
+    for name, x in (('Hares', sol[..., 0]), ('Lynx', sol[..., 1])):
+        mean = x.mean(axis=-1)
+        summary['mean' + name] = mean
+        summary['min' + name] = x.min(axis=-1)
+        summary['max' + name] = x.max(axis=-1)
+        summary['period' + name] = crossing_period(t, x - mean[..., None])
+    return summary
+
+
+def crossing_period(t, x):
+    """
+    The mean time between the upward zero crossings of x along its last axis, with
+    the crossing times interpolated linearly between the times of t.
+    """
+    before = x[..., :-1]
+    after = x[..., 1:]
+    crossing = (before < 0) & (after >= 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        times = np.where(crossing, t[:-1] - before * (t[1:] - t[:-1]) / (after - before), np.nan)
+    count = crossing.sum(axis=-1)
+    with np.errstate(invalid='ignore'):
+        first = np.where(count > 0, np.nanmin(np.where(crossing, times, np.inf), axis=-1), np.nan)
+        last = np.where(count > 0, np.nanmax(np.where(crossing, times, -np.inf), axis=-1), np.nan)
+        return np.where(count > 1, (last - first) / np.maximum(count - 1, 1), np.nan)
+
+
+if __name__ == '__main__':
+    sol = solve()
+    plot(t, sol)
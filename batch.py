@@ -0,0 +1,324 @@
+import os
+import csv
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import sweep
+import stopping
+import recorder
+import runcache
+
+"""
+Batches of simulation runs without any prompts or plots, described by a JSON spec:
+    {"kind": "run",                  "run" keeps the populations of every timestep,
+                                     "cycles" only the cycle statistics, see sweep.run_cycles
+     "timeSteps": 2450,
+     "seed": 1,                      the seeds of the jobs are spawned from it
+     "replicates": 1,                runs with their own seed per parameter set
+     "vectorized": true,
+     "params": {"mountainOn": true}, Model arguments of every run
+     "sweep": {"killProb": [0.2, 0.4],
+               "nHares": {"start": 1000, "stop": 3000, "num": 5}},
+                                     every combination of these values, lists or linspaces
+     "stopping": {"extinction": true}}
+                                     stopping.StoppingRule arguments, null to run every timestep
+Only timeSteps is required, a spec without sweep is a single run. Every job writes its
+result to a directory of its own under jobs/ and its progress to journal.jsonl, so a
+batch that was killed continues with the jobs that did not finish.
+"""
+DEFAULTS = {'kind': 'run', 'seed': 1, 'replicates': 1, 'vectorized': True, 'params': {}, 'sweep': {},
+            'stopping': None}
+
+STARTED = 'started'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def load_spec(fileName):
+    """
+    The spec in the JSON file fileName with the defaults filled in.
+    """
+    with open(fileName) as file:
+        spec = dict(DEFAULTS, **json.load(file))
+    unknown = set(spec) - set(DEFAULTS) - {'timeSteps'}
+    if unknown:
+        raise ValueError(f'Unknown spec entries {sorted(unknown)}')
+    if 'timeSteps' not in spec:
+        raise ValueError('The spec needs timeSteps')
+    if spec['kind'] not in ('run', 'cycles'):
+        raise ValueError(f"kind must be 'run' or 'cycles', not {spec['kind']!r}")
+    return spec
+
+
+def expand(spec):
+    """
+    The parameter sets of all jobs of spec, every combination of the sweep values
+    repeated replicates times, in a fixed order. Values of integer Model arguments are
+    rounded.
+    """
+    defaults = runcache.model_parameters({})
+    values = {}
+    for name in list(spec['params']) + list(spec['sweep']):
+        if name not in defaults:
+            raise ValueError(f'Unknown parameter {name}')
+    for name, value in spec['sweep'].items():
+        if isinstance(value, dict):
+            value = np.linspace(value['start'], value['stop'], value['num']).tolist()
+        integer = isinstance(defaults[name], int) and not isinstance(defaults[name], bool)
+        values[name] = [int(round(v)) if integer else v for v in value]
+
+    paramSets = []
+    for combination in itertools.product(*values.values()):
+        params = dict(spec['params'], **dict(zip(values, combination)))
+        paramSets.extend(dict(params) for _ in range(spec['replicates']))
+    return paramSets
+
+
+def spec_hash(spec):
+    """
+    A hash of the spec, the journal of a batch only applies to the spec it was made for.
+    """
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def read_journal(fileName):
+    """
+    The header of the journal and the last status of every job in it. A line that was
+    cut off when the batch was killed is skipped.
+    """
+    header = None
+    status = {}
+    if not os.path.exists(fileName):
+        return header, status
+    with open(fileName) as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if 'spec' in entry:
+                header = entry
+            else:
+                status[entry['job']] = entry['status']
+    return header, status
+
+
+def write_entry(file, entry):
+    """
+    Appends an entry to the journal and makes sure it is on disk.
+    """
+    file.write(json.dumps(entry) + '\n')
+    file.flush()
+    os.fsync(file.fileno())
+
+
+def run_job(directory, job, params, timeSteps, seed, kind, vectorized, stoppingSettings):
+    """
+    Runs one job and writes its result to jobs/<job> in directory: the populations as
+    recorder columns for a run, and a meta.json with the parameters, the seed, the
+    reason the run stopped or the cycle statistics. The result is written to a
+    temporary directory first, so a killed job never leaves a partial result.
+    Returns the job and the number of timesteps that were run.
+    """
+    rule = None if stoppingSettings is None else stopping.StoppingRule(**stoppingSettings)
+    if kind == 'cycles':
+        result = sweep.run_cycles(params, timeSteps, seed, vectorized, rule)
+        steps = result['steps']
+    else:
+        result = sweep.run_single(params, timeSteps, seed, vectorized, rule)
+        steps = len(result[0])
+    columns, meta = sweep.pack(result)
+
+    path = os.path.join(directory, 'jobs', str(job))
+    temporary = path + '.tmp'
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    if columns:
+        with recorder.Recorder(temporary, columns=[(name, np.asarray(values).dtype)
+                                                   for name, values in columns.items()]) as rec:
+            rec.extend(columns)
+    with open(os.path.join(temporary, 'meta.json'), 'w') as file:
+        json.dump({'job': job, 'params': params, 'seed': runcache.seed_description(seed), 'steps': steps,
+                   'meta': meta}, file)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temporary, path)
+    return job, steps
+
+
+def remove_batch(directory):
+    """
+    Removes the files a batch made in directory: the journal, the spec, the job results
+    and results.csv. Other files in directory are left alone.
+    """
+    for name in ('journal.jsonl', 'spec.json', 'results.csv'):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(os.path.join(directory, 'jobs'), ignore_errors=True)
+
+
+def progress(done, total, finished, steps, elapsed):
+    """
+    A line with the jobs done out of total, the throughput of the finished jobs and
+    timesteps of this session over elapsed seconds and the estimated time left.
+    """
+    rate = finished / elapsed if elapsed > 0 else 0
+    if rate > 0:
+        eta = time.strftime('%H:%M:%S', time.gmtime((total - done) / rate))
+    else:
+        eta = '--:--:--'
+    return (f'{done}/{total} jobs, {rate:.2f} jobs/s, {steps / elapsed if elapsed > 0 else 0:.0f} timesteps/s, '
+            f'ETA {eta}')
+
+
+def run_batch(spec, directory, processes=None, restart=False, interval=5.0, log=print):
+    """
+    Runs all jobs of spec (see load_spec and expand) that are not done yet, spread over
+    processes worker processes, processes=1 runs them in this process and None uses all
+    CPUs. The results go to directory, see run_job, and every job is recorded in
+    directory/journal.jsonl when it starts and when it is done or failed. A journal of
+    another spec raises a ValueError, unless restart is given, which removes the files
+    of the earlier batch, see remove_batch, and starts over. The seeds of the jobs are spawned from the seed of the spec, so a resumed
+    batch gives the same results. A progress line is logged at most every interval
+    seconds and when the batch is done.
+    Returns the number of jobs that are done and the jobs that failed.
+    """
+    paramSets = expand(spec)
+    seeds = sweep.spawn_seeds(spec['seed'], len(paramSets))
+    journalFile = os.path.join(directory, 'journal.jsonl')
+    if restart:
+        remove_batch(directory)
+    os.makedirs(os.path.join(directory, 'jobs'), exist_ok=True)
+
+    header, status = read_journal(journalFile)
+    if header is not None and header['spec'] != spec_hash(spec):
+        raise ValueError(f'{directory} holds a batch of another spec, use another directory or restart')
+    done = {job for job, s in status.items()
+            if s == DONE and os.path.exists(os.path.join(directory, 'jobs', str(job), 'meta.json'))}
+    todo = [job for job in range(len(paramSets)) if job not in done]
+    if header is None:
+        with open(os.path.join(directory, 'spec.json'), 'w') as file:
+            json.dump(spec, file, indent=2)
+    if done:
+        log(f'Resuming: {len(done)} of {len(paramSets)} jobs are done')
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    failed = []
+    ran = 0
+    steps = 0
+    start = time.time()
+    lastLog = start
+    with open(journalFile, 'a') as journal:
+        if header is None:
+            write_entry(journal, {'spec': spec_hash(spec), 'jobs': len(paramSets)})
+
+        def submit(job):
+            write_entry(journal, {'job': job, 'status': STARTED, 'time': time.time()})
+            return (directory, job, paramSets[job], spec['timeSteps'], seeds[job], spec['kind'], spec['vectorized'],
+                    spec['stopping'])
+
+        def finish(job, result=None, error=None):
+            nonlocal ran, steps, lastLog
+            if error is None:
+                write_entry(journal, {'job': job, 'status': DONE, 'time': time.time(), 'steps': result[1]})
+                done.add(job)
+                ran += 1
+                steps += result[1]
+            else:
+                write_entry(journal, {'job': job, 'status': FAILED, 'time': time.time(), 'error': repr(error)})
+                failed.append(job)
+                log(f'Job {job} failed: {error!r}')
+            now = time.time()
+            if now - lastLog >= interval or len(done) + len(failed) == len(paramSets):
+                log(progress(len(done), len(paramSets), ran, steps, now - start))
+                lastLog = now
+
+        if processes == 1:
+            for job in todo:
+                args = submit(job)
+                try:
+                    finish(job, run_job(*args))
+                except Exception as error:
+                    finish(job, error=error)
+        else:
+            """
+            Keep a few jobs per worker in flight, every job is journaled as soon as it
+            finishes.
+            """
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                waiting = iter(todo)
+                running = {}
+                while True:
+                    for job in itertools.islice(waiting, 2 * processes - len(running)):
+                        running[pool.submit(run_job, *submit(job))] = job
+                    if not running:
+                        break
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        job = running.pop(future)
+                        try:
+                            finish(job, future.result())
+                        except Exception as error:
+                            finish(job, error=error)
+    return len(done), failed
+
+
+def collect(directory):
+    """
+    The results of the finished jobs in directory, as a list of dicts with the job,
+    its parameters, the timesteps that were run and the reason it stopped, or the
+    cycle statistics for a batch of kind cycles. The populations of the runs can be
+    read with recorder.load(os.path.join(directory, 'jobs', str(job))).
+    """
+    _, status = read_journal(os.path.join(directory, 'journal.jsonl'))
+    rows = []
+    for job in sorted(job for job, s in status.items() if s == DONE):
+        with open(os.path.join(directory, 'jobs', str(job), 'meta.json')) as file:
+            meta = json.load(file)
+        row = {'job': job, **meta['params'], 'steps': meta['steps']}
+        row.update(meta['meta'].get('summary', {'reason': meta['meta'].get('reason')}))
+        rows.append(row)
+    return rows
+
+
+def write_results(rows, fileName):
+    """
+    Writes the rows of collect to the CSV file fileName.
+    """
+    names = list(dict.fromkeys(name for row in rows for name in row))
+    with open(fileName, 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=names)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs a batch of simulations described by a JSON spec.')
+    parser.add_argument('spec', help='the JSON spec file')
+    parser.add_argument('--output', default=None, help='directory for the results, by default the spec name')
+    parser.add_argument('--processes', type=int, default=None, help='worker processes, by default all CPUs')
+    parser.add_argument('--restart', action='store_true', help='throw away earlier results and start over')
+    parser.add_argument('--interval', type=float, default=5.0, help='seconds between progress lines')
+    parser.add_argument('--dry-run', dest='dryRun', action='store_true', help='only print the jobs')
+    args = parser.parse_args()
+
+    spec = load_spec(args.spec)
+    directory = args.output or os.path.splitext(args.spec)[0]
+    if args.dryRun:
+        for job, params in enumerate(expand(spec)):
+            print(job, json.dumps(params))
+        sys.exit(0)
+
+    done, failed = run_batch(spec, directory, args.processes, args.restart, args.interval,
+                             lambda line: print(line, flush=True))
+    write_results(collect(directory), os.path.join(directory, 'results.csv'))
+    print(f'{done} jobs done, {len(failed)} failed, results in {directory}')
+    sys.exit(1 if failed else 0)
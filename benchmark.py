@@ -0,0 +1,237 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import tempfile
+import tracemalloc
+import numpy as np
+import matplotlib.pyplot as plt
+
+import recorder
+import simulation
+import simulation_vectorized
+import kernels
+import LVmodel
+import LVcalibration
+import historical_data_visualization
+
+"""
+The settings of the Model.update benchmarks, every combination is timed for both
+engines. QUICK_GRID is a smaller grid for a fast check.
+"""
+GRID = {'nHares': [500, 2000, 5000], 'nLynx': [5, 20], 'size': [50, 100, 200], 'nForest': [200, 1000],
+        'terrain': [(False, False), (True, True)]}
+QUICK_GRID = {'nHares': [500, 2000], 'nLynx': [5], 'size': [100], 'nForest': [200], 'terrain': [(False, False), (True, True)]}
+
+"""
+The settings whose exponent is fitted in the scaling of the update benchmarks.
+"""
+SCALING = ('nHares', 'nLynx', 'size', 'nForest')
+
+
+def measure(function, repeats=3, setup=None):
+    """
+    Runs function repeats times and once more under tracemalloc. Returns the best wall
+    time, the peak memory allocated during the call in bytes and what the last call
+    returned. With setup the function is called with the result of setup(), which is
+    neither timed nor traced.
+    """
+    def call(traced=False):
+        argument = None if setup is None else setup()
+        if traced:
+            tracemalloc.start()
+        start = time.perf_counter()
+        result = function() if setup is None else function(argument)
+        seconds = time.perf_counter() - start
+        return seconds, result
+
+    best = min(call()[0] for _ in range(repeats))
+    _, result = call(traced=True)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def update_cases(grid, steps):
+    """
+    A benchmark of steps calls to update for every combination of settings in grid and
+    both engines. The model is made again for every repeat, only update is timed.
+    Every case is (name, settings, steps, function, setup).
+    """
+    cases = []
+    for engine, nHares, nLynx, size, nForest, (mountainOn, forestOn) in itertools.product(
+            ('Model', 'VectorizedModel'), grid['nHares'], grid['nLynx'], grid['size'], grid['nForest'], grid['terrain']):
+        params = {'nHares': nHares, 'nLynx': nLynx, 'width': size, 'height': size, 'nForest': nForest,
+                  'mountainOn': mountainOn, 'forestOn': forestOn}
+        name = f"update/{engine}/nHares={nHares}/nLynx={nLynx}/size={size}/nForest={nForest}" \
+               f"/mountainOn={mountainOn}/forestOn={forestOn}"
+        settings = {'engine': engine, 'nHares': nHares, 'nLynx': nLynx, 'size': size, 'nForest': nForest,
+                    'mountainOn': mountainOn, 'forestOn': forestOn}
+        cases.append((name, settings, steps) + update_runner(engine, params, steps))
+    return cases
+
+
+def update_runner(engine, params, steps):
+    """
+    The function and the setup that measure needs to time steps calls to update of
+    a new model.
+    """
+    cls = simulation.Model if engine == 'Model' else simulation_vectorized.VectorizedModel
+
+    def setup():
+        return cls(seed=1, **params)
+
+    def run(sim):
+        for _ in range(steps):
+            sim.update()
+    return run, setup
+
+
+def kernel_cases(grid, steps):
+    """
+    steps calls to update of VectorizedModel with and without the loop kernels, for
+    every number of hares and lynxes in grid on a 100 x 100 grid. The settings record
+    whether Numba compiled the kernels.
+    """
+    cases = []
+    for useKernels, nHares, nLynx in itertools.product((False, True), grid['nHares'], grid['nLynx']):
+        params = {'nHares': nHares, 'nLynx': nLynx, 'useKernels': useKernels}
+        settings = {'engine': 'VectorizedModel', 'useKernels': useKernels, 'compiled': kernels.COMPILED,
+                    'nHares': nHares, 'nLynx': nLynx}
+        name = f'kernels/useKernels={useKernels}/nHares={nHares}/nLynx={nLynx}'
+        cases.append((name, settings, steps) + update_runner('VectorizedModel', params, steps))
+    return cases
+
+
+def run_simulation_cases():
+    """
+    The full run_simulation of simulation.py with both engines, without the live
+    visualization and with the final plot drawn off screen. The run stops when the
+    lynx or the hares die out, so it returns the number of timesteps it recorded.
+    """
+    cases = []
+    for vectorized in (False, True):
+        def run(vectorized=vectorized):
+            simulation.run_simulation(mountainOn=True, forestOn=True, visualize=False, vectorized=vectorized)
+            plt.close('all')
+            return len(recorder.load('simulation', ['time'])['time'])
+        cases.append((f'run_simulation/vectorized={vectorized}', {'vectorized': vectorized}, 1000, run, None))
+    return cases
+
+
+def analytical_cases():
+    """
+    The ODE solves of LVmodel, one system with odeint and a grid of 1000 systems with
+    both batched methods, the Lotka-Volterra calibration without its cache and the sine
+    fits of historical_data_visualization.
+    """
+    alphas = np.linspace(0.005, 0.02, 100)[:, None]
+    betas = np.linspace(0.0003, 0.001, 10)[None, :]
+    return [('LVmodel.solve', {}, None, LVmodel.solve, None),
+            ('LVmodel.solve_batch/rk4/1000 systems', {}, None,
+             lambda: LVmodel.solve_batch(alpha=alphas, beta=betas, method='rk4'), None),
+            ('LVmodel.solve_batch/dopri5/1000 systems', {}, None,
+             lambda: LVmodel.solve_batch(alpha=alphas, beta=betas, method='dopri5'), None),
+            ('LVcalibration.fit', {}, None, lambda: LVcalibration.fit(useCache=False), None),
+            ('historical_data_visualization.fit_curves', {}, None, historical_data_visualization.fit_curves, None)]
+
+
+def run_benchmarks(quick=False, repeats=3, steps=None, full=True):
+    """
+    Runs all benchmarks and returns the results as a dict that can be saved as JSON.
+    full includes the 1000 step run_simulation runs.
+    """
+    plt.switch_backend('Agg')
+    grid = QUICK_GRID if quick else GRID
+    steps = steps or (20 if quick else 50)
+    cases = update_cases(grid, steps) + kernel_cases(grid, steps) + analytical_cases()
+    if full:
+        cases += run_simulation_cases()
+
+    results = []
+    directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as workDirectory:
+        """
+        run_simulation writes its recordings to the working directory.
+        """
+        os.chdir(workDirectory)
+        try:
+            for name, settings, caseSteps, run, setup in cases:
+                seconds, peak, ranSteps = measure(run, 1 if name.startswith('run_simulation') else repeats, setup)
+                result = {'name': name, 'settings': settings, 'seconds': seconds, 'peakMemory': peak}
+                if caseSteps is not None:
+                    """
+                    A run that stopped early returns the timesteps it ran.
+                    """
+                    caseSteps = ranSteps if isinstance(ranSteps, int) else caseSteps
+                    result['steps'] = caseSteps
+                    result['stepsPerSecond'] = caseSteps / seconds
+                results.append(result)
+                print(f"{name:<100} {seconds:9.4f} s {peak / 2**20:8.1f} MiB", flush=True)
+        finally:
+            os.chdir(directory)
+
+    return {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                     'platform': platform.platform(), 'processor': platform.processor(),
+                     'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'quick': quick, 'repeats': repeats},
+            'results': results, 'scaling': scaling(results)}
+
+
+def scaling(results):
+    """
+    For every engine the exponents b of a least squares fit of the update time per
+    step ~ nHares^b1 * nLynx^b2 * size^b3 * nForest^b4 over all update benchmarks,
+    with the mountain and forest switches as extra terms. Settings that do not vary
+    are left out.
+    """
+    exponents = {}
+    for engine in ('Model', 'VectorizedModel'):
+        runs = [r for r in results if r['name'].startswith('update/') and r['settings']['engine'] == engine]
+        if len(runs) < 2:
+            continue
+        names = [name for name in SCALING if len({r['settings'][name] for r in runs}) > 1]
+        columns = [np.ones(len(runs))] + [np.log([r['settings'][name] for r in runs]) for name in names]
+        for switch in ('mountainOn', 'forestOn'):
+            if len({r['settings'][switch] for r in runs}) > 1:
+                columns.append(np.array([float(r['settings'][switch]) for r in runs]))
+        y = np.log([r['seconds'] / r['steps'] for r in runs])
+        coefficients = np.linalg.lstsq(np.column_stack(columns), y, rcond=None)[0]
+        exponents[engine] = dict(zip(names, coefficients[1:len(names) + 1].tolist()))
+    return exponents
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    The benchmarks that got more than tolerance slower than in the baseline, as
+    (name, seconds, baseline seconds) tuples. Benchmarks missing in either are skipped.
+    """
+    before = {r['name']: r['seconds'] for r in baseline['results']}
+    return [(r['name'], r['seconds'], before[r['name']]) for r in results['results']
+            if r['name'] in before and r['seconds'] > before[r['name']] * (1 + tolerance)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the simulation and the analytical models.')
+    parser.add_argument('--quick', action='store_true', help='use the small grid of settings')
+    parser.add_argument('--no-full', dest='full', action='store_false', help='skip the run_simulation runs')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--steps', type=int, default=None, help='timesteps per update benchmark')
+    parser.add_argument('--output', default='benchmark.json', help='file to save the results to')
+    parser.add_argument('--baseline', default=None, help='results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown against the baseline')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.quick, args.repeats, args.steps, args.full)
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print('Scaling exponents:', json.dumps(results['scaling'], indent=2))
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for name, seconds, before in regressions:
+            print(f'Slower: {name} {seconds:.4f} s, was {before:.4f} s')
+        sys.exit(1 if regressions else 0)
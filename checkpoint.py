@@ -0,0 +1,163 @@
+import json
+import numpy as np
+
+import simulation
+import simulation_vectorized
+import terrain
+
+"""
+Checkpoints of a simulation.Model or simulation_vectorized.VectorizedModel: the
+animals, the terrain, the counters and the state of the random generator. A model
+restored from a checkpoint continues exactly like the original would have.
+"""
+
+"""
+The attributes of the animals of simulation.Model that are stored, next to their
+position. Attributes that are not set yet are stored as their value in DEFAULTS.
+"""
+HARE_SLOTS = ('state', 'time_born', 'lastbreed')
+LYNX_SLOTS = ('state', 'killProb', 'killProbHares', 'time_born', 'hungry', 'time_hungry', 'eatIndex',
+              'eaten3', 'eaten7', 'eaten14', 'lastbreed', 'huntDistance', 'speed', 'xdirection', 'ydirection')
+DEFAULTS = {'killProbHares': np.nan, 'xdirection': 0, 'ydirection': 0}
+
+"""
+Parameters that can be changed when forking, with the name of the attribute they set.
+The terrain and the initial populations are fixed once the model is made.
+"""
+PARAMETERS = {'killProb': 'killProb', 'breedProbHares': 'breedProbHares', 'breedProbLynx': 'breedProbLynx',
+              'maximumHares': 'maxHares', 'maximumLynx': 'maxLynx', 'legacyRemoval': 'legacyRemoval'}
+
+MODELS = {'Model': simulation.Model, 'VectorizedModel': simulation_vectorized.VectorizedModel}
+
+
+def get_state(sim):
+    """
+    The full state of the model as a dict of arrays. The parameters, the counters and
+    the generator state are in the JSON string under 'meta'.
+    """
+    meta = {'model': type(sim).__name__, 'rng': sim.rng.bit_generator.state, 'attributes': {}, 'arrays': []}
+    state = {}
+    for name, value in vars(sim).items():
+        if isinstance(value, (bool, int, float, np.bool_, np.integer, np.floating)):
+            meta['attributes'][name] = value.item() if isinstance(value, np.generic) else value
+        elif isinstance(value, np.ndarray):
+            state[name] = value
+            meta['arrays'].append(name)
+
+    if isinstance(sim, simulation.Model):
+        state.update(agent_columns(sim.HaresPopulation, HARE_SLOTS, 'hare'))
+        state.update(agent_columns(sim.LynxPopulation, LYNX_SLOTS, 'lynx'))
+        state['lynxEathistory'] = np.array([list(l.eathistory) for l in sim.LynxPopulation],
+                                           dtype=np.uint8).reshape(-1, 14)
+        state['Mountains'] = np.array([m.position for m in sim.Mountains], dtype=int).reshape(-1, 2)
+        state['Forests'] = np.array([f.position for f in sim.Forests], dtype=int).reshape(-1, 2)
+
+    state['meta'] = np.array(json.dumps(meta))
+    return state
+
+
+def agent_columns(agents, slots, prefix):
+    """
+    The positions and the attributes in slots of a list of agents as arrays.
+    """
+    columns = {prefix + 'Position': np.array([a.position for a in agents], dtype=int).reshape(-1, 2)}
+    for name in slots:
+        columns[prefix + '_' + name] = np.array([getattr(a, name, DEFAULTS.get(name)) for a in agents])
+    return columns
+
+
+def from_state(state):
+    """
+    Makes the model with the given state again, without running its constructor.
+    The restored model is not profiled.
+    """
+    meta = json.loads(str(state['meta']))
+    cls = MODELS[meta['model']]
+    sim = cls.__new__(cls)
+    for name, value in meta['attributes'].items():
+        setattr(sim, name, value)
+    sim.rng = np.random.Generator(getattr(np.random, meta['rng']['bit_generator'])())
+    sim.rng.bit_generator.state = meta['rng']
+    sim.profiler = None
+
+    for name in meta['arrays']:
+        setattr(sim, name, np.array(state[name]))
+
+    if cls is simulation.Model:
+        sim.harePool = []
+        sim.lynxPool = []
+        sim.HaresPopulation = make_agents(sim, simulation.Hare, state, HARE_SLOTS, 'hare')
+        sim.LynxPopulation = make_agents(sim, simulation.Lynx, state, LYNX_SLOTS, 'lynx')
+        for l, history in zip(sim.LynxPopulation, state['lynxEathistory']):
+            l.eathistory = bytearray(history.tobytes())
+        sim.Mountains = [simulation.Mountain(x, y) for x, y in state['Mountains'].tolist()]
+        sim.Forests = [simulation.Forest(x, y) for x, y in state['Forests'].tolist()]
+    sim.hareGrid = simulation_vectorized.PeriodicGrid(sim.width, sim.height, cellSize=10)
+    return sim
+
+
+def make_agents(sim, cls, state, slots, prefix):
+    """
+    The agents of class cls with the positions and attributes stored by agent_columns,
+    the first attribute in slots is the state passed to the constructor.
+    """
+    agents = []
+    columns = [state[prefix + '_' + name].tolist() for name in slots]
+    for i, (x, y) in enumerate(state[prefix + 'Position'].tolist()):
+        agent = cls(x, y, columns[0][i], sim)
+        for name, column in zip(slots[1:], columns[1:]):
+            setattr(agent, name, column[i])
+        agents.append(agent)
+    return agents
+
+
+def save(sim, fileName):
+    """
+    Writes a compressed checkpoint of the model to fileName, a .npz file.
+    """
+    np.savez_compressed(fileName, **get_state(sim))
+
+
+def load(fileName):
+    """
+    The model saved in fileName, ready to continue the run.
+    """
+    with np.load(fileName) as data:
+        return from_state({name: data[name] for name in data.files})
+
+
+def set_parameters(sim, **params):
+    """
+    Changes parameters of a model, named like the constructor arguments. Changing
+    killProb also recomputes the kill probability of every cell.
+    """
+    for name, value in params.items():
+        if name not in PARAMETERS:
+            raise ValueError(f'The parameter {name} can not be changed during a run')
+        setattr(sim, PARAMETERS[name], value)
+
+    if 'killProb' in params:
+        counts = getattr(sim, 'forestCount', np.zeros((sim.width, sim.height)))
+        sim.killProbField = terrain.kill_probability_field(counts, sim.killProb)
+        if isinstance(sim, simulation.Model):
+            for l in sim.LynxPopulation:
+                l.killProb = sim.killProb
+
+
+def fork(sim, paramSets, seed=None):
+    """
+    Copies of the model, one per dict of changed parameters in paramSets, so runs
+    that share a burn-in only simulate it once. Without seed every copy continues
+    with the same random numbers as the original, so they only differ in their
+    parameters. With seed copy k gets the k-th generator spawned from seed.
+    """
+    state = get_state(sim)
+    seeds = [None] * len(paramSets) if seed is None else np.random.SeedSequence(seed).spawn(len(paramSets))
+    children = []
+    for params, s in zip(paramSets, seeds):
+        child = from_state(state)
+        set_parameters(child, **params)
+        if s is not None:
+            child.rng = np.random.default_rng(s)
+        children.append(child)
+    return children
@@ -0,0 +1,155 @@
+from collections import deque
+import numpy as np
+
+import ensemble
+
+"""
+The events PeakTracker.add reports.
+"""
+PEAK = 'peak'
+TROUGH = 'trough'
+
+"""
+The statistics in CycleDetector.summary, periods and the phase lag in timesteps.
+"""
+CYCLE_STATS = ('haresPeriod', 'lynxPeriod', 'haresAmplitude', 'lynxAmplitude', 'phaseLag', 'haresPeaks', 'lynxPeaks',
+               'meanHares', 'meanLynx')
+
+
+class PeakTracker:
+    def __init__(self, delta=0.25, minDelta=0, keep=5):
+        """
+        Streaming peak and trough detection of one population with hysteresis: the
+        highest value since the last trough is confirmed as a peak once the population
+        fell delta times that value below it, but at least minDelta, and a trough
+        likewise once it rose that much above the lowest value since the last peak.
+        So a peak is known some timesteps after it happened. The first turn only sets
+        the direction and is not counted. Only the current extremes, the running mean
+        and variance of the period and the amplitude and the keep most recent peaks
+        are kept, whatever the length of the run.
+        """
+        self.delta = delta
+        self.minDelta = minDelta
+        self.keep = keep
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets all values, peaks and troughs, for a new run.
+        """
+        self.direction = 0
+        self.high = self.low = None
+        self.highTime = self.lowTime = None
+        self.lastPeak = self.lastTrough = None
+        self.peaks = 0
+        self.troughs = 0
+        self.period = ensemble.RunningStats()
+        self.amplitude = ensemble.RunningStats()
+        """
+        (time, population, period, amplitude) of the most recent peaks, period and
+        amplitude are nan while there is no earlier peak or trough.
+        """
+        self.recent = deque(maxlen=self.keep)
+
+    def threshold(self):
+        """
+        The change that confirms a turn: delta times the highest value, at least minDelta.
+        """
+        return max(self.delta * self.high, self.minDelta)
+
+    def add(self, t, x):
+        """
+        Adds the population x of timestep t, returns PEAK or TROUGH when one was
+        confirmed by it, otherwise None.
+        """
+        if self.high is None:
+            self.high = self.low = x
+            self.highTime = self.lowTime = t
+            return None
+        if self.direction >= 0 and x > self.high:
+            self.high, self.highTime = x, t
+        if self.direction <= 0 and x < self.low:
+            self.low, self.lowTime = x, t
+
+        event = None
+        if self.direction >= 0 and x <= self.high - self.threshold():
+            if self.direction:
+                self.add_peak()
+                event = PEAK
+            self.direction = -1
+            self.low, self.lowTime = x, t
+        elif self.direction <= 0 and x >= self.low + self.threshold():
+            if self.direction:
+                self.troughs += 1
+                self.lastTrough = (self.lowTime, self.low)
+                event = TROUGH
+            self.direction = 1
+            self.high, self.highTime = x, t
+        return event
+
+    def add_peak(self):
+        period = amplitude = np.nan
+        if self.lastPeak is not None:
+            period = self.highTime - self.lastPeak[0]
+            self.period.add(period)
+        if self.lastTrough is not None:
+            amplitude = (self.high - self.lastTrough[1]) / 2
+            self.amplitude.add(amplitude)
+        self.peaks += 1
+        self.lastPeak = (self.highTime, self.high)
+        self.recent.append((self.highTime, self.high, period, amplitude))
+
+
+class CycleDetector:
+    def __init__(self, delta=0.25, haresMinDelta=100, lynxMinDelta=3, keep=5):
+        """
+        Follows the lynx and hare populations during a run with a PeakTracker each and
+        estimates the cycle period and amplitude of both, and the phase lag: the
+        timesteps from a hare peak to the next lynx peak, next to the mean populations.
+        The estimates are available at any time while the run goes on, in constant
+        memory.
+        """
+        self.hares = PeakTracker(delta, haresMinDelta, keep)
+        self.lynx = PeakTracker(delta, lynxMinDelta, keep)
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the peaks, the phase lags and the means of both species, for a new run.
+        """
+        self.hares.reset()
+        self.lynx.reset()
+        self.phaseLag = ensemble.RunningStats()
+        self.lastPhaseLag = np.nan
+        self.steps = 0
+        self.sumLynx = 0
+        self.sumHares = 0
+
+    def add(self, t, nLynx, nHares):
+        """
+        Adds the populations of timestep t, returns the events of the hares and the
+        lynx, see PeakTracker.add.
+        """
+        self.steps += 1
+        self.sumLynx += nLynx
+        self.sumHares += nHares
+        haresEvent = self.hares.add(t, nHares)
+        lynxEvent = self.lynx.add(t, nLynx)
+        if lynxEvent == PEAK and self.hares.lastPeak is not None and self.lynx.lastPeak[0] >= self.hares.lastPeak[0]:
+            self.lastPhaseLag = self.lynx.lastPeak[0] - self.hares.lastPeak[0]
+            self.phaseLag.add(self.lastPhaseLag)
+        return haresEvent, lynxEvent
+
+    def summary(self):
+        """
+        The mean periods, amplitudes and phase lag so far, nan when not seen yet, the
+        number of peaks and the mean populations, as a dict with the keys CYCLE_STATS.
+        """
+        def mean(stats):
+            return float(stats.mean) if stats.count else np.nan
+
+        return {'haresPeriod': mean(self.hares.period), 'lynxPeriod': mean(self.lynx.period),
+                'haresAmplitude': mean(self.hares.amplitude), 'lynxAmplitude': mean(self.lynx.amplitude),
+                'phaseLag': mean(self.phaseLag), 'haresPeaks': self.hares.peaks, 'lynxPeaks': self.lynx.peaks,
+                'meanHares': float(self.sumHares / self.steps) if self.steps else np.nan,
+                'meanLynx': float(self.sumLynx / self.steps) if self.steps else np.nan}
@@ -0,0 +1,320 @@
+import os
+import functools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from scipy.stats import norm
+
+import sweep
+import cycles as cycle_detection
+
+
+class RunningStats:
+    def __init__(self, shape=()):
+        """
+        Mean and variance of a stream of arrays with Welford's online algorithm,
+        element wise, so only the count, the mean and the sum of squared deviations
+        are kept in memory.
+        """
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def add(self, x):
+        """
+        Adds one observation.
+        """
+        self.count += 1
+        delta = x - self.mean
+        self.mean = self.mean + delta / self.count
+        self.m2 = self.m2 + delta * (x - self.mean)
+
+    @property
+    def variance(self):
+        """
+        The sample variance, nan with fewer than two observations.
+        """
+        if self.count < 2:
+            return np.full(np.shape(self.mean), np.nan)
+        return self.m2 / (self.count - 1)
+
+
+class P2Quantile:
+    def __init__(self, p, shape=()):
+        """
+        Streaming estimate of the p-quantile with the P-square algorithm of Jain and
+        Chlamtac (1985), element wise. Five markers per element are kept, whatever the
+        number of observations.
+        """
+        self.p = p
+        self.count = 0
+        self.first = []
+        self.heights = np.zeros(shape + (5,))
+        self.positions = np.tile(np.arange(5.0), shape + (1,))
+        self.desired = np.tile(np.array([0, 2 * p, 4 * p, 2 + 2 * p, 4]), shape + (1,))
+        self.increments = np.array([0, p / 2, p, (1 + p) / 2, 1])
+
+    def add(self, x):
+        """
+        Adds one observation.
+        """
+        x = np.asarray(x, dtype=float)
+        self.count += 1
+        if self.count <= 5:
+            """
+            The markers start at the first five observations.
+            """
+            self.first.append(x)
+            if self.count == 5:
+                self.heights = np.sort(np.stack(self.first, axis=-1), axis=-1)
+                self.first = []
+            return
+
+        q = self.heights
+        n = self.positions
+        q[..., 0] = np.minimum(q[..., 0], x)
+        q[..., 4] = np.maximum(q[..., 4], x)
+        k = np.sum(x[..., None] >= q[..., 1:4], axis=-1)
+        n += np.arange(5) > k[..., None]
+        self.desired += self.increments
+
+        for i in (1, 2, 3):
+            d = self.desired[..., i] - n[..., i]
+            move = ((d >= 1) & (n[..., i + 1] - n[..., i] > 1)) | ((d <= -1) & (n[..., i - 1] - n[..., i] < -1))
+            d = np.where(move, np.sign(d), 0.0)
+
+            """
+            Try the piecewise parabolic prediction, fall back to linear when it would
+            leave the neighbouring markers.
+            """
+            with np.errstate(divide='ignore', invalid='ignore'):
+                parabolic = q[..., i] + d / (n[..., i + 1] - n[..., i - 1]) * (
+                    (n[..., i] - n[..., i - 1] + d) * (q[..., i + 1] - q[..., i]) / (n[..., i + 1] - n[..., i])
+                    + (n[..., i + 1] - n[..., i] - d) * (q[..., i] - q[..., i - 1]) / (n[..., i] - n[..., i - 1]))
+                neighbour = np.where(d > 0, i + 1, i - 1)
+                qn = np.take_along_axis(q, neighbour[..., None], axis=-1)[..., 0]
+                nn = np.take_along_axis(n, neighbour[..., None], axis=-1)[..., 0]
+                linear = q[..., i] + d * (qn - q[..., i]) / (nn - n[..., i])
+            inside = (q[..., i - 1] < parabolic) & (parabolic < q[..., i + 1])
+            q[..., i] = np.where(move, np.where(inside, parabolic, linear), q[..., i])
+            n[..., i] += d
+
+    @property
+    def value(self):
+        """
+        The current estimate, exact while there are fewer than five observations.
+        """
+        if self.count == 0:
+            return np.full(self.heights.shape[:-1], np.nan)
+        if self.count < 5:
+            return np.quantile(np.stack(self.first, axis=-1), self.p, axis=-1)
+        return self.heights[..., 2].copy()
+
+
+"""
+Statistics of one replicate that can be used as the target of the sequential stopping.
+"""
+TARGETS = {
+    'meanLynx': lambda LynxAmount, HaresAmount: np.mean(LynxAmount),
+    'meanHares': lambda LynxAmount, HaresAmount: np.mean(HaresAmount),
+    'lynxExtinction': lambda LynxAmount, HaresAmount: float(LynxAmount[-1] == 0),
+    'haresExtinction': lambda LynxAmount, HaresAmount: float(HaresAmount[-1] == 0),
+}
+
+"""
+The TARGETS that are 0 or 1 per replicate, their mean is a proportion.
+"""
+PROPORTIONS = ('lynxExtinction', 'haresExtinction')
+
+
+class Ensemble:
+    def __init__(self, timeSteps, quantiles=(0.05, 0.5, 0.95), target='meanLynx', confidence=0.95):
+        """
+        The aggregated result of the replicates of one configuration: the mean, the
+        variance and the quantiles of the lynx and hare population at every timestep,
+        and the running mean of the target statistic with its confidence interval.
+        Replicates are added one at a time and not kept.
+        """
+        self.timeSteps = timeSteps
+        self.quantiles = tuple(quantiles)
+        self.target = TARGETS[target] if isinstance(target, str) else target
+        self.proportion = target in PROPORTIONS
+        self.confidence = confidence
+        self.lynx = RunningStats((timeSteps,))
+        self.hares = RunningStats((timeSteps,))
+        self.lynxQuantiles = [P2Quantile(p, (timeSteps,)) for p in self.quantiles]
+        self.haresQuantiles = [P2Quantile(p, (timeSteps,)) for p in self.quantiles]
+        self.targetStats = RunningStats()
+
+    def add(self, LynxAmount, HaresAmount):
+        """
+        Folds the populations of one replicate into the statistics.
+        """
+        self.lynx.add(LynxAmount)
+        self.hares.add(HaresAmount)
+        for estimate in self.lynxQuantiles:
+            estimate.add(LynxAmount)
+        for estimate in self.haresQuantiles:
+            estimate.add(HaresAmount)
+        self.targetStats.add(self.target(LynxAmount, HaresAmount))
+
+    @property
+    def replicates(self):
+        return self.lynx.count
+
+    @property
+    def quantilesLynx(self):
+        """
+        Array of shape (len(quantiles), timeSteps).
+        """
+        return np.array([estimate.value for estimate in self.lynxQuantiles])
+
+    @property
+    def quantilesHares(self):
+        return np.array([estimate.value for estimate in self.haresQuantiles])
+
+    @property
+    def targetMean(self):
+        return float(self.targetStats.mean)
+
+    @property
+    def targetInterval(self):
+        return confidence_interval(self.targetStats, self.confidence, self.proportion)
+
+
+class CycleEnsemble:
+    def __init__(self, target='haresPeriod', confidence=0.95):
+        """
+        The aggregated cycle statistics of the replicates of one configuration, see
+        cycles.CycleDetector.summary: the running mean and variance of every statistic
+        in cycles.CYCLE_STATS, over the replicates in which it was seen, and how often
+        the runs stopped for every reason. target is the statistic of the sequential
+        stopping. No populations are kept at all.
+        """
+        self.target = target
+        self.confidence = confidence
+        self.stats = {name: RunningStats() for name in cycle_detection.CYCLE_STATS}
+        self.reasons = {}
+        self.replicates = 0
+
+    def add(self, summary):
+        """
+        Folds the summary of one replicate into the statistics.
+        """
+        self.replicates += 1
+        for name, stats in self.stats.items():
+            if not np.isnan(summary[name]):
+                stats.add(summary[name])
+        self.reasons[summary['reason']] = self.reasons.get(summary['reason'], 0) + 1
+
+    @property
+    def targetStats(self):
+        return self.stats[self.target]
+
+    @property
+    def targetMean(self):
+        return float(self.targetStats.mean) if self.targetStats.count else np.nan
+
+    @property
+    def targetInterval(self):
+        return confidence_interval(self.targetStats, self.confidence)
+
+
+def confidence_interval(stats, confidence, proportion=False):
+    """
+    Normal approximation confidence interval of the mean of the RunningStats stats.
+    With proportion the observations are 0 or 1 and the Wilson score interval is
+    used, which does not shrink to zero width while all of them are the same.
+    """
+    if stats.count < 2:
+        return (-np.inf, np.inf)
+    z = norm.ppf((1 + confidence) / 2)
+    if proportion:
+        n = stats.count
+        p = float(stats.mean)
+        center = (p + z**2 / (2 * n)) / (1 + z**2 / n)
+        halfWidth = z / (1 + z**2 / n) * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2))
+        return (float(center - halfWidth), float(center + halfWidth))
+    halfWidth = z * np.sqrt(stats.variance / stats.count)
+    return (float(stats.mean) - halfWidth, float(stats.mean) + halfWidth)
+
+
+def run_ensemble(params, timeSteps, maxReplicates=100, seed=1, processes=None, target=None,
+                 width=None, confidence=0.95, minReplicates=10, quantiles=(0.05, 0.5, 0.95),
+                 vectorized=True, callback=None, cycles=False, stopping=None):
+    """
+    Runs replicates of one configuration (a dict of Model constructor arguments) over
+    a pool of worker processes and aggregates them online into an Ensemble.
+    Replicate i always gets the i-th seed spawned from seed and the replicates are
+    added in that order, so the result does not depend on the number of processes.
+    When width is given no new replicates are started once the confidence interval on
+    the target statistic is narrower than width (after at least minReplicates); the
+    extinction targets use the Wilson interval, see confidence_interval.
+    target is a name from TARGETS or a function of (LynxAmount, HaresAmount),
+    'meanLynx' by default.
+    callback, when given, is called with the Ensemble after every added replicate.
+    With cycles the replicates keep only their cycle statistics, see sweep.run_cycles,
+    and may stop early on the stopping.StoppingRule stopping. The result is then a
+    CycleEnsemble and target a name from cycles.CYCLE_STATS, 'haresPeriod' by default.
+    """
+    if cycles:
+        ensemble = CycleEnsemble(target or 'haresPeriod', confidence)
+        run = functools.partial(sweep.run_cycles, stopping=stopping)
+    else:
+        ensemble = Ensemble(timeSteps, quantiles, target or 'meanLynx', confidence)
+        run = sweep.run_single
+    seeds = sweep.spawn_seeds(seed, maxReplicates)
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    def converged():
+        if width is None or ensemble.replicates < minReplicates:
+            return False
+        low, high = ensemble.targetInterval
+        return high - low < width
+
+    def add(result):
+        if cycles:
+            ensemble.add(result)
+        else:
+            ensemble.add(*result)
+        if callback is not None:
+            callback(ensemble)
+
+    if processes == 1:
+        for s in seeds:
+            add(run(params, timeSteps, s, vectorized))
+            if converged():
+                break
+        return ensemble
+
+    """
+    Keep a few replicates per worker in flight. Finished replicates wait in done until
+    all replicates before them are added.
+    """
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        running = {}
+        done = {}
+        started = 0
+        added = 0
+        while added < maxReplicates and not converged():
+            while started < maxReplicates and len(running) < 2 * processes:
+                future = pool.submit(run, params, timeSteps, seeds[started], vectorized)
+                running[future] = started
+                started += 1
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                done[running.pop(future)] = future.result()
+            while added in done and not converged():
+                add(done.pop(added))
+                added += 1
+        for future in running:
+            future.cancel()
+
+    return ensemble
+
+
+def run_ensembles(paramSets, timeSteps, **kwargs):
+    """
+    run_ensemble for every configuration in paramSets, returns a list of Ensembles.
+    """
+    return [run_ensemble(params, timeSteps, **kwargs) for params in paramSets]
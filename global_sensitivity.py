@@ -0,0 +1,214 @@
+import numpy as np
+from scipy.stats import qmc
+
+import sweep
+import stopping
+
+"""
+The numeric Model arguments that are varied, with their ranges, and the ones that
+are rounded to whole numbers. The forests and the mountains only count with forestOn
+and mountainOn, so they are switched on by default, see FIXED.
+"""
+PARAMETERS = {'killProb': (0.2, 0.6), 'breedProbHares': (0.03, 0.07), 'breedProbLynx': (0.01, 0.03),
+              'maximumHares': (5000, 10000), 'maximumLynx': (15, 40), 'forestDensityRange': (2, 8),
+              'nForest': (100, 400), 'nMountains': (5, 20), 'nHares': (1000, 3000), 'nLynx': (3, 10)}
+INTEGER = ('maximumHares', 'maximumLynx', 'forestDensityRange', 'nForest', 'nMountains', 'nHares', 'nLynx')
+FIXED = {'mountainOn': True, 'forestOn': True}
+
+"""
+The outputs of every run that are analysed, keys of the cycles.CycleDetector summary.
+"""
+OUTPUTS = ('meanLynx', 'meanHares', 'haresPeriod', 'lynxPeriod')
+
+
+def scale(X, parameters):
+    """
+    The parameter sets of the points X in the unit cube, as a list of dicts.
+    """
+    names = list(parameters)
+    low = np.array([parameters[name][0] for name in names], dtype=float)
+    high = np.array([parameters[name][1] for name in names], dtype=float)
+    values = low + X * (high - low)
+    return [{name: int(round(v)) if name in INTEGER else float(v) for name, v in zip(names, row)} for row in values]
+
+
+def evaluate(X, parameters, timeSteps, seed, processes, vectorized, fixed, outputs, cache):
+    """
+    Runs the model for every point of X, see sweep.run_cycle_sweep, without stopping
+    on extinction so every run has timeSteps timesteps. Every run gets its own seed
+    spawned from seed. Returns an array of every output, nan where it was not seen.
+    """
+    paramSets = [dict(fixed, **params) for params in scale(X, parameters)]
+    summaries = sweep.run_cycle_sweep(paramSets, timeSteps, seed, processes, vectorized,
+                                      stopping.StoppingRule(extinction=False), cache)
+    return {output: np.array([summary[output] for summary in summaries], dtype=float) for output in outputs}
+
+
+def saltelli_sample(d, n, seed=1):
+    """
+    The matrices A and B of n points in the d dimensional unit cube, the two halves of
+    a scrambled Sobol sequence in 2d dimensions, and the d matrices AB with column i
+    of A replaced by that of B. n is best a power of two.
+    """
+    sampler = qmc.Sobol(2 * d, scramble=True, seed=seed)
+    points = sampler.random_base2(int(np.log2(n))) if n & (n - 1) == 0 else sampler.random(n)
+    A = points[:, :d]
+    B = points[:, d:]
+    AB = np.repeat(A[None], d, axis=0)
+    for i in range(d):
+        AB[i, :, i] = B[:, i]
+    return A, B, AB
+
+
+def sobol_indices(fA, fB, fAB, bootstrap=1000, confidence=0.95, seed=1):
+    """
+    First order indices S1 with the estimator of Saltelli et al. (2010) and total
+    indices ST with that of Jansen (1999), from the outputs fA, fB of length n and fAB
+    of shape (d, n). Rows with a nan output are left out. The confidence intervals
+    come from bootstrap resamples of the rows, so no runs are repeated.
+    Returns a dict with S1, ST and their intervals S1Interval, STInterval of shape (d, 2).
+    """
+    keep = np.isfinite(fA) & np.isfinite(fB) & np.isfinite(fAB).all(axis=0)
+    fA, fB, fAB = fA[keep], fB[keep], fAB[:, keep]
+    d = fAB.shape[0]
+    if fA.size < 2:
+        return {'S1': np.full(d, np.nan), 'ST': np.full(d, np.nan), 'S1Interval': np.full((d, 2), np.nan),
+                'STInterval': np.full((d, 2), np.nan), 'runs': int(keep.sum())}
+
+    def indices(rows):
+        a = fA[..., rows]
+        b = fB[..., rows]
+        ab = fAB[:, rows]
+        variance = np.var(np.concatenate([a, b], axis=-1), axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            S1 = np.mean(b * (ab - a), axis=-1) / variance
+            ST = 0.5 * np.mean((a - ab) ** 2, axis=-1) / variance
+        return S1, ST
+
+    n = fA.size
+    S1, ST = indices(np.arange(n))
+    rows = np.random.default_rng(seed).integers(n, size=(bootstrap, n))
+    """
+    Indexing with the (bootstrap, n) rows gives every resample at once, the index
+    axis of fAB moves to the front.
+    """
+    S1s, STs = indices(rows)
+    tails = [(1 - confidence) / 2, (1 + confidence) / 2]
+    return {'S1': S1, 'ST': ST, 'S1Interval': np.nanquantile(S1s, tails, axis=-1).T,
+            'STInterval': np.nanquantile(STs, tails, axis=-1).T, 'runs': int(keep.sum())}
+
+
+def run_sobol(n=64, timeSteps=2450, parameters=PARAMETERS, outputs=OUTPUTS, seed=1, processes=None, vectorized=True,
+              fixed=FIXED, bootstrap=1000, confidence=0.95, cache=None):
+    """
+    Sobol sensitivity analysis with Saltelli sampling of the parameters over their
+    ranges, n * (len(parameters) + 2) runs spread over processes worker processes.
+    The sample and the seeds of the runs only depend on seed. fixed holds other Model
+    arguments of all runs, cache an optional runcache.RunCache.
+    Returns a dict with the parameter names, the outputs of the runs as fA, fB and fAB,
+    from which sobol_indices can compute the indices again with other bootstrap
+    settings, and for every output its indices, see sobol_indices.
+    """
+    names = list(parameters)
+    A, B, AB = saltelli_sample(len(names), n, seed)
+    X = np.vstack([A, B, AB.reshape(-1, len(names))])
+    Y = evaluate(X, parameters, timeSteps, seed, processes, vectorized, fixed, outputs, cache)
+
+    result = {'names': names, 'fA': {}, 'fB': {}, 'fAB': {}, 'indices': {}}
+    for output in outputs:
+        result['fA'][output] = Y[output][:n]
+        result['fB'][output] = Y[output][n:2 * n]
+        result['fAB'][output] = Y[output][2 * n:].reshape(len(names), n)
+        result['indices'][output] = sobol_indices(result['fA'][output], result['fB'][output],
+                                                  result['fAB'][output], bootstrap, confidence, seed)
+    return result
+
+
+def morris_sample(d, r, levels=4, seed=1):
+    """
+    r trajectories of Morris (1991) through a grid of levels values per dimension of
+    the unit cube, shape (r, d + 1, d). Every trajectory changes one parameter at a
+    time by levels / (2 * (levels - 1)), in a random order and direction.
+    """
+    rng = np.random.default_rng(seed)
+    step = levels / (2 * (levels - 1))
+    starts = rng.integers(0, levels // 2, size=(r, d)) / (levels - 1)
+    trajectories = np.empty((r, d + 1, d))
+    for k in range(r):
+        x = np.where(rng.random(d) < 0.5, starts[k], starts[k] + step)
+        trajectories[k, 0] = x
+        for j, i in enumerate(rng.permutation(d)):
+            x = x.copy()
+            x[i] = x[i] + step if x[i] + step <= 1 else x[i] - step
+            trajectories[k, j + 1] = x
+    return trajectories
+
+
+def morris_indices(trajectories, f, bootstrap=1000, confidence=0.95, seed=1):
+    """
+    The elementary effects of every trajectory, with f the outputs of shape
+    (r, d + 1), and their mean mu, the mean of the absolute effects muStar and the
+    standard deviation sigma per parameter. The interval of muStar comes from
+    bootstrap resamples of the trajectories. Trajectories with a nan output are left
+    out. Returns a dict of arrays of length d and muStarInterval of shape (d, 2).
+    """
+    keep = np.isfinite(f).all(axis=1)
+    trajectories, f = trajectories[keep], f[keep]
+    r, _, d = trajectories.shape
+    if r == 0:
+        return {'mu': np.full(d, np.nan), 'muStar': np.full(d, np.nan), 'sigma': np.full(d, np.nan),
+                'muStarInterval': np.full((d, 2), np.nan), 'runs': 0}
+    moves = np.diff(trajectories, axis=1)
+    changed = np.argmax(np.abs(moves), axis=2)
+    effects = np.empty((r, d))
+    for k in range(r):
+        effects[k, changed[k]] = np.diff(f[k]) / moves[k, np.arange(d), changed[k]]
+
+    rows = np.random.default_rng(seed).integers(r, size=(bootstrap, r))
+    tails = [(1 - confidence) / 2, (1 + confidence) / 2]
+    return {'mu': effects.mean(axis=0), 'muStar': np.abs(effects).mean(axis=0),
+            'sigma': effects.std(axis=0, ddof=1) if r > 1 else np.full(d, np.nan),
+            'muStarInterval': np.quantile(np.abs(effects)[rows].mean(axis=1), tails, axis=0).T, 'runs': r}
+
+
+def run_morris(r=20, levels=4, timeSteps=2450, parameters=PARAMETERS, outputs=OUTPUTS, seed=1, processes=None,
+               vectorized=True, fixed=FIXED, bootstrap=1000, confidence=0.95, cache=None):
+    """
+    Morris screening of the parameters with r trajectories, r * (len(parameters) + 1)
+    runs spread over processes worker processes, like run_sobol. The effects are per
+    unit of the range of a parameter. Returns a dict with the parameter names, the
+    trajectories, the outputs of the runs as f, of shape (r, len(parameters) + 1), and
+    for every output its indices, see morris_indices.
+    """
+    names = list(parameters)
+    trajectories = morris_sample(len(names), r, levels, seed)
+    Y = evaluate(trajectories.reshape(-1, len(names)), parameters, timeSteps, seed, processes, vectorized, fixed,
+                 outputs, cache)
+
+    result = {'names': names, 'trajectories': trajectories, 'f': {}, 'indices': {}}
+    for output in outputs:
+        result['f'][output] = Y[output].reshape(r, len(names) + 1)
+        result['indices'][output] = morris_indices(trajectories, result['f'][output], bootstrap, confidence, seed)
+    return result
+
+
+def report(result):
+    """
+    Prints the indices of a run_sobol or run_morris result as a table per output.
+    """
+    for output, indices in result['indices'].items():
+        print(f"{output} ({indices['runs']} runs)")
+        for i, name in enumerate(result['names']):
+            if 'S1' in indices:
+                (low1, high1), (lowT, highT) = indices['S1Interval'][i], indices['STInterval'][i]
+                print(f"  {name:<20} S1 {indices['S1'][i]:6.3f} [{low1:6.3f}, {high1:6.3f}]"
+                      f"  ST {indices['ST'][i]:6.3f} [{lowT:6.3f}, {highT:6.3f}]")
+            else:
+                low, high = indices['muStarInterval'][i]
+                print(f"  {name:<20} mu* {indices['muStar'][i]:10.3f} [{low:10.3f}, {high:10.3f}]"
+                      f"  mu {indices['mu'][i]:10.3f}  sigma {indices['sigma'][i]:10.3f}")
+
+
+if __name__ == '__main__':
+    report(run_morris())
+    report(run_sobol())
@@ -0,0 +1,147 @@
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+"""
+Loop kernels for the phases of simulation_vectorized.VectorizedModel that are
+sequential by nature: the hunt, where every lynx takes at most 3 hares and a hare
+can only be killed once, and the lynx movement with its direction kept for 7 steps.
+When Numba is installed the kernels are compiled to machine code, otherwise they
+stay plain Python functions. They give exactly the same results as the NumPy code
+paths of VectorizedModel, the random numbers are drawn by the model beforehand.
+"""
+COMPILED = numba is not None
+
+
+def jit(function):
+    """
+    Compiles function with Numba when it is available.
+    """
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+
+@jit
+def in_window(hareX, hareY, lynxX, lynxY, distance, width, height):
+    """
+    The hunt window of VectorizedModel.hunt: at most distance away along both axes,
+    measured the short way around the periodic grid.
+    """
+    dx = abs(hareX - lynxX)
+    dy = abs(hareY - lynxY)
+    return min(dx, width - dx) <= distance and min(dy, height - dy) <= distance
+
+
+@jit
+def cell_range(c, distance, size, cellSize, nCells):
+    """
+    The cells along one axis that overlap the coordinates c - distance up to
+    c + distance, wrapped around an axis of the given size, see
+    spatial_index.window_cells. They are the nCells cells (first + k) % nCells for k
+    up to count; returns first and count.
+    """
+    if 2 * distance + 1 >= size:
+        return 0, nCells
+    low = (c - distance) % size // cellSize
+    high = (c + distance) % size // cellSize
+    if (c - distance) % size <= (c + distance) % size:
+        return low, high - low + 1
+    if high >= low:
+        return 0, nCells
+    return low, nCells - low + high + 1
+
+
+@jit
+def window_hares(hareX, hareY, lynxX, lynxY, huntDistance, order, start, cellSize, nCellsX, nCellsY,
+                 width, height):
+    """
+    The hares in the hunt window of every lynx, found in the cells of the
+    spatial_index.PeriodicGrid with order and start built from hareX and hareY, so only
+    the candidate cells are visited. Returns the hare indices of all windows, every
+    window sorted, the offsets of the windows of the lynxes in it, so the number of kill
+    trials to draw is the length of the windows, and the number of distance tests.
+    """
+    windows = np.empty(max(hareX.size, 16), dtype=np.int64)
+    offsets = np.zeros(lynxX.size + 1, dtype=np.int64)
+    buffer = np.empty(hareX.size, dtype=np.int64)
+    total = 0
+    tested = 0
+    for i in range(lynxX.size):
+        n = 0
+        firstX, countX = cell_range(lynxX[i], huntDistance[i], width, cellSize, nCellsX)
+        firstY, countY = cell_range(lynxY[i], huntDistance[i], height, cellSize, nCellsY)
+        for kx in range(countX):
+            for ky in range(countY):
+                cell = (firstX + kx) % nCellsX * nCellsY + (firstY + ky) % nCellsY
+                for k in range(start[cell], start[cell + 1]):
+                    j = order[k]
+                    tested += 1
+                    if in_window(hareX[j], hareY[j], lynxX[i], lynxY[i], huntDistance[i], width, height):
+                        buffer[n] = j
+                        n += 1
+        buffer[:n].sort()
+        if total + n > windows.size:
+            grown = np.empty(max(2 * windows.size, total + n), dtype=np.int64)
+            grown[:total] = windows[:total]
+            windows = grown
+        windows[total:total + n] = buffer[:n]
+        total += n
+        offsets[i + 1] = total
+    return windows[:total], offsets, tested
+
+
+@jit
+def hunt(windows, offsets, killProbs, hungry, draws, alive, legacy):
+    """
+    Every lynx in turn tries to kill the hares of its window, see window_hares, in
+    array order, using draw k for hare k of the windows, until it ate 3 hares this
+    timestep. Killed hares are marked in alive and the kills are added to hungry.
+    With legacy the next living hare after every kill is skipped, see
+    simulation_vectorized.legacy_kills.
+    """
+    for i in range(offsets.size - 1):
+        appetite = max(3 - hungry[i], 0)
+        kills = 0
+        skipped = -1
+        for k in range(offsets[i], offsets[i + 1]):
+            j = windows[k]
+            if kills == appetite or not alive[j] or draws[k] > killProbs[i] or j == skipped:
+                continue
+            alive[j] = False
+            kills += 1
+            if legacy:
+                skipped = -1
+                for m in range(j + 1, alive.size):
+                    if alive[m]:
+                        skipped = m
+                        break
+        hungry[i] += kills
+
+
+@jit
+def move_lynx(lynxX, lynxY, xDirection, yDirection, speed, huntDistance, timeBorn, eaten7,
+              deltaX, deltaY, mountainMask, width, height):
+    """
+    Moves every lynx in place, see VectorizedModel.move_lynx for the rules.
+    """
+    for i in range(lynxX.size):
+        if eaten7[i] < 3 and timeBorn[i] > 20:
+            speed[i] = 1.25
+            huntDistance[i] = 10
+        else:
+            speed[i] = 1.0
+            huntDistance[i] = 5
+
+        if timeBorn[i] % 7 == 0:
+            xDirection[i] = deltaX[i]
+            yDirection[i] = deltaY[i]
+
+        if mountainMask[lynxX[i], lynxY[i]]:
+            speed[i] = 0.25
+
+        lynxX[i] = int(lynxX[i] + xDirection[i] * speed[i]) % width
+        lynxY[i] = int(lynxY[i] + yDirection[i] * speed[i]) % height
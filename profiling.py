@@ -0,0 +1,117 @@
+import time
+import numpy as np
+
+"""
+The phases of a timestep that are timed, in the order update runs them, and the
+counters that are kept. VectorizedModel removes the dead animals inside the hunt
+and the starvation, so its cleanup phase stays empty.
+"""
+PHASES = ('moveLynx', 'hunt', 'moveHares', 'breeding', 'starvation', 'cleanup')
+COUNTERS = ('distanceChecks', 'killsAttempted', 'kills', 'haresBorn', 'lynxBorn', 'lynxStarved')
+
+
+class Profiler:
+    def __init__(self, keepSteps=True):
+        """
+        Instrumentation of Model.update and VectorizedModel.update, made when the model
+        is created with profile=True. Every timestep gets the wall time of each phase
+        and the counters, which the model adds with count:
+            distanceChecks  lynx-hare pairs whose distance was tested
+            killsAttempted  kill trials of a lynx on a hare in its hunt window
+            kills           hares killed
+            haresBorn, lynxBorn, lynxStarved
+        together with the populations at the start of the step. With keepSteps the
+        record of every step is kept in steps, the totals are always kept.
+        """
+        self.keepSteps = keepSteps
+        self.steps = []
+        self.nSteps = 0
+        self.totalTimes = dict.fromkeys(PHASES, 0.0)
+        self.totalCounts = dict.fromkeys(COUNTERS, 0)
+
+    def start(self, nLynx, nHares):
+        """
+        Starts the record of a new timestep.
+        """
+        self.record = {'step': self.nSteps, 'nLynx': nLynx, 'nHares': nHares}
+        self.record.update(dict.fromkeys(PHASES, 0.0))
+        self.record.update(dict.fromkeys(COUNTERS, 0))
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        """
+        Adds the time since the previous lap, or the start, to phase.
+        """
+        now = time.perf_counter()
+        self.record[phase] += now - self.last
+        self.last = now
+
+    def count(self, counter, n):
+        self.record[counter] += n
+
+    def stop(self):
+        """
+        Ends the record of the timestep and adds it to the totals.
+        """
+        for phase in PHASES:
+            self.totalTimes[phase] += self.record[phase]
+        for counter in COUNTERS:
+            self.totalCounts[counter] += self.record[counter]
+        if self.keepSteps:
+            self.steps.append(self.record)
+        self.nSteps += 1
+
+    def table(self):
+        """
+        The kept step records as a dict of arrays, one entry per step.
+        """
+        names = ('step', 'nLynx', 'nHares') + PHASES + COUNTERS
+        return {name: np.array([record[name] for record in self.steps]) for name in names}
+
+    def summary(self):
+        """
+        The totals of the run: the time of every phase with its share of the total and
+        the mean per step, and the counters. When the steps are kept, scaling gives for
+        every phase the exponent b of a fit time ~ population^b over the steps, with
+        the lynx-hare pairs as population of the hunt and the number of animals for
+        the other phases.
+        """
+        total = sum(self.totalTimes.values())
+        summary = {'steps': self.nSteps, 'time': total, 'counts': dict(self.totalCounts), 'phases': {}}
+        for phase, t in self.totalTimes.items():
+            summary['phases'][phase] = {'time': t, 'share': t / total if total else 0.0,
+                                        'perStep': t / self.nSteps if self.nSteps else 0.0}
+
+        if len(self.steps) > 1:
+            data = self.table()
+            animals = data['nLynx'] + data['nHares']
+            pairs = data['nLynx'] * data['nHares']
+            summary['scaling'] = {phase: scaling_exponent(pairs if phase == 'hunt' else animals, data[phase])
+                                  for phase in PHASES}
+        return summary
+
+    def report(self):
+        """
+        Prints the summary as a table.
+        """
+        summary = self.summary()
+        print(f"{summary['steps']} steps in {summary['time']:.3f} s")
+        for phase, values in summary['phases'].items():
+            exponent = summary.get('scaling', {}).get(phase, np.nan)
+            print(f"  {phase:<12} {values['time']:9.3f} s {100 * values['share']:6.1f} %"
+                  f" {1000 * values['perStep']:9.3f} ms/step  scaling {exponent:5.2f}")
+        for counter, n in summary['counts'].items():
+            print(f"  {counter:<15} {n}")
+
+
+def scaling_exponent(size, times):
+    """
+    Slope of the least squares line through log(times) against log(size), nan when
+    the sizes do not vary.
+    """
+    keep = (size > 0) & (times > 0)
+    x = np.log(size[keep])
+    y = np.log(times[keep])
+    if x.size < 2 or np.ptp(x) == 0:
+        return np.nan
+    return float(np.polyfit(x, y, 1)[0])
@@ -0,0 +1,167 @@
+import os
+import numpy as np
+
+"""
+The columns every Recorder has, with their dtypes. The death counts are the running
+totals LynxDeathCount and HaresDeathCount of the model.
+"""
+COLUMNS = (('time', np.int64), ('lynx', np.int64), ('hares', np.int64),
+           ('lynxDeaths', np.int64), ('haresDeaths', np.int64))
+
+"""
+Size in bytes of the .npy header the Recorder writes, it is rewritten in place with
+the final length when the recorder is flushed.
+"""
+HEADER_SIZE = 128
+
+
+class Recorder:
+    def __init__(self, directory, chunkSize=4096, columns=COLUMNS):
+        """
+        Records one value per timestep for a number of columns, like the populations
+        and the death counts, into the directory. Every column is its own .npy file,
+        so it can be read back with np.load, memory mapped, without any parsing.
+        The values are kept in a buffer of chunkSize rows per column and appended to
+        the files whenever the buffer is full, so the memory used does not grow with
+        the number of timesteps.
+        columns are the (name, dtype) pairs to record, a subset of COLUMNS when the
+        rest is not available. More columns can be added with register before the
+        first row is recorded.
+        """
+        self.directory = directory
+        self.chunkSize = chunkSize
+        self.columns = {name: dtype for name, dtype in columns}
+        self.functions = {}
+        self.length = 0
+        self.buffered = 0
+        self.files = None
+
+    def register(self, name, function, dtype=np.float64):
+        """
+        Adds a column whose value every timestep is function(model), for example
+        recorder.register('meanSpeed', lambda sim: np.mean(sim.lynxSpeed)).
+        """
+        if self.files is not None:
+            raise ValueError('Columns have to be registered before the first row is recorded')
+        if name in self.columns:
+            raise ValueError(f'There already is a column {name}')
+        self.columns[name] = dtype
+        self.functions[name] = function
+
+    def open(self):
+        """
+        Creates the directory, the column files and the buffers.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.files = {}
+        self.buffers = {}
+        for name, dtype in self.columns.items():
+            self.files[name] = open(os.path.join(self.directory, name + '.npy'), 'wb')
+            write_header(self.files[name], dtype, 0)
+            self.buffers[name] = np.empty(self.chunkSize, dtype=dtype)
+
+    def record(self, t, sim, nLynx, nHares):
+        """
+        Records timestep t of the model sim, nLynx and nHares are the populations
+        returned by sim.update().
+        """
+        row = {'time': t, 'lynx': nLynx, 'hares': nHares,
+               'lynxDeaths': sim.LynxDeathCount, 'haresDeaths': sim.HaresDeathCount}
+        for name, function in self.functions.items():
+            row[name] = function(sim)
+        self.append(row)
+
+    def append(self, row):
+        """
+        Records one row, a dict with a value for every column.
+        """
+        if self.files is None:
+            self.open()
+        for name in self.columns:
+            self.buffers[name][self.buffered] = row[name]
+        self.buffered += 1
+        self.length += 1
+        if self.buffered == self.chunkSize:
+            self.write()
+
+    def extend(self, columns):
+        """
+        Records many rows at once, columns is a dict with an array of values for
+        every column. The arrays are written straight to the files.
+        """
+        if self.files is None:
+            self.open()
+        self.write()
+        for name, dtype in self.columns.items():
+            self.files[name].write(np.asarray(columns[name], dtype=dtype).tobytes())
+        self.length += len(columns['time'])
+
+    def write(self):
+        """
+        Appends the buffered rows to the column files.
+        """
+        for name in self.columns:
+            self.files[name].write(self.buffers[name][:self.buffered].tobytes())
+        self.buffered = 0
+
+    def flush(self):
+        """
+        Writes out the buffer and updates the headers, after which the files can be
+        read while recording goes on.
+        """
+        if self.files is None:
+            self.open()
+        self.write()
+        for name, file in self.files.items():
+            file.seek(0)
+            write_header(file, self.columns[name], self.length)
+            file.seek(0, os.SEEK_END)
+            file.flush()
+
+    def close(self):
+        self.flush()
+        for file in self.files.values():
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_header(file, dtype, length):
+    """
+    Writes a version 1.0 .npy header for a 1D array of length values, padded with
+    spaces to HEADER_SIZE bytes so it can be overwritten when the length changes.
+    """
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+        np.lib.format.dtype_to_descr(np.dtype(dtype)), length)
+    header = header.ljust(HEADER_SIZE - 10 - 1) + '\n'
+    file.write(b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1'))
+
+
+def load(directory, columns=None, mmap=True):
+    """
+    Reads the columns recorded in directory into a dict of arrays, memory mapped
+    unless mmap is False. columns defaults to all columns in the directory.
+    """
+    if columns is None:
+        columns = sorted(name[:-4] for name in os.listdir(directory) if name.endswith('.npy'))
+    return {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r' if mmap else None)
+            for name in columns}
+
+
+def export_csv(directory, fileName, columns=('time', 'lynx', 'hares'), chunkSize=65536):
+    """
+    Writes recorded columns to a comma separated file, one row per timestep, in
+    chunks so the columns never have to be in memory at once. The default columns
+    give the time, lynx, hares layout of the old simulation.csv.
+    """
+    data = load(directory, columns)
+    fmt = ['%d' if np.issubdtype(data[name].dtype, np.integer) else '%.18e' for name in columns]
+    length = len(data[columns[0]])
+    with open(fileName, 'w') as file:
+        for start in range(0, length, chunkSize):
+            block = np.column_stack([data[name][start:start + chunkSize] for name in columns])
+            np.savetxt(file, block, fmt=fmt, delimiter=',')
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import inspect
+import sqlite3
+import numpy as np
+
+import recorder
+import simulation
+
+"""
+The source files whose code decides the outcome of a run. A change to any of them
+changes the version, and the runs cached with another version are dropped.
+"""
+ENGINE_FILES = ('simulation.py', 'simulation_vectorized.py', 'terrain.py', 'spatial_index.py', 'kernels.py',
+                'stopping.py', 'cycles.py', 'ensemble.py', 'sweep.py', 'recorder.py')
+
+"""
+Model constructor arguments that do not change the outcome of a run.
+"""
+IGNORED = ('seed', 'profile', 'useKernels')
+
+"""
+The index columns that can be queried directly, next to the parameters.
+"""
+COLUMNS = ('engine', 'function', 'timeSteps')
+
+version = None
+
+
+def code_version():
+    """
+    A hash of the source of ENGINE_FILES, computed once per process.
+    """
+    global version
+    if version is None:
+        digest = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in ENGINE_FILES:
+            with open(os.path.join(directory, name), 'rb') as file:
+                digest.update(name.encode() + b'\0' + file.read())
+        version = digest.hexdigest()[:16]
+    return version
+
+
+def model_parameters(params):
+    """
+    All Model constructor arguments of a run, the defaults filled in for the ones
+    missing from params.
+    """
+    signature = inspect.signature(simulation.Model)
+    full = {name: p.default for name, p in signature.parameters.items() if name not in IGNORED}
+    full.update({name: value for name, value in params.items() if name not in IGNORED})
+    return {name: value.item() if isinstance(value, np.generic) else value for name, value in full.items()}
+
+
+def seed_description(seed):
+    """
+    A JSON description of an int or np.random.SeedSequence seed, None for seeds that
+    can not be described, like a Generator, whose runs are not cached.
+    """
+    if isinstance(seed, (int, np.integer)):
+        return int(seed)
+    if isinstance(seed, np.random.SeedSequence):
+        return {'entropy': seed.entropy, 'spawnKey': list(seed.spawn_key)}
+    return None
+
+
+class RunCache:
+    def __init__(self, directory='.runcache', maxBytes=2**30):
+        """
+        A cache of simulation runs on disk. Every run is keyed by a hash of the function
+        that made it, the engine, the code version (see code_version), all Model
+        parameters, the seed, the number of timesteps and any extra settings, like the
+        stopping rule. Its columns are stored with recorder.Recorder in a directory of
+        its own, next to a meta.json, and an SQLite index records the parameters of
+        every run, see query. When the cached runs take more than maxBytes, the least
+        recently used ones are removed, also when the cache is opened. Runs of an older
+        code version are removed when the cache is opened.
+        """
+        self.directory = directory
+        self.maxBytes = maxBytes
+        os.makedirs(os.path.join(directory, 'runs'), exist_ok=True)
+        self.index = sqlite3.connect(os.path.join(directory, 'index.sqlite'))
+        self.index.execute('CREATE TABLE IF NOT EXISTS runs (key TEXT PRIMARY KEY, version TEXT, engine TEXT, '
+                           'function TEXT, seed TEXT, timeSteps INTEGER, params TEXT, extra TEXT, '
+                           'size INTEGER, created REAL, lastUsed REAL)')
+        self.index.commit()
+        stale = [key for key, in self.index.execute('SELECT key FROM runs WHERE version != ?', (code_version(),))]
+        self.remove(stale)
+        self.evict()
+
+    def key(self, params, seed, timeSteps, vectorized=True, function='run_single', extra=None):
+        """
+        The key of a run and its description for the index, the key is None when the
+        seed can not be described.
+        """
+        description = {'function': function, 'engine': 'VectorizedModel' if vectorized else 'Model',
+                       'version': code_version(), 'params': model_parameters(params),
+                       'seed': seed_description(seed), 'timeSteps': timeSteps, 'extra': extra or {}}
+        if description['seed'] is None:
+            return None, description
+        key = hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+        return key, description
+
+    def path(self, key):
+        return os.path.join(self.directory, 'runs', key)
+
+    def get(self, key):
+        """
+        The columns of the run as a dict of arrays and its meta dict, or None when the
+        run is not cached.
+        """
+        if key is None or not self.index.execute('SELECT 1 FROM runs WHERE key = ?', (key,)).fetchone():
+            return None
+        path = self.path(key)
+        try:
+            with open(os.path.join(path, 'meta.json')) as file:
+                meta = json.load(file)
+            columns = recorder.load(path, meta['columns'], mmap=False) if meta['columns'] else {}
+        except (OSError, ValueError, KeyError):
+            self.remove([key])
+            return None
+        self.index.execute('UPDATE runs SET lastUsed = ? WHERE key = ?', (time.time(), key))
+        self.index.commit()
+        return columns, meta['meta']
+
+    def put(self, key, description, columns=None, meta=None, directory=None):
+        """
+        Stores a run under key: the dict of arrays columns, or the recorder directory
+        directory, together with the JSON serializable dict meta.
+        """
+        if key is None:
+            return
+        path = self.path(key)
+        shutil.rmtree(path, ignore_errors=True)
+        if directory is not None:
+            shutil.copytree(directory, path)
+            names = sorted(name[:-4] for name in os.listdir(path) if name.endswith('.npy'))
+        else:
+            columns = columns or {}
+            os.makedirs(path)
+            if columns:
+                with recorder.Recorder(path, columns=[(name, np.asarray(values).dtype)
+                                                      for name, values in columns.items()]) as rec:
+                    rec.extend(columns)
+            names = list(columns)
+        with open(os.path.join(path, 'meta.json'), 'w') as file:
+            json.dump({'columns': names, 'meta': meta or {}}, file)
+
+        size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        now = time.time()
+        self.index.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           (key, description['version'], description['engine'], description['function'],
+                            json.dumps(description['seed']), description['timeSteps'],
+                            json.dumps(description['params']), json.dumps(description['extra']), size, now, now))
+        self.index.commit()
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used runs until the cache is within maxBytes.
+        """
+        total = self.index.execute('SELECT COALESCE(SUM(size), 0) FROM runs').fetchone()[0]
+        remove = []
+        for key, size in self.index.execute('SELECT key, size FROM runs ORDER BY lastUsed'):
+            if total <= self.maxBytes:
+                break
+            remove.append(key)
+            total -= size
+        self.remove(remove)
+
+    def remove(self, keys):
+        for key in keys:
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            self.index.execute('DELETE FROM runs WHERE key = ?', (key,))
+        self.index.commit()
+
+    def clear(self):
+        self.remove([key for key, in self.index.execute('SELECT key FROM runs')])
+
+    def query(self, **conditions):
+        """
+        The cached runs whose parameters match conditions, newest first. A condition
+        is a value, or a (low, high) range that includes its bounds, on a Model
+        parameter or on engine, function or timeSteps, e.g.
+        query(killProb=(0.2, 0.5), forestOn=True, engine='VectorizedModel').
+        Every run is a dict with its key, engine, function, seed, timeSteps, params,
+        extra and size in bytes.
+        """
+        parameters = model_parameters({})
+        clauses = []
+        values = []
+        for name, condition in conditions.items():
+            if name in COLUMNS:
+                column = name
+            elif name in parameters:
+                column = f"json_extract(params, '$.{name}')"
+            else:
+                raise ValueError(f'Unknown parameter {name}')
+            if isinstance(condition, tuple):
+                clauses.append(f'{column} BETWEEN ? AND ?')
+                values.extend(condition)
+            else:
+                clauses.append(f'{column} = ?')
+                values.append(condition)
+
+        sql = 'SELECT key, engine, function, seed, timeSteps, params, extra, size FROM runs'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        runs = []
+        for key, engine, function, seed, timeSteps, params, extra, size in self.index.execute(
+                sql + ' ORDER BY created DESC', values):
+            runs.append({'key': key, 'engine': engine, 'function': function, 'seed': json.loads(seed),
+                         'timeSteps': timeSteps, 'params': json.loads(params), 'extra': json.loads(extra),
+                         'size': size})
+        return runs
+
+    def close(self):
+        self.index.close()
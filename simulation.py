@@ -1,16 +1,35 @@
 import matplotlib.pyplot as plt
 import math
 import numpy as np
+import terrain
+import recorder
+import trajectory
+import profiling
+import stopping as stopping_rules
 import simulation_visualization
+import simulation_vectorized
+from spatial_index import PeriodicGrid
 from scipy.signal import find_peaks
 
 
 class Model: 
-    def __init__(self, width=100, height=100, nHares=2000, nMountains=10, nForest=200, nLynx=5, killProb=0.4, breedProbHares = 0.05, breedProbLynx = 0.0192, maximumHares = 7500, maximumLynx = 25, forestDensityRange = 5, mountainOn = False, forestOn = False):
+    def __init__(self, width=100, height=100, nHares=2000, nMountains=10, nForest=200, nLynx=5, killProb=0.4, breedProbHares = 0.05, breedProbLynx = 0.0192, maximumHares = 7500, maximumLynx = 25, forestDensityRange = 5, mountainOn = False, forestOn = False, seed = None, legacyRemoval = False, legacyWindow = False, profile = False):
         """
         Model parameters
         Initialize the model with the right parameters.
-        """
+        The model draws all its random numbers from its own generator, seed can be
+        an integer, a numpy SeedSequence or an existing numpy Generator.
+        Dead animals are only marked during a timestep and removed at the end of update.
+        With legacyRemoval the model mimics the old removal from the lists while looping
+        over them, which skipped the animal after every removed one, for comparison runs.
+        A lynx hunts the hares at most its huntDistance away along both axes, measured
+        the short way around the periodic grid like VectorizedModel.hunt, found with a
+        spatial_index.PeriodicGrid of the hares. With legacyWindow it uses the old test
+        that does not wrap and whose y part accepts every hare below the lynx.
+        With profile every timestep is timed per phase and counted, see profiling.Profiler.
+        """
+        self.rng = np.random.default_rng(seed)
+        self.profiler = profiling.Profiler() if profile else None
         self.height = height
         self.width = width
         self.nHares = nHares
@@ -23,6 +42,9 @@ class Model:
         self.maxHares = maximumHares
         self.maxLynx = maximumLynx
         self.forestDensityRange = forestDensityRange
+        self.legacyRemoval = legacyRemoval
+        self.legacyWindow = legacyWindow
+        self.hareGrid = PeriodicGrid(self.width, self.height, cellSize=10)
 
         """
         Data parameters
@@ -35,7 +57,11 @@ class Model:
         Population setters
         Make a data structure in this case a list with the hares, lynxes, trees and mountains.
         We only create mountains and forests if they are put as 'on'.
+        Dead hares and lynxes are kept in a pool and reused for newborns, so births and
+        deaths do not keep allocating and freeing objects.
         """
+        self.harePool = []
+        self.lynxPool = []
         self.HaresPopulation = self.set_hare_population()
         self.LynxPopulation = self.set_lynx_population()
         
@@ -43,20 +69,21 @@ class Model:
             self.Mountains = self.set_mountain()
         else: 
             self.Mountains = []
+            self.mountainMask = terrain.mountain_mask([], self.width, self.height)
             
         if forestOn:
             self.Forests = self.set_forest()
         else:
             self.Forests = []
+            self.killProbField = terrain.kill_probability_field(np.zeros((self.width, self.height)), self.killProb)
     
     def set_mountain(self):
         """
         This function makes the initial Mountains, they are 10x10 grids long.
         """
         mountainPopulation = []
-        for i in range(self.nMountains):           
-            x = np.random.randint(10,self.width-10)
-            y = np.random.randint(10,self.height-10)
+        corners = self.rng.integers(10, [self.width-10, self.height-10], size=(self.nMountains, 2)).tolist()
+        for x, y in corners:           
             x_list = []
             y_list = []
             for j in range(10):
@@ -66,7 +93,12 @@ class Model:
                 y_list.append(y)
             for m in x_list:
                 for n in y_list:
-                    mountainPopulation.append(Mountain(m, n, self))
+                    mountainPopulation.append(Mountain(m, n))
+        
+        """
+        The lynxes look up whether they stand on a mountain in this grid.
+        """
+        self.mountainMask = terrain.mountain_mask([m.position for m in mountainPopulation], self.width, self.height)
                 
         return mountainPopulation
     
@@ -75,12 +107,16 @@ class Model:
         This function makes the initial forests, the trees are put randomly in the grid.
         """
         forestPopulation = []
-        for i in range(self.nForest):           
-            x = np.random.randint(self.width)
-            y = np.random.randint(self.height)
-
-            
-            forestPopulation.append(Forest(x, y, self))
+        positions = self.rng.integers([self.width, self.height], size=(self.nForest, 2)).tolist()
+        for x, y in positions:           
+            forestPopulation.append(Forest(x, y))
+        
+        """
+        The trees never move, so the kill probability for a lynx on each cell of
+        the grid is computed once here.
+        """
+        self.forestCount = terrain.forest_counts([f.position for f in forestPopulation], self.width, self.height, self.forestDensityRange)
+        self.killProbField = terrain.kill_probability_field(self.forestCount, self.killProb)
                 
         return forestPopulation
 
@@ -92,13 +128,13 @@ class Model:
         Each Hare has a random chance of either being a woman or a man.
         """
         harePopulation = []
-        for i in range(self.nHares):
-            x = np.random.randint(self.width)
-            y = np.random.randint(self.height)
+        positions = self.rng.integers([self.width, self.height], size=(self.nHares, 2)).tolist()
+        draws = self.rng.random(self.nHares)
+        for (x, y), u in zip(positions, draws):
             """
             Hares may have overlapping positions.
             """
-            if np.random.uniform() < 0.5:
+            if u < 0.5:
                 state = 'M'  # M for male
             else:
                 state = 'F' # F for female
@@ -114,10 +150,10 @@ class Model:
         Each Lynx has a random chance of either being a woman or a man.
         """
         lynxPopulation = []
-        for i in range(self.nLynx):
-            x = np.random.randint(self.width)
-            y = np.random.randint(self.height)
-            if np.random.uniform() < 0.5:
+        positions = self.rng.integers([self.width, self.height], size=(self.nLynx, 2)).tolist()
+        draws = self.rng.random(self.nLynx)
+        for (x, y), u in zip(positions, draws):
+            if u < 0.5:
                 state = 'M'  # M for male
             else:
                 state = 'F' # F for female
@@ -125,6 +161,26 @@ class Model:
             lynxPopulation.append(Lynx(x, y, state, self))
         return lynxPopulation
 
+    def new_hare(self, x, y, state):
+        """
+        A hare at (x, y), taken from the pool of dead hares when possible.
+        """
+        if self.harePool:
+            hare = self.harePool.pop()
+            hare.spawn(x, y, state)
+            return hare
+        return Hare(x, y, state, self)
+
+    def new_lynx(self, x, y, state):
+        """
+        A lynx at (x, y), taken from the pool of dead lynxes when possible.
+        """
+        if self.lynxPool:
+            lynx = self.lynxPool.pop()
+            lynx.spawn(x, y, state)
+            return lynx
+        return Lynx(x, y, state, self)
+
     def update(self):
         """
         Perform everything each timestep.
@@ -139,13 +195,35 @@ class Model:
         #if len(self.HaresPopulation) <= 20:
         #    l.killProbHares = 0
         
+        """
+        The random numbers are drawn from the model generator in one batch per phase:
+        the moves and the maturations of all lynxes here, the kill trials of every lynx
+        once it moved, the moves and maturations of the hares and the breeding trials
+        further on.
+        """
+        prof = self.profiler
+        if prof is not None:
+            prof.start(len(self.LynxPopulation), len(self.HaresPopulation))
+        checks = 0
+        attempts = 0
+
+        nLynx = len(self.LynxPopulation)
+        lynxDeltas = self.rng.integers(-2, 3, size=(nLynx, 2)).tolist()
+        lynxMatureDraws = self.rng.random(nLynx).tolist()
+        if prof is not None:
+            prof.lap('moveLynx')
+        hareX, hareY = np.array([h.position for h in self.HaresPopulation], dtype=int).reshape(-1, 2).T
+        self.hareGrid.rebuild(hareX, hareY)
+        kills = 0
+        if prof is not None:
+            prof.lap('hunt')
+        
         for i, l in enumerate(self.LynxPopulation):
             """
             Let the Lynxes move around. Update their position in the grid.
             """
-            l.move(self.height, self.width)
+            l.move(self.height, self.width, *lynxDeltas[i])
             
-            trees_nearby = 0
             l.time_born += 1
             
             """
@@ -153,48 +231,80 @@ class Model:
             either a man or a woman.
             """
             if l.time_born == 150: ## Time period is 150 days
-                if np.random.uniform() < 0.5:
+                if lynxMatureDraws[i] < 0.5:
                     l.state = 'M' 
                 else:
                     l.state = 'F'
             
             """
             The density of the forest around the lynx will cause the lynx to decrease their 
-            kill probability, it's harder for them to hunt.
+            kill probability, it's harder for them to hunt. The kill probability for
+            every cell is precomputed in set_forest.
             """
-            for q, f in enumerate(self.Forests):
-                if abs(l.position[0] - f.position[0]) <= self.forestDensityRange \
-                    and abs(l.position[1] - f.position[1]) <= self.forestDensityRange:
-                        trees_nearby +=1
-                        
-            if trees_nearby == 0:
-                l.killProbHares = self.killProb
-            else:
-                l.killProbHares = self.killProb / (trees_nearby)
+            lx, ly = l.position
+            l.killProbHares = self.killProbField[lx, ly]
+            if prof is not None:
+                prof.lap('moveLynx')
             
                 
             """ 
             When a Lynx is hungry and a Hare is closeby, the Lynx will kill the Hare with 
-            a certain kill probability (kill prob).
+            a certain kill probability (kill prob). Killed hares stay in the list until
+            the end of the timestep, but are skipped.
+            """
             """
-            for h in self.HaresPopulation:
-                if abs(l.position[0] - h.position[0]) <= l.huntDistance and abs(l.position[1] - h.position[1] <= l.huntDistance): # adjust to closeby 
-                    if l.state == 'M' or l.state == 'F' or l.state == 'B':
-                        l.hunt(h, l.killProbHares)
+            One kill draw for every hare in the hunt window, in the order of the list,
+            whether it is still alive or not. The legacy window is
+            abs(lx - hx) <= huntDistance and abs(ly - hy <= huntDistance).
+            """
+            if self.legacyWindow:
+                candidates = np.flatnonzero((np.abs(lx - hareX) <= l.huntDistance) & (ly - hareY <= l.huntDistance))
+                checks += len(self.HaresPopulation)
+            else:
+                candidates = self.hareGrid.query(lx, ly, l.huntDistance)
+            killDraws = self.rng.random(candidates.size).tolist()
+
+            """
+            With legacyRemoval the next living hare in the list after a kill is skipped.
+            """
+            skipped = -1
+            for k, j in enumerate(candidates.tolist()):
+                h = self.HaresPopulation[j]
+                if not h.alive or j == skipped:
+                    continue
+                if l.state == 'M' or l.state == 'F' or l.state == 'B':
+                    attempts += 1
+                    if l.hunt(h, l.killProbHares, killDraws[k]):
+                        kills += 1
+                        if self.legacyRemoval:
+                            skipped = next((m for m in range(j + 1, len(self.HaresPopulation))
+                                            if self.HaresPopulation[m].alive), -1)
+            if prof is not None:
+                prof.lap('hunt')
+        if not self.legacyWindow:
+            checks += self.hareGrid.tested
 
+        nHares = len(self.HaresPopulation)
+        hareDeltas = self.rng.integers(-2, 3, size=(nHares, 2)).tolist()
+        hareMatureDraws = self.rng.random(nHares).tolist()
+        
         for j, h in enumerate(self.HaresPopulation):
             """
             Update the hares population. Let them all move around. Also add when a hare
             is old enough and becomes an adult (either female or male).
             """
-            h.move(self.height,self.width)
+            if not h.alive:
+                continue
+            h.move(self.height,self.width, *hareDeltas[j])
             if h.state == 'B':
                 h.time_born += 1
             if h.time_born == 15: ## After a month
-                if np.random.uniform() < 0.5:
+                if hareMatureDraws[j] < 0.5:
                     h.state = 'M' 
                 else:
                     h.state = 'F'
+        if prof is not None:
+            prof.lap('moveHares')
         
         """
         The breeding probability of the Hares is dependent of the amount of Lynxes alive (stress),
@@ -204,28 +314,41 @@ class Model:
         slows down drastically.
         If the Lynx reach a certain population amount, due to food limitations their breeding
         will also slow down drastically.
+        Without lynx the hares breed as if there was a single lynx.
         """
+        nHares -= kills
         
-        if len(self.HaresPopulation) >= self.maxHares * 0.75:
-            probbreedHares = self.breedProbHares/math.sqrt(len(self.LynxPopulation)) * 0.1
+        if nHares >= self.maxHares * 0.75:
+            probbreedHares = self.breedProbHares/math.sqrt(max(nLynx, 1)) * 0.1
         else:
-            probbreedHares = self.breedProbHares/math.sqrt(len(self.LynxPopulation))* 0.5
+            probbreedHares = self.breedProbHares/math.sqrt(max(nLynx, 1))* 0.5
         
         
-        if len(self.LynxPopulation) >= self.maxLynx * 0.75:
-            probbreedLynx = self.breedProbLynx/1000 * math.sqrt((len(self.HaresPopulation))) 
+        if nLynx >= self.maxLynx * 0.75:
+            probbreedLynx = self.breedProbLynx/1000 * math.sqrt(nHares) 
         else:
-            probbreedLynx = self.breedProbLynx/10000 * len(self.HaresPopulation) 
+            probbreedLynx = self.breedProbLynx/10000 * nHares 
         
+        """
+        One breeding draw for every animal alive before breeding. The babies are added to
+        the lists while looping over them, but they can not breed yet so never need a draw.
+        """
+        hareBreedDraws = self.rng.random(len(self.HaresPopulation)).tolist()
+        lynxBreedDraws = self.rng.random(len(self.LynxPopulation)).tolist()
+        nHaresBefore = len(self.HaresPopulation)
+        nLynxBefore = len(self.LynxPopulation)
+        lynxDeathsBefore = self.LynxDeathCount
         
         for m, h in enumerate(self.HaresPopulation):
             """
             Let the Hares reproduce by themselves. Only if enough time passed since last time
             breeding.
             """
+            if not h.alive:
+                continue
             h.lastbreed +=1
             if h.state == 'F' or h.state == 'M' and h.lastbreed > 50:
-                h.breed(probbreedHares)
+                h.breed(probbreedHares, hareBreedDraws[m])
         
         for m, l in enumerate(self.LynxPopulation):
             """
@@ -234,23 +357,50 @@ class Model:
             """
             l.lastbreed +=1
             if l.state == 'M' or l.state == 'F' and l.lastbreed > 50:
-                l.breed(probbreedLynx)
+                l.breed(probbreedLynx, lynxBreedDraws[m])
+        if prof is not None:
+            prof.lap('breeding')
+            prof.count('haresBorn', len(self.HaresPopulation) - nHaresBefore)
+            prof.count('lynxBorn', len(self.LynxPopulation) - nLynxBefore)
                 
+        skipNext = False
         for o, l in enumerate(self.LynxPopulation):
             """
             Lynxes die of starvation if not eaten enough, they need to eat atleast 5 hares in the last
             14 timesteps to survive.
             """
-            l.eathistory.append(l.hungry)
+            if skipNext:
+                skipNext = False
+                continue
+            l.remember_meal()
             
             
-            if sum(l.eathistory[-14:]) < 5 and l.time_born > 30:
+            if l.eaten14 < 5 and l.time_born > 30:
                 self.LynxDeathCount += 1
-                self.LynxPopulation.remove(l)
+                l.alive = False
+                skipNext = self.legacyRemoval
             """
             Reset the Lynx to be hungry again.
             """
             l.hungry = 0
+        if prof is not None:
+            prof.lap('starvation')
+        
+        """
+        Sweep the killed hares and starved lynxes out of the populations in one pass,
+        they go to the pools to be reused for the next newborns.
+        """
+        self.harePool.extend(h for h in self.HaresPopulation if not h.alive)
+        self.lynxPool.extend(l for l in self.LynxPopulation if not l.alive)
+        self.HaresPopulation = [h for h in self.HaresPopulation if h.alive]
+        self.LynxPopulation = [l for l in self.LynxPopulation if l.alive]
+        if prof is not None:
+            prof.lap('cleanup')
+            prof.count('distanceChecks', checks)
+            prof.count('killsAttempted', attempts)
+            prof.count('kills', kills)
+            prof.count('lynxStarved', self.LynxDeathCount - lynxDeathsBefore)
+            prof.stop()
         
         """
         Update the data/statistics.
@@ -260,48 +410,84 @@ class Model:
 
 
 class Lynx:
+    __slots__ = ('position', 'model', 'killProb', 'killProbHares', 'state', 'time_born', 'hungry',
+                 'time_hungry', 'eathistory', 'eatIndex', 'eaten3', 'eaten7', 'eaten14', 'lastbreed',
+                 'huntDistance', 'speed', 'xdirection', 'ydirection', 'alive')
+
     def __init__(self, x, y, state, model):
         """
         Class to model the Lynx. 
         Each Lynx is initiliazed with all the parameter values.
+        The attributes are slots instead of a __dict__, which keeps every lynx small.
         """
-        self.position = [x, y]
         self.model = model
-        self.killProb = model.killProb
+        self.spawn(x, y, state)
+
+    def spawn(self, x, y, state):
+        """
+        Gives the lynx its starting values. The model also calls this to reuse a dead
+        lynx from its pool for a newborn one.
+        """
+        self.position = (x, y)
+        self.killProb = self.model.killProb
         self.state = state
         self.time_born = 0
         self.hungry = 0
         self.time_hungry = 0
-        self.eathistory = []
+        """
+        The kills of the last 14 timesteps in a ring buffer, eatIndex points at the
+        oldest entry. The totals over the last 3, 7 and 14 timesteps are kept up to date.
+        """
+        self.eathistory = bytearray(14)
+        self.eatIndex = 0
+        self.eaten3 = 0
+        self.eaten7 = 0
+        self.eaten14 = 0
         self.lastbreed = 0
         self.huntDistance = 5
         self.speed = 1
+        self.alive = True
 
-    def hunt(self, hare, killProb):
+    def hunt(self, hare, killProb, draw):
         """
         Function that handles the killing.
         After a lynx hunts and kills, it will add its hares to its eaten tally. If it has
         eaten 3 hares, it wont kill any other hares nearby for that timestep. 
+        The draw is a uniform random number drawn by the model for this kill trial.
+        The killed hare is only marked dead, the model removes it at the end of the timestep.
+        Returns whether the hare was killed.
         """
-        if np.random.uniform() <= killProb and self.hungry < 3:
+        if draw <= killProb and self.hungry < 3:
             self.model.HaresDeathCount += 1
-            self.model.HaresPopulation.remove(hare)
+            hare.alive = False
             self.hungry +=1
             self.time_hungry = 0
+            return True
+        return False
 
+    def remember_meal(self):
+        """
+        Adds the kills of this timestep to the eat history. The entries that drop out of
+        the 3, 7 and 14 step windows are 3, 7 and 14 places back in the ring buffer.
+        """
+        i = self.eatIndex
+        self.eaten3 += self.hungry - self.eathistory[i - 3]
+        self.eaten7 += self.hungry - self.eathistory[i - 7]
+        self.eaten14 += self.hungry - self.eathistory[i]
+        self.eathistory[i] = self.hungry
+        self.eatIndex = (i + 1) % 14
 
-    def move(self, height, width):
+    def move(self, height, width, deltaX, deltaY):
         """
         Moves the lynx seven steps in the same random direction. The more hungry the lynxes are, the 'intenser'
         they will hunt, and thus move.
+        The new random direction (deltaX, deltaY) is drawn by the model, it is only used
+        at the start of every seven steps.
         """      
-        deltaX = np.random.randint(-2, 3)
-        deltaY = np.random.randint(-2, 3)
-        
-        if np.sum(self.eathistory[-3:]) < 3 and self.time_born > 10:
+        if self.eaten3 < 3 and self.time_born > 10:
             self.huntDistance = 8
             
-        if np.sum(self.eathistory[-7:]) < 3 and self.time_born > 20:
+        if self.eaten7 < 3 and self.time_born > 20:
             self.speed = 1.25
             self.huntDistance = 10
         
@@ -323,63 +509,74 @@ class Lynx:
         """
         The lynxes move slower when they are on the mountains, hares are not effected:
         """
-        for i, m in enumerate(self.model.Mountains): 
-            if self.position[0] == m.position[0] and self.position[1] == m.position[1]:
-                self.speed = 0.25
+        x, y = self.position
+        if self.model.mountainMask[x, y]:
+            self.speed = 0.25
         
-        self.position[0] = int((self.position[0] + self.xdirection*self.speed)) % width
-        self.position[1] = int((self.position[1] + self.ydirection*self.speed)) % height
+        self.position = (int(x + self.xdirection*self.speed) % width,
+                         int(y + self.ydirection*self.speed) % height)
     
-    def breed(self, breedProbLynx):
+    def breed(self, breedProbLynx, draw):
         """
-        Determines whether the Lynx actually reproduces or not.
+        Determines whether the Lynx actually reproduces or not, draw is the uniform
+        random number drawn by the model for this breeding trial.
         """
-        if np.random.uniform() <= breedProbLynx:
-            x = self.position[0]
-            y = self.position[1]
+        if draw <= breedProbLynx:
+            x, y = self.position
             
             self.lastbreed = 0
             
             state = 'B'  # B for baby
-            self.model.LynxPopulation.append(Lynx(x, y, state, self.model))
+            self.model.LynxPopulation.append(self.model.new_lynx(x, y, state))
 
 class Mountain:
-    def __init__(self, x, y, model):
+    __slots__ = ('position',)
+
+    def __init__(self, x, y):
         """
         Class to model the Mountains. 
         Each Mountain is initialized with a position on the grid. 
         """
-        self.position = [x, y]
-        self.model = model
+        self.position = (x, y)
         
 class Forest:
-    def __init__(self, x, y, model):
+    __slots__ = ('position',)
+
+    def __init__(self, x, y):
         """
         Class to model the Forest. 
         Each Forest is initialized with a position on the grid. 
         """
-        self.position = [x, y]
-        self.model = model
+        self.position = (x, y)
 
 
 class Hare:
+    __slots__ = ('position', 'state', 'model', 'time_born', 'lastbreed', 'alive')
+
     def __init__(self, x, y, state, model):
         """
         Class to model the Hares. 
         Each Hare is initialized with all the parameter values.
+        The attributes are slots instead of a __dict__, which keeps every hare small.
         """
-        self.position = [x, y]
-        self.state = state
         self.model = model
+        self.spawn(x, y, state)
+
+    def spawn(self, x, y, state):
+        """
+        Gives the hare its starting values. The model also calls this to reuse a dead
+        hare from its pool for a newborn one.
+        """
+        self.position = (x, y)
+        self.state = state
         self.time_born = 0
         self.lastbreed = 0
+        self.alive = True
      
-    def move(self, height, width):
+    def move(self, height, width, deltaX, deltaY):
         """
-        Moves the hares one step in a random direction.
+        Moves the hares one step in the random direction (deltaX, deltaY) drawn by the model.
         """
-        deltaX = np.random.randint(-2, 3)
-        deltaY = np.random.randint(-2, 3)
         """
         The hares may not leave the grid. There are two options:
                       - fixed boundaries: if the hares wants to move off the
@@ -387,30 +584,40 @@ class Hare:
                       - periodic boundaries: implement a wrap around i.e. if
                         y+deltaY > ymax -> y = 0. This is the option currently implemented.
         """
-        self.position[0] = (self.position[0] + deltaX) % width
-        self.position[1] = (self.position[1] + deltaY) % height
+        x, y = self.position
+        self.position = ((x + deltaX) % width, (y + deltaY) % height)
     
-    def breed(self, breedProbHares):
+    def breed(self, breedProbHares, draw):
         """
         Determines whether a Hare reproduces or not. 
         We include the fact that Hares reproduce worse when Lynx population amount increases.
+        draw is the uniform random number drawn by the model for this breeding trial.
         """
-        if np.random.uniform() <= breedProbHares:
-            x = self.position[0]
-            y = self.position[1]
+        if draw <= breedProbHares:
+            x, y = self.position
 
             self.lastbreed = 0
             
             state = 'B'  # B for baby
-            self.model.HaresPopulation.append(Hare(x, y, state, self.model))
+            self.model.HaresPopulation.append(self.model.new_hare(x, y, state))
             
 
      
-def run_simulation(mountainOn, forestOn, visualize = True, seed=1):
+def run_simulation(mountainOn, forestOn, visualize = True, seed=1, vectorized = False, exportCsv = False, renderEvery = 1, targetFps = None, trajectoryFile = None, stopping = None, cache = None):
     """
-    Set a random seed, such that we have the same simulation each time
+    The model is seeded, such that we have the same simulation each time.
+    The populations are recorded in the directory fileName, see recorder.Recorder,
+    with exportCsv they are also written to fileName.csv.
+    renderEvery and targetFps limit how often the live visualization is drawn.
+    With trajectoryFile the animals of every timestep are recorded in that directory,
+    to be replayed later with trajectory.Replay.
+    The run stops early when the stopping.StoppingRule stopping is met, by default
+    when the lynx or the hares died out. Its cycles.CycleDetector, stopping.detector,
+    follows the cycles during the run.
+    With a runcache.RunCache cache a run without visualization and trajectory is
+    loaded from the cache when it was made before, otherwise it is added to it.
     """
-    np.random.seed(seed)
+
     """
     Simulation parameters
     """
@@ -423,19 +630,50 @@ def run_simulation(mountainOn, forestOn, visualize = True, seed=1):
     Run a simulation for an indicated number of timesteps.
     """
     
-    file = open(fileName + '.csv', 'w')
-    sim = Model(mountainOn=mountainOn, forestOn=forestOn)
-    if visualize:
-        vis = simulation_visualization.Visualization(sim.height, sim.width)
-    print('Starting simulation')
-    while t < timeSteps:
-        [d1, d2] = sim.update()  # Catch the data
-        line = str(t) + ',' + str(d1) + ',' + str(d2) + '\n'  # Separate the data with commas
-        file.write(line)  # Write the data to a .csv file
+    if stopping is None:
+        stopping = stopping_rules.StoppingRule()
+    key = None
+    if cache is not None and not visualize and trajectoryFile is None:
+        key, description = cache.key({'mountainOn': mountainOn, 'forestOn': forestOn}, seed, timeSteps, vectorized,
+                                     'run_simulation', {'stopping': stopping.settings()})
+    cached = None if key is None else cache.get(key)
+    dataDirectory = fileName
+    if cached is not None:
+        print('Loaded the simulation from the cache')
+        dataDirectory = cache.path(key)
+        cycles = cached[1]['cycles']
+    else:
+        rec = recorder.Recorder(fileName)
+        if vectorized:
+            sim = simulation_vectorized.VectorizedModel(mountainOn=mountainOn, forestOn=forestOn, seed=seed)
+        else:
+            sim = Model(mountainOn=mountainOn, forestOn=forestOn, seed=seed)
         if visualize:
-            vis.update(t, sim.LynxPopulation, sim.HaresPopulation, sim.Mountains, sim.Forests)
-        t += 1
-    file.close()
+            vis = simulation_visualization.Visualization(sim.height, sim.width, renderEvery=renderEvery, targetFps=targetFps)
+        if trajectoryFile is not None:
+            trajectoryRecorder = trajectory.TrajectoryRecorder(trajectoryFile, sim.width, sim.height, sim.Mountains, sim.Forests)
+        stopping.start(sim)
+        print('Starting simulation')
+        while t < timeSteps:
+            [d1, d2] = sim.update()  # Catch the data
+            rec.record(t, sim, d1, d2)  # Store the data
+            if trajectoryFile is not None:
+                trajectoryRecorder.record(t, sim)
+            if visualize:
+                vis.update(t, sim.LynxPopulation, sim.HaresPopulation, sim.Mountains, sim.Forests)
+            t += 1
+            if stopping.check(d1, d2) is not None:
+                print(f'Stopped after {t} timesteps: {stopping.reason}')
+                break
+        rec.close()
+        if trajectoryFile is not None:
+            trajectoryRecorder.close()
+        cycles = stopping.detector.summary()
+        if key is not None:
+            cache.put(key, description, directory=fileName, meta={'reason': stopping.reason, 'cycles': cycles})
+    print(f"Hare period: {cycles['haresPeriod']}, lynx period: {cycles['lynxPeriod']}, phase lag: {cycles['phaseLag']}")
+    if exportCsv:
+        recorder.export_csv(dataDirectory, fileName + '.csv')
     if visualize:
         vis.persist()
 
@@ -443,10 +681,10 @@ def run_simulation(mountainOn, forestOn, visualize = True, seed=1):
         """
         Make a plot by from the stored simulation data.
         """
-        data = np.loadtxt(fileName+'.csv', delimiter=',')
-        time = data[:, 0]
-        LynxAmount = data[:, 1]
-        HaresAmount = data[:, 2]
+        data = recorder.load(dataDirectory)
+        time = data['time']
+        LynxAmount = data['lynx']
+        HaresAmount = data['hares']
         
         print(f"Average Lynx: {np.mean(LynxAmount)}")
         print(f"Average Hares: {np.mean(HaresAmount)}")
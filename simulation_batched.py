@@ -0,0 +1,281 @@
+import numpy as np
+from spatial_index import window_pairs
+from simulation_vectorized import (VectorizedModel, BABY, MALE, FEMALE, HARE_ARRAYS, LYNX_ARRAYS,
+                                   legacy_kills, legacy_visited)
+
+
+class BatchedModel:
+    def __init__(self, paramSets, seed=None, seeds=None):
+        """
+        Many independent replicates of simulation_vectorized.VectorizedModel advanced
+        together, so the interpreter overhead of a timestep is shared by all of them.
+        paramSets holds the VectorizedModel constructor arguments of every replicate,
+        e.g. [{'killProb': 0.4}, {'killProb': 0.2, 'forestOn': True}]. All replicates
+        need the same width and height.
+        Every replicate has its own random generator, made from seeds[r] or else from
+        the r-th seed spawned from seed, and draws from it exactly like a VectorizedModel
+        with that seed would. So replicate r follows the same trajectory as
+        sweep.run_single(paramSets[r], timeSteps, seeds[r]).
+
+        The animals of all replicates are stored in the same arrays as in VectorizedModel
+        plus hareRep and lynxRep with the replicate of every row. The rows are grouped by
+        replicate and keep their order within a replicate.
+        """
+        self.nReplicates = len(paramSets)
+        if seeds is None:
+            seeds = np.random.SeedSequence(seed).spawn(self.nReplicates)
+        self.rngs = [np.random.default_rng(s) for s in seeds]
+
+        """
+        The initial populations and terrain are made by a VectorizedModel per replicate,
+        which uses up the same random numbers from the generators.
+        """
+        models = [VectorizedModel(seed=rng, **params) for rng, params in zip(self.rngs, paramSets)]
+        self.width = models[0].width
+        self.height = models[0].height
+        if any(m.width != self.width or m.height != self.height for m in models):
+            raise ValueError('All replicates of a BatchedModel need the same width and height')
+
+        for name in HARE_ARRAYS:
+            setattr(self, name, np.concatenate([getattr(m, name) for m in models]))
+        for name in LYNX_ARRAYS:
+            setattr(self, name, np.concatenate([getattr(m, name) for m in models]))
+        self.hareRep = np.repeat(np.arange(self.nReplicates), [m.hareX.size for m in models])
+        self.lynxRep = np.repeat(np.arange(self.nReplicates), [m.lynxX.size for m in models])
+
+        """
+        Per replicate parameters and terrain grids, indexed by replicate.
+        """
+        self.killProb = np.array([m.killProb for m in models], dtype=float)
+        self.breedProbHares = np.array([m.breedProbHares for m in models], dtype=float)
+        self.breedProbLynx = np.array([m.breedProbLynx for m in models], dtype=float)
+        self.maxHares = np.array([m.maxHares for m in models], dtype=float)
+        self.maxLynx = np.array([m.maxLynx for m in models], dtype=float)
+        self.legacyRemoval = np.array([m.legacyRemoval for m in models], dtype=bool)
+        self.mountainMask = np.stack([m.mountainMask for m in models])
+        self.killProbField = np.stack([m.killProbField for m in models])
+
+        self.LynxDeathCount = np.zeros(self.nReplicates, dtype=int)
+        self.HaresDeathCount = np.zeros(self.nReplicates, dtype=int)
+
+    def counts(self, rep):
+        """
+        How many of the given rows belong to every replicate.
+        """
+        return np.bincount(rep, minlength=self.nReplicates)
+
+    def random(self, counts):
+        """
+        counts[r] uniform numbers from the generator of every replicate r, concatenated
+        in replicate order.
+        """
+        return np.concatenate([rng.random(c) for rng, c in zip(self.rngs, counts)])
+
+    def steps(self, counts):
+        """
+        counts[r] random steps in x and then in y from the generator of every replicate r.
+        """
+        deltas = [(rng.integers(-2, 3, size=c), rng.integers(-2, 3, size=c)) for rng, c in zip(self.rngs, counts)]
+        return np.concatenate([d[0] for d in deltas]), np.concatenate([d[1] for d in deltas])
+
+    def random_sex(self, rows, rep):
+        """
+        Draws the state of the maturing animals in rows, male or female with equal chance.
+        """
+        return np.where(self.random(self.counts(rep[rows])) < 0.5, MALE, FEMALE)
+
+    def update(self):
+        """
+        Perform everything each timestep, for every replicate.
+        Returns arrays with the number of lynxes and hares in every replicate.
+        """
+        self.move_lynx()
+
+        self.lynxTimeBorn += 1
+        mature = np.flatnonzero(self.lynxTimeBorn == 150)
+        self.lynxState[mature] = self.random_sex(mature, self.lynxRep)
+
+        self.hunt()
+        self.move_hares()
+
+        self.hareTimeBorn[self.hareState == BABY] += 1
+        mature = np.flatnonzero(self.hareTimeBorn == 15)
+        self.hareState[mature] = self.random_sex(mature, self.hareRep)
+
+        """
+        The breeding probabilities of every replicate, as in VectorizedModel.update.
+        A replicate without lynxes has no predator stress on its hares.
+        """
+        nLynx = self.counts(self.lynxRep)
+        nHares = self.counts(self.hareRep)
+        stress = np.sqrt(np.maximum(nLynx, 1))
+        probbreedHares = np.where(nHares >= self.maxHares * 0.75,
+                                  self.breedProbHares/stress * 0.1, self.breedProbHares/stress * 0.5)
+        probbreedLynx = np.where(nLynx >= self.maxLynx * 0.75,
+                                 self.breedProbLynx/1000 * np.sqrt(nHares), self.breedProbLynx/10000 * nHares)
+
+        self.breed_hares(probbreedHares)
+        self.breed_lynx(probbreedLynx)
+        self.starve_lynx()
+
+        return self.counts(self.lynxRep), self.counts(self.hareRep)
+
+    def move_lynx(self):
+        """
+        Moves all lynxes, see VectorizedModel.move_lynx.
+        """
+        deltaX, deltaY = self.steps(self.counts(self.lynxRep))
+
+        hungry = (self.lynxEaten7 < 3) & (self.lynxTimeBorn > 20)
+        self.lynxSpeed = np.where(hungry, 1.25, 1.0)
+        self.lynxHuntDistance = np.where(hungry, 10, 5)
+
+        newDirection = self.lynxTimeBorn % 7 == 0
+        self.lynxXDirection[newDirection] = deltaX[newDirection]
+        self.lynxYDirection[newDirection] = deltaY[newDirection]
+
+        self.lynxSpeed[self.mountainMask[self.lynxRep, self.lynxX, self.lynxY]] = 0.25
+
+        self.lynxX = np.trunc(self.lynxX + self.lynxXDirection * self.lynxSpeed).astype(int) % self.width
+        self.lynxY = np.trunc(self.lynxY + self.lynxYDirection * self.lynxSpeed).astype(int) % self.height
+
+    def hunt(self):
+        """
+        Every lynx hunts the hares close by in its own replicate, with the hunt window
+        of VectorizedModel.hunt.
+        The windows of all lynxes are found at once with spatial_index.window_pairs,
+        the pairs come out grouped by lynx and in hare order, so the kill trials of
+        each replicate are drawn at once from its generator in the same order as
+        VectorizedModel does.
+        """
+        hareEnd = np.cumsum(self.counts(self.hareRep))
+        lynx, hares = window_pairs(self.hareX, self.hareY, self.hareRep, self.lynxX, self.lynxY,
+                                   self.lynxHuntDistance, self.lynxRep, self.width, self.height)
+
+        draws = self.random(self.counts(self.lynxRep[lynx]))
+        killProbs = self.killProbField[self.lynxRep, self.lynxX, self.lynxY]
+        success = draws <= killProbs[lynx]
+        lynx = lynx[success]
+        hares = hares[success]
+
+        """
+        Only the successful trials are left, they are handed out lynx by lynx because
+        a hare killed by an earlier lynx can not be killed again.
+        """
+        alive = np.ones(self.hareX.size, dtype=bool)
+        bounds = np.searchsorted(lynx, np.arange(self.lynxX.size + 1))
+        for i in np.flatnonzero(np.diff(bounds)):
+            candidates = hares[bounds[i]:bounds[i + 1]]
+            hits = candidates[alive[candidates]]
+            appetite = max(3 - self.lynxHungry[i], 0)
+            r = self.lynxRep[i]
+            if self.legacyRemoval[r]:
+                kills = legacy_kills(hits, alive[:hareEnd[r]], appetite)
+            else:
+                kills = hits[:appetite]
+            alive[kills] = False
+            self.lynxHungry[i] += kills.size
+
+        self.HaresDeathCount += self.counts(self.hareRep[~alive])
+        self.keep(HARE_ARRAYS + ('hareRep',), alive)
+
+    def move_hares(self):
+        """
+        Moves the hares one step in a random direction, with periodic boundaries.
+        """
+        deltaX, deltaY = self.steps(self.counts(self.hareRep))
+        self.hareX = (self.hareX + deltaX) % self.width
+        self.hareY = (self.hareY + deltaY) % self.height
+
+    def breed_hares(self, probbreedHares):
+        """
+        See VectorizedModel.breed_hares, probbreedHares holds the probability of every
+        replicate.
+        """
+        self.hareLastBreed += 1
+        canBreed = (self.hareState == FEMALE) | ((self.hareState == MALE) & (self.hareLastBreed > 50))
+        candidates = np.flatnonzero(canBreed)
+        draws = self.random(self.counts(self.hareRep[candidates]))
+        parents = candidates[draws <= probbreedHares[self.hareRep[candidates]]]
+        self.hareLastBreed[parents] = 0
+
+        n = parents.size
+        self.add_animals(HARE_ARRAYS + ('hareRep',), n, {'hareX': self.hareX[parents],
+                                                         'hareY': self.hareY[parents],
+                                                         'hareState': np.full(n, BABY),
+                                                         'hareLastBreed': np.ones(n, dtype=int),
+                                                         'hareRep': self.hareRep[parents]})
+
+    def breed_lynx(self, probbreedLynx):
+        """
+        See VectorizedModel.breed_lynx, probbreedLynx holds the probability of every
+        replicate.
+        """
+        self.lynxLastBreed += 1
+        canBreed = (self.lynxState == MALE) | ((self.lynxState == FEMALE) & (self.lynxLastBreed > 50))
+        candidates = np.flatnonzero(canBreed)
+        draws = self.random(self.counts(self.lynxRep[candidates]))
+        parents = candidates[draws <= probbreedLynx[self.lynxRep[candidates]]]
+        self.lynxLastBreed[parents] = 0
+
+        n = parents.size
+        self.add_animals(LYNX_ARRAYS + ('lynxRep',), n, {'lynxX': self.lynxX[parents],
+                                                         'lynxY': self.lynxY[parents],
+                                                         'lynxState': np.full(n, BABY),
+                                                         'lynxLastBreed': np.ones(n, dtype=int),
+                                                         'lynxSpeed': np.ones(n),
+                                                         'lynxHuntDistance': np.full(n, 5),
+                                                         'lynxRep': self.lynxRep[parents]})
+
+    def starve_lynx(self):
+        """
+        See VectorizedModel.starve_lynx. The legacy skipping stays within a replicate.
+        """
+        rows = np.arange(self.lynxX.size)
+        oldest = self.lynxEatHistory[rows, self.lynxEatIndex]
+        starving = (self.lynxEaten14 + self.lynxHungry - oldest < 5) & (self.lynxTimeBorn > 30)
+
+        visited = np.ones(self.lynxX.size, dtype=bool)
+        lynxEnd = np.cumsum(self.counts(self.lynxRep))
+        for r in np.flatnonzero(self.legacyRemoval):
+            replicate = slice(lynxEnd[r] - np.count_nonzero(self.lynxRep == r), lynxEnd[r])
+            visited[replicate] = legacy_visited(starving[replicate])
+        rows = rows[visited]
+
+        index = self.lynxEatIndex[rows]
+        kills = self.lynxHungry[rows]
+        self.lynxEaten3[rows] += kills - self.lynxEatHistory[rows, (index - 3) % 14]
+        self.lynxEaten7[rows] += kills - self.lynxEatHistory[rows, (index - 7) % 14]
+        self.lynxEaten14[rows] += kills - self.lynxEatHistory[rows, index]
+        self.lynxEatHistory[rows, index] = kills
+        self.lynxEatIndex[rows] = (index + 1) % 14
+        self.lynxHungry[rows] = 0
+
+        dead = starving & visited
+        self.LynxDeathCount += self.counts(self.lynxRep[dead])
+        self.keep(LYNX_ARRAYS + ('lynxRep',), ~dead)
+
+    def keep(self, names, alive):
+        """
+        Keeps only the rows for which alive is True.
+        """
+        for name in names:
+            setattr(self, name, getattr(self, name)[alive])
+
+    def add_animals(self, names, n, values):
+        """
+        Adds n animals like VectorizedModel.add_animals, every newborn is put after the
+        last row of its replicate, so the rows stay grouped by replicate and the
+        newborns of a replicate come after its older animals just like in
+        VectorizedModel. The replicate of the newborns is the last array in names,
+        they have to be sorted by it.
+        """
+        rep = getattr(self, names[-1])
+        at = np.searchsorted(rep, values[names[-1]], side='right')
+        for name in names:
+            old = getattr(self, name)
+            new = values.get(name)
+            if new is None:
+                new = np.zeros((n,) + old.shape[1:], dtype=old.dtype)
+            setattr(self, name, np.insert(old, at, new, axis=0))
+
@@ -0,0 +1,498 @@
+import math
+import numpy as np
+import terrain
+import kernels
+import profiling
+from spatial_index import PeriodicGrid
+
+"""
+State codes used in the state arrays, they replace the 'B', 'M' and 'F' strings
+of the Hare and Lynx classes in simulation.py.
+"""
+BABY = 0
+MALE = 1
+FEMALE = 2
+
+"""
+The arrays that together hold the hares and the lynxes, one row per animal.
+"""
+HARE_ARRAYS = ('hareX', 'hareY', 'hareState', 'hareTimeBorn', 'hareLastBreed')
+LYNX_ARRAYS = ('lynxX', 'lynxY', 'lynxState', 'lynxTimeBorn', 'lynxLastBreed', 'lynxHungry',
+               'lynxEatHistory', 'lynxEatIndex', 'lynxEaten3', 'lynxEaten7', 'lynxEaten14',
+               'lynxXDirection', 'lynxYDirection', 'lynxSpeed', 'lynxHuntDistance')
+
+
+class VectorizedModel:
+    def __init__(self, width=100, height=100, nHares=2000, nMountains=10, nForest=200, nLynx=5, killProb=0.4, breedProbHares = 0.05, breedProbLynx = 0.0192, maximumHares = 7500, maximumLynx = 25, forestDensityRange = 5, mountainOn = False, forestOn = False, seed = None, legacyRemoval = False, useKernels = None, profile = False):
+        """
+        Struct-of-arrays version of simulation.Model.
+        Takes the same parameters and follows the same rules, but every hare and lynx is a
+        row in a set of NumPy arrays instead of an object, so each phase of a timestep
+        is done with whole-array operations.
+        All random numbers come from the model's own generator, seed can be an integer,
+        a numpy SeedSequence or an existing numpy Generator.
+        legacyRemoval skips the animal after every killed hare and starved lynx, like
+        the old list removal during iteration of simulation.Model did.
+        useKernels runs the hunt and the lynx movement with the loop kernels of the
+        kernels module instead of NumPy operations. By default they are used only
+        when Numba is installed to compile them, as plain Python they are much slower;
+        both ways give the same run.
+        With profile every timestep is timed per phase and counted, see profiling.Profiler.
+        """
+        self.rng = np.random.default_rng(seed)
+        self.profiler = profiling.Profiler() if profile else None
+        self.legacyRemoval = legacyRemoval
+        self.useKernels = kernels.numba is not None if useKernels is None else useKernels
+        self.height = height
+        self.width = width
+        self.nHares = nHares
+        self.nLynx = nLynx
+        self.nMountains = nMountains
+        self.nForest = nForest
+        self.killProb = killProb
+        self.breedProbHares = breedProbHares
+        self.breedProbLynx = breedProbLynx
+        self.maxHares = maximumHares
+        self.maxLynx = maximumLynx
+        self.forestDensityRange = forestDensityRange
+
+        """
+        Data parameters
+        To record the evolution of the model
+        """
+        self.LynxDeathCount = 0
+        self.HaresDeathCount = 0
+
+        """
+        Population setters
+        The hares and lynxes are stored column wise: one array per attribute,
+        one row per animal.
+        """
+        self.set_hare_population()
+        self.set_lynx_population()
+
+        if mountainOn:
+            self.Mountains = self.set_mountain()
+        else:
+            self.Mountains = np.zeros((0, 2), dtype=int)
+
+        if forestOn:
+            self.Forests = self.set_forest()
+        else:
+            self.Forests = np.zeros((0, 2), dtype=int)
+
+        """
+        The terrain never changes, so it is turned into grids once: whether a cell
+        is on a mountain and the kill probability of a lynx standing on it.
+        """
+        self.mountainMask = terrain.mountain_mask(self.Mountains, self.width, self.height)
+        self.forestCount = terrain.forest_counts(self.Forests, self.width, self.height, self.forestDensityRange)
+        self.killProbField = terrain.kill_probability_field(self.forestCount, self.killProb)
+
+        """
+        Cell list over the hare positions, the cells are as large as the longest
+        hunt distance.
+        """
+        self.hareGrid = PeriodicGrid(self.width, self.height, cellSize=10)
+
+    def set_mountain(self):
+        """
+        This function makes the initial Mountains, they are 10x10 grids long.
+        Returns an array with the position of every mountain cell.
+        """
+        x = self.rng.integers(10, self.width - 10, size=self.nMountains)
+        y = self.rng.integers(10, self.height - 10, size=self.nMountains)
+        steps = np.arange(1, 11)
+        cellsX = np.repeat(x[:, None] + steps, 10, axis=1)
+        cellsY = np.tile(y[:, None] + steps, 10)
+
+        return np.column_stack((cellsX.ravel(), cellsY.ravel()))
+
+    def set_forest(self):
+        """
+        This function makes the initial forests, the trees are put randomly in the grid.
+        Returns an array with the position of every tree.
+        """
+        x = self.rng.integers(self.width, size=self.nForest)
+        y = self.rng.integers(self.height, size=self.nForest)
+
+        return np.column_stack((x, y))
+
+    def set_hare_population(self):
+        """
+        This function makes the initial Hare population. The positions are randomized
+        and each Hare has a random chance of either being a woman or a man.
+        """
+        self.hareX = self.rng.integers(self.width, size=self.nHares)
+        self.hareY = self.rng.integers(self.height, size=self.nHares)
+        self.hareState = np.where(self.rng.random(self.nHares) < 0.5, MALE, FEMALE)
+        self.hareTimeBorn = np.zeros(self.nHares, dtype=int)
+        self.hareLastBreed = np.zeros(self.nHares, dtype=int)
+
+    def set_lynx_population(self):
+        """
+        This function makes the initial lynx population. The positions are randomized
+        and each Lynx has a random chance of either being a woman or a man.
+        The eat history keeps the kills of the last 14 timesteps; that is all the
+        starvation and hunting rules look at. Every row is a ring buffer whose oldest
+        entry is at lynxEatIndex, next to it the totals over the last 3, 7 and 14
+        timesteps are kept up to date, so the memory per lynx stays the same however
+        long the run is.
+        """
+        self.lynxX = self.rng.integers(self.width, size=self.nLynx)
+        self.lynxY = self.rng.integers(self.height, size=self.nLynx)
+        self.lynxState = np.where(self.rng.random(self.nLynx) < 0.5, MALE, FEMALE)
+        self.lynxTimeBorn = np.zeros(self.nLynx, dtype=int)
+        self.lynxLastBreed = np.zeros(self.nLynx, dtype=int)
+        self.lynxHungry = np.zeros(self.nLynx, dtype=int)
+        self.lynxEatHistory = np.zeros((self.nLynx, 14), dtype=int)
+        self.lynxEatIndex = np.zeros(self.nLynx, dtype=int)
+        self.lynxEaten3 = np.zeros(self.nLynx, dtype=int)
+        self.lynxEaten7 = np.zeros(self.nLynx, dtype=int)
+        self.lynxEaten14 = np.zeros(self.nLynx, dtype=int)
+        self.lynxXDirection = np.zeros(self.nLynx, dtype=int)
+        self.lynxYDirection = np.zeros(self.nLynx, dtype=int)
+        self.lynxSpeed = np.ones(self.nLynx)
+        self.lynxHuntDistance = np.full(self.nLynx, 5)
+
+    @property
+    def LynxPopulation(self):
+        """
+        Positions of the living lynxes as an (n, 2) array, so len() gives the
+        population size just like the list of simulation.Model.
+        """
+        return np.column_stack((self.lynxX, self.lynxY))
+
+    @property
+    def HaresPopulation(self):
+        """
+        Positions of the living hares as an (n, 2) array.
+        """
+        return np.column_stack((self.hareX, self.hareY))
+
+    def update(self):
+        """
+        Perform everything each timestep.
+        """
+        prof = self.profiler
+        if prof is not None:
+            prof.start(self.lynxX.size, self.hareX.size)
+
+        self.move_lynx()
+
+        """
+        The newborn lynxes age, after 150 days they will become mature,
+        either a man or a woman.
+        """
+        self.lynxTimeBorn += 1
+        mature = np.flatnonzero(self.lynxTimeBorn == 150)
+        self.lynxState[mature] = self.random_sex(mature.size)
+        if prof is not None:
+            prof.lap('moveLynx')
+
+        self.hunt()
+        if prof is not None:
+            prof.lap('hunt')
+
+        self.move_hares()
+
+        """
+        The newborn hares age only while they are babies, after a month they become
+        mature. Like in simulation.Model the sex is drawn again every timestep
+        for the hares whose time_born stays at 15.
+        """
+        self.hareTimeBorn[self.hareState == BABY] += 1
+        mature = np.flatnonzero(self.hareTimeBorn == 15)
+        self.hareState[mature] = self.random_sex(mature.size)
+        if prof is not None:
+            prof.lap('moveHares')
+
+        """
+        The breeding probabilities depend on the population sizes before breeding,
+        see simulation.Model.update for the reasoning, also when the lynx died out.
+        """
+        nLynx = self.lynxX.size
+        nHares = self.hareX.size
+        if nHares >= self.maxHares * 0.75:
+            probbreedHares = self.breedProbHares/math.sqrt(max(nLynx, 1)) * 0.1
+        else:
+            probbreedHares = self.breedProbHares/math.sqrt(max(nLynx, 1)) * 0.5
+
+        if nLynx >= self.maxLynx * 0.75:
+            probbreedLynx = self.breedProbLynx/1000 * math.sqrt(nHares)
+        else:
+            probbreedLynx = self.breedProbLynx/10000 * nHares
+
+        self.breed_hares(probbreedHares)
+        self.breed_lynx(probbreedLynx)
+        if prof is not None:
+            prof.lap('breeding')
+            prof.count('haresBorn', self.hareX.size - nHares)
+            prof.count('lynxBorn', self.lynxX.size - nLynx)
+            lynxDeathsBefore = self.LynxDeathCount
+
+        self.starve_lynx()
+        if prof is not None:
+            prof.lap('starvation')
+            prof.count('lynxStarved', self.LynxDeathCount - lynxDeathsBefore)
+            prof.stop()
+
+        return self.lynxX.size, self.hareX.size
+
+    def random_sex(self, n):
+        """
+        Draws the state of n maturing animals, male or female with equal chance.
+        """
+        return np.where(self.rng.random(n) < 0.5, MALE, FEMALE)
+
+    def move_lynx(self):
+        """
+        Moves all lynxes, they keep the same random direction for seven steps.
+        Hungry lynxes move faster and hunt further away, on mountains they move slower.
+        A direction is drawn for every lynx, but only the ones starting a new seven
+        step period use it.
+        """
+        n = self.lynxX.size
+        deltaX = self.rng.integers(-2, 3, size=n)
+        deltaY = self.rng.integers(-2, 3, size=n)
+
+        if self.useKernels:
+            kernels.move_lynx(self.lynxX, self.lynxY, self.lynxXDirection, self.lynxYDirection, self.lynxSpeed,
+                              self.lynxHuntDistance, self.lynxTimeBorn, self.lynxEaten7, deltaX, deltaY,
+                              self.mountainMask, self.width, self.height)
+            return
+
+        """
+        In simulation.Lynx.move the huntDistance of 8 for the 3 step rule is always
+        overwritten by the 7 step rule, so only the distances 5 and 10 occur.
+        """
+        hungry = (self.lynxEaten7 < 3) & (self.lynxTimeBorn > 20)
+        self.lynxSpeed = np.where(hungry, 1.25, 1.0)
+        self.lynxHuntDistance = np.where(hungry, 10, 5)
+
+        newDirection = self.lynxTimeBorn % 7 == 0
+        self.lynxXDirection[newDirection] = deltaX[newDirection]
+        self.lynxYDirection[newDirection] = deltaY[newDirection]
+
+        self.lynxSpeed[self.mountainMask[self.lynxX, self.lynxY]] = 0.25
+
+        """
+        Periodic boundaries, the position is truncated towards zero before wrapping
+        just like int() does in simulation.Lynx.move.
+        """
+        self.lynxX = np.trunc(self.lynxX + self.lynxXDirection * self.lynxSpeed).astype(int) % self.width
+        self.lynxY = np.trunc(self.lynxY + self.lynxYDirection * self.lynxSpeed).astype(int) % self.height
+
+    def lynx_kill_probability(self):
+        """
+        The density of the forest around each lynx decreases their kill probability,
+        looked up in the precomputed kill probability grid.
+        """
+        return self.killProbField[self.lynxX, self.lynxY]
+
+    def hunt(self):
+        """
+        Every lynx hunts the hares close by, in the order of the lynx arrays. A lynx
+        kills each nearby hare with its kill probability, up to 3 hares per timestep.
+
+        Hunt window: a hare is close by when it is at most huntDistance (5 or 10)
+        cells away from the lynx along both the x and the y axis, where the distance
+        is measured the short way around the periodic grid. So the window is the
+        (2 * huntDistance + 1) square centred on the lynx, wrapped at the edges.
+        The hares in the window are visited in the order of the hare arrays, a hare
+        killed by an earlier lynx can not be killed again.
+        This replaces the test in simulation.Model.update, which does not wrap and
+        whose y part, abs(... <= huntDistance), accepts every hare below the lynx.
+
+        The windows of all lynxes are collected first, so the kill trials of the whole
+        phase are drawn at once; the draws for hares killed earlier go unused.
+        """
+        killProbs = self.lynx_kill_probability()
+        alive = np.ones(self.hareX.size, dtype=bool)
+
+        self.hareGrid.rebuild(self.hareX, self.hareY)
+
+        if self.useKernels:
+            grid = self.hareGrid
+            windows, offsets, tested = kernels.window_hares(self.hareX, self.hareY, self.lynxX, self.lynxY,
+                                                            self.lynxHuntDistance, grid.order, grid.start,
+                                                            grid.cellSize, grid.nCellsX, grid.nCellsY,
+                                                            self.width, self.height)
+            draws = self.rng.random(windows.size)
+            kernels.hunt(windows, offsets, killProbs, self.lynxHungry, draws, alive, self.legacyRemoval)
+            self.count_hunt(tested, draws.size, alive)
+            self.HaresDeathCount += int(np.count_nonzero(~alive))
+            self.remove_hares(alive)
+            return
+
+        windows = [self.hareGrid.query(self.lynxX[i], self.lynxY[i], self.lynxHuntDistance[i])
+                   for i in range(self.lynxX.size)]
+        draws = self.rng.random(sum(candidates.size for candidates in windows))
+
+        start = 0
+        for i, candidates in enumerate(windows):
+            success = draws[start:start + candidates.size] <= killProbs[i]
+            start += candidates.size
+            hits = candidates[success & alive[candidates]]
+            appetite = max(3 - self.lynxHungry[i], 0)
+            if self.legacyRemoval:
+                kills = legacy_kills(hits, alive, appetite)
+            else:
+                kills = hits[:appetite]
+            alive[kills] = False
+            self.lynxHungry[i] += kills.size
+
+        self.count_hunt(self.hareGrid.tested, draws.size, alive)
+        self.HaresDeathCount += int(np.count_nonzero(~alive))
+        self.remove_hares(alive)
+
+    def count_hunt(self, checks, attempts, alive):
+        """
+        Adds the distance checks, kill trials and kills of the hunt to the profiler.
+        """
+        if self.profiler is not None:
+            self.profiler.count('distanceChecks', checks)
+            self.profiler.count('killsAttempted', attempts)
+            self.profiler.count('kills', int(np.count_nonzero(~alive)))
+
+    def move_hares(self):
+        """
+        Moves the hares one step in a random direction, with periodic boundaries.
+        """
+        n = self.hareX.size
+        self.hareX = (self.hareX + self.rng.integers(-2, 3, size=n)) % self.width
+        self.hareY = (self.hareY + self.rng.integers(-2, 3, size=n)) % self.height
+
+    def breed_hares(self, probbreedHares):
+        """
+        Females always try to breed, males only when more than 50 timesteps passed
+        since they last bred. The babies are born at the position of their parent.
+        """
+        self.hareLastBreed += 1
+        canBreed = (self.hareState == FEMALE) | ((self.hareState == MALE) & (self.hareLastBreed > 50))
+        candidates = np.flatnonzero(canBreed)
+        parents = candidates[self.rng.random(candidates.size) <= probbreedHares]
+        self.hareLastBreed[parents] = 0
+
+        """
+        In simulation.Model the babies join the list that is being iterated over,
+        so their lastbreed is raised once in the timestep they are born.
+        """
+        n = parents.size
+        self.add_animals(HARE_ARRAYS, n, {'hareX': self.hareX[parents],
+                                          'hareY': self.hareY[parents],
+                                          'hareState': np.full(n, BABY),
+                                          'hareLastBreed': np.ones(n, dtype=int)})
+
+    def breed_lynx(self, probbreedLynx):
+        """
+        Males always try to breed, females only when more than 50 timesteps passed
+        since they last bred. The babies are born at the position of their parent.
+        """
+        self.lynxLastBreed += 1
+        canBreed = (self.lynxState == MALE) | ((self.lynxState == FEMALE) & (self.lynxLastBreed > 50))
+        candidates = np.flatnonzero(canBreed)
+        parents = candidates[self.rng.random(candidates.size) <= probbreedLynx]
+        self.lynxLastBreed[parents] = 0
+
+        n = parents.size
+        self.add_animals(LYNX_ARRAYS, n, {'lynxX': self.lynxX[parents],
+                                          'lynxY': self.lynxY[parents],
+                                          'lynxState': np.full(n, BABY),
+                                          'lynxLastBreed': np.ones(n, dtype=int),
+                                          'lynxSpeed': np.ones(n),
+                                          'lynxHuntDistance': np.full(n, 5)})
+
+    def starve_lynx(self):
+        """
+        Lynxes die of starvation if not eaten enough, they need to eat atleast 5 hares
+        in the last 14 timesteps to survive. Afterwards the lynxes are hungry again.
+        With legacyRemoval the lynx after a starved one is skipped: its kills are not
+        recorded and it stays hungry, so they count for the next timestep.
+        """
+        rows = np.arange(self.lynxX.size)
+        oldest = self.lynxEatHistory[rows, self.lynxEatIndex]
+        starving = (self.lynxEaten14 + self.lynxHungry - oldest < 5) & (self.lynxTimeBorn > 30)
+        if self.legacyRemoval:
+            rows = rows[legacy_visited(starving)]
+
+        """
+        Push the kills of this timestep in the ring buffers, the entries that drop out of
+        the 3, 7 and 14 step totals are 3, 7 and 14 places back.
+        """
+        index = self.lynxEatIndex[rows]
+        kills = self.lynxHungry[rows]
+        self.lynxEaten3[rows] += kills - self.lynxEatHistory[rows, (index - 3) % 14]
+        self.lynxEaten7[rows] += kills - self.lynxEatHistory[rows, (index - 7) % 14]
+        self.lynxEaten14[rows] += kills - self.lynxEatHistory[rows, index]
+        self.lynxEatHistory[rows, index] = kills
+        self.lynxEatIndex[rows] = (index + 1) % 14
+        self.lynxHungry[rows] = 0
+
+        visited = np.zeros(self.lynxX.size, dtype=bool)
+        visited[rows] = True
+
+        alive = ~(starving & visited)
+        self.LynxDeathCount += int(np.count_nonzero(~alive))
+        self.remove_lynx(alive)
+
+    def remove_hares(self, alive):
+        """
+        Keeps only the hares for which alive is True.
+        """
+        for name in HARE_ARRAYS:
+            setattr(self, name, getattr(self, name)[alive])
+
+    def remove_lynx(self, alive):
+        """
+        Keeps only the lynxes for which alive is True.
+        """
+        for name in LYNX_ARRAYS:
+            setattr(self, name, getattr(self, name)[alive])
+
+    def add_animals(self, names, n, values):
+        """
+        Appends n animals to the arrays in names. values gives the new rows of some of
+        the arrays, the other arrays get rows of zeros.
+        """
+        for name in names:
+            old = getattr(self, name)
+            new = values.get(name)
+            if new is None:
+                new = np.zeros((n,) + old.shape[1:], dtype=old.dtype)
+            setattr(self, name, np.concatenate((old, new)))
+
+
+def legacy_visited(removed):
+    """
+    Which animals a loop that removes items from the list it iterates over would
+    visit: the item after every removed one shifts into its place and is skipped.
+    """
+    visited = np.ones(removed.size, dtype=bool)
+    skip = False
+    for i in range(removed.size):
+        if skip:
+            visited[i] = False
+            skip = False
+        elif removed[i]:
+            skip = True
+    return visited
+
+
+def legacy_kills(hits, alive, appetite):
+    """
+    The kills of one lynx when every kill skips the next living hare, like the
+    removal from HaresPopulation during the hunting loop of the old simulation.Model.
+    hits are the hares in the window whose kill trial succeeded, in array order.
+    """
+    kills = []
+    skipped = -1
+    for k in hits:
+        if len(kills) == appetite:
+            break
+        if k == skipped:
+            continue
+        kills.append(k)
+        after = np.flatnonzero(alive[k + 1:])
+        skipped = k + 1 + after[0] if after.size else -1
+    return np.array(kills, dtype=int)
@@ -5,79 +5,165 @@ Created on Mon Jan 15 16:17:28 2024
 @author: luukv
 """
 
+import time
 import numpy as np
 import matplotlib.pyplot as plt
 
 
 class Visualization:
-    def __init__(self, height, width, pauseTime=0.05):
+    def __init__(self, height, width, pauseTime=0.05, renderEvery=1, targetFps=None, blit=True):
         """
         This simple visualization shows the population of hares and lynx.
         Each subject is color coded according to its state.
+        Only every renderEvery-th timestep is drawn, and with targetFps at most that
+        many frames per second, so the simulation is not slowed down by the window.
+        Where the backend supports it the frames are drawn with blitting: only the
+        image and the title are redrawn on top of a saved copy of the rest of the figure.
+        With blit=False the figure is drawn normally, e.g. to save frames to files.
         """
         self.h = height
         self.w = width
         self.pauseTime = pauseTime
-        grid = np.zeros((self.w, self.h))
-        self.im = plt.imshow(grid, vmin=-75, vmax=50, cmap='nipy_spectral')
+        self.renderEvery = renderEvery
+        self.targetFps = targetFps
+        self.lastRender = -np.inf
+        self.pending = None
+
         """
-        Color information
+        The grid is painted in place every frame. The mountains and forests never
+        change, they are painted once in the terrain layer.
         """
-        fig = plt.gcf()
+        self.grid = np.zeros((self.w, self.h))
+        self.terrain = None
+        self.terrainMask = None
+        self.terrainSource = None
 
-        fig.text(0.02, 0.35, 'Lynx', color='red', fontsize=14)
-        fig.text(0.02, 0.2, 'Forests', color='green', fontsize=14)
-        fig.text(0.02, 0.3, 'Hares', color='blue', fontsize=14)
-        fig.text(0.02, 0.25, 'Mountains', color='purple', fontsize=14)
+        self.fig = plt.gcf()
+        self.ax = plt.gca()
+        self.blit = blit and getattr(self.fig.canvas, 'supports_blit', False)
+        self.im = self.ax.imshow(self.grid, vmin=-75, vmax=50, cmap='nipy_spectral', animated=self.blit)
+        self.title = self.ax.text(0.5, 1.02, '', transform=self.ax.transAxes, ha='center',
+                                  fontsize='large', animated=self.blit)
+        """
+        Color information
+        """
+        self.fig.text(0.02, 0.35, 'Lynx', color='red', fontsize=14)
+        self.fig.text(0.02, 0.2, 'Forests', color='green', fontsize=14)
+        self.fig.text(0.02, 0.3, 'Hares', color='blue', fontsize=14)
+        self.fig.text(0.02, 0.25, 'Mountains', color='purple', fontsize=14)
 
         plt.subplots_adjust(left=0.3)
 
+        """
+        The background is saved again after every full redraw, e.g. when the window
+        is resized.
+        """
+        self.background = None
+        if self.blit:
+            self.fig.canvas.mpl_connect('draw_event', self.on_draw)
+            plt.show(block=False)
+            plt.pause(0.01)
+
+    def on_draw(self, event):
+        """
+        Saves the background after a full redraw and draws the frame on top of it.
+        """
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.ax.draw_artist(self.im)
+        self.ax.draw_artist(self.title)
+
     def update(self, t, LynxPopulation, HaresPopulation, Mountains, Forests):
         """
-        Updates the data array, and draws the data.
+        Updates the data array, and draws the data, when this timestep is rendered.
         """
-        grid = np.zeros((self.w, self.h))
+        if t % self.renderEvery != 0 or (self.targetFps is not None
+                                         and time.perf_counter() - self.lastRender < 1 / self.targetFps):
+            self.pending = (t, LynxPopulation, HaresPopulation, Mountains, Forests)
+            return
+        self.render(t, LynxPopulation, HaresPopulation, Mountains, Forests)
 
+    def render(self, t, LynxPopulation, HaresPopulation, Mountains, Forests):
         """
-        Visualise the Lynxes, Hares, Mountains and Forests (trees).
+        Paints and draws one frame.
         """
-        
-        ## kleur grid is 35-50
+        self.pending = None
+        self.lastRender = time.perf_counter()
+        self.paint(LynxPopulation, HaresPopulation, Mountains, Forests)
+        self.im.set_data(self.grid)
+        self.title.set_text('t = %i' % t)
+
+        if self.blit and self.background is not None:
+            self.fig.canvas.restore_region(self.background)
+            self.ax.draw_artist(self.im)
+            self.ax.draw_artist(self.title)
+            self.fig.canvas.blit(self.fig.bbox)
+            self.fig.canvas.flush_events()
+        else:
+            self.fig.canvas.draw_idle()
+            plt.pause(0.01)
 
-        for h in HaresPopulation:
-            grid[h.position[0]][h.position[1]] = -40
-        
-        for m in Mountains:
-            grid[m.position[0]][m.position[1]] = -60
-        
-        for f in Forests:
-            grid[f.position[0]][f.position[1]] = -20
-            
-        for l in LynxPopulation:
-            grid[l.position[0]][l.position[1]] = 30
+    def paint(self, LynxPopulation, HaresPopulation, Mountains, Forests):
+        """
+        Visualise the Lynxes, Hares, Mountains and Forests (trees). The cells are
+        painted with fancy indexing, the terrain covers the hares and the lynxes are
+        painted on top of everything.
+        """
+        ## kleur grid is 35-50
+        if self.terrainSource != (id(Mountains), id(Forests)):
+            self.terrain = np.zeros((self.w, self.h))
+            m = positions(Mountains)
+            self.terrain[m[:, 0], m[:, 1]] = -60
+            f = positions(Forests)
+            self.terrain[f[:, 0], f[:, 1]] = -20
+            self.terrainMask = self.terrain != 0
+            self.terrainSource = (id(Mountains), id(Forests))
 
-        self.im.set_data(grid)
+        self.grid.fill(0)
+        h = positions(HaresPopulation)
+        self.grid[h[:, 0], h[:, 1]] = -40
+        np.copyto(self.grid, self.terrain, where=self.terrainMask)
+        l = positions(LynxPopulation)
+        self.grid[l[:, 0], l[:, 1]] = 30
 
-        plt.draw()
-        plt.title('t = %i' % t)
-        plt.pause(0.01)
+    def save_frame(self, fileName, t, LynxPopulation, HaresPopulation, Mountains, Forests):
+        """
+        Paints one timestep and saves the figure to fileName instead of showing it.
+        """
+        self.paint(LynxPopulation, HaresPopulation, Mountains, Forests)
+        self.im.set_data(self.grid)
+        self.title.set_text('t = %i' % t)
+        self.fig.savefig(fileName)
 
     def persist(self):
         """
         Use this method if you want to have the visualization persist after the
-        calling the update method for the last time.
+        calling the update method for the last time. A last timestep that was
+        skipped is drawn first.
         """
+        if self.pending is not None:
+            self.render(*self.pending)
         plt.show()
 
 
+def positions(agents):
+    """
+    The positions of a population as an (n, 2) array. The populations are either
+    lists of agents with a position (simulation.Model) or arrays of positions
+    (simulation_vectorized.VectorizedModel).
+    """
+    if isinstance(agents, np.ndarray):
+        return agents.reshape(-1, 2)
+    return np.array([a.position for a in agents], dtype=int).reshape(-1, 2)
+
+
 """
 * EXAMPLE USAGE *
 
 sim = Model()
-vis = visualization.Visualization(sim.height, sim.width)
+vis = visualization.Visualization(sim.height, sim.width, renderEvery=5, targetFps=30)
 maxT = 100
 for t in range(maxT):
     sim.update()
-    vis.update()
+    vis.update(t, sim.LynxPopulation, sim.HaresPopulation, sim.Mountains, sim.Forests)
 vis.persist()
 """
@@ -0,0 +1,140 @@
+import numpy as np
+
+
+class PeriodicGrid:
+    def __init__(self, width, height, cellSize=10):
+        """
+        Cell list over points on the width x height grid with periodic boundaries,
+        the same wrap around Hare.move and Lynx.move use.
+        The grid is cut into square cells of cellSize, the points are sorted by cell
+        so a query only has to look at the cells that overlap its window.
+        tested counts the points whose distance was tested since the last rebuild.
+        """
+        self.width = width
+        self.height = height
+        self.cellSize = cellSize
+        self.nCellsX = -(-width // cellSize)
+        self.nCellsY = -(-height // cellSize)
+        self.rebuild(np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+
+    def rebuild(self, x, y):
+        """
+        Sorts the points into their cells with sort_keys, a radix sort that costs
+        O(points) for up to 2**16 cells, so it is cheap enough to redo every timestep.
+        """
+        self.x = x
+        self.y = y
+        cell = (x // self.cellSize) * self.nCellsY + y // self.cellSize
+        self.order = sort_keys(cell, self.nCellsX * self.nCellsY)
+        self.tested = 0
+        counts = np.bincount(cell, minlength=self.nCellsX * self.nCellsY)
+        self.start = np.concatenate(([0], np.cumsum(counts)))
+
+    def query(self, cx, cy, distance):
+        """
+        Returns the indices of all points that are at most distance away from
+        (cx, cy) along both axes, measuring the distance the short way around the
+        periodic grid. The indices are sorted, so callers visit the points in the
+        same order as the arrays passed to rebuild.
+        """
+        cellsX = window_cells(cx, distance, self.width, self.cellSize)
+        cellsY = window_cells(cy, distance, self.height, self.cellSize)
+        cells = (cellsX[:, None] * self.nCellsY + cellsY[None, :]).ravel()
+
+        slices = [self.order[self.start[c]:self.start[c + 1]] for c in cells]
+        if not slices:
+            return np.zeros(0, dtype=int)
+        candidates = np.concatenate(slices)
+        self.tested += candidates.size
+
+        dx = np.abs(self.x[candidates] - cx)
+        dy = np.abs(self.y[candidates] - cy)
+        inside = (np.minimum(dx, self.width - dx) <= distance) \
+            & (np.minimum(dy, self.height - dy) <= distance)
+
+        return np.sort(candidates[inside])
+
+
+def sort_keys(keys, nKeys):
+    """
+    The stable sorting order of integer keys from 0 up to nKeys. NumPy sorts 16 bit
+    integers with a radix sort, in linear time, so keys that fit are sorted as uint16;
+    more keys fall back to the O(n log n) stable sort.
+    """
+    if nKeys <= 2**16:
+        return np.argsort(keys.astype(np.uint16), kind='stable')
+    return np.argsort(keys, kind='stable')
+
+
+def window_cells(c, distance, size, cellSize):
+    """
+    The cells along one axis that overlap the coordinates c - distance up to
+    c + distance, wrapped around an axis of the given size.
+    """
+    if 2 * distance + 1 >= size:
+        return np.arange(-(-size // cellSize))
+
+    low = (c - distance) % size
+    high = (c + distance) % size
+    if low <= high:
+        return np.arange(low // cellSize, high // cellSize + 1)
+
+    """
+    The window wraps around the edge, it is split in the part up to the last
+    coordinate and the part from zero.
+    """
+    return np.unique(np.concatenate((np.arange(low // cellSize, (size - 1) // cellSize + 1),
+                                     np.arange(0, high // cellSize + 1))))
+
+
+def window_pairs(x, y, layer, cx, cy, distance, queryLayer, width, height):
+    """
+    All pairs of a query and a point in the same layer where the point is at most
+    distance away from the query position along both axes, on a periodic width x
+    height grid; the same test as PeriodicGrid.query, but for many queries at once
+    without a Python loop over them.
+    The points are sorted by layer, x and y, see sort_keys. The window of a query is a block of at
+    most 2 * distance + 1 columns, and within each column one or two runs of y values,
+    which are found with a binary search in the sorted points.
+    Returns the query and point indices as two arrays ordered by query and then point.
+    """
+    key = (layer * width + x) * height + y
+    order = sort_keys(key, (int(np.max(layer, initial=0)) + 1) * width * height)
+    key = key[order]
+
+    cx = np.asarray(cx)
+    cy = np.asarray(cy)
+    distance = np.asarray(distance)
+    queryLayer = np.asarray(queryLayer)
+
+    """
+    One row per query and column, the columns of a wide window are not repeated.
+    """
+    nColumns = np.minimum(2 * distance + 1, width)
+    query = np.repeat(np.arange(cx.size), nColumns)
+    column = np.arange(query.size) - np.repeat(np.cumsum(nColumns) - nColumns, nColumns)
+    column = (cx[query] - distance[query] + column) % width
+    base = (queryLayer[query] * width + column) * height
+
+    """
+    The y runs of every column, a window that wraps around the y axis is split in
+    the part from low up to the last coordinate and the part from zero up to high.
+    """
+    d = distance[query]
+    full = 2 * d + 1 >= height
+    low = np.where(full, 0, (cy[query] - d) % height)
+    high = np.where(full, height - 1, (cy[query] + d) % height)
+    wraps = low > high
+    runQuery = np.concatenate((query, query[wraps]))
+    runLow = np.concatenate((base + np.where(wraps, 0, low), base[wraps] + low[wraps]))
+    runHigh = np.concatenate((base + high, base[wraps] + height - 1))
+
+    starts = np.searchsorted(key, runLow, side='left')
+    ends = np.searchsorted(key, runHigh, side='right')
+    lengths = ends - starts
+    owner = np.repeat(runQuery, lengths)
+    offsets = np.arange(owner.size) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    points = order[np.repeat(starts, lengths) + offsets]
+
+    pairs = np.lexsort((points, owner))
+    return owner[pairs], points[pairs]
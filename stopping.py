@@ -0,0 +1,115 @@
+import numpy as np
+
+import cycles as cycle_detection
+
+"""
+The reasons a run can stop early, reported by StoppingRule.check.
+"""
+LYNX_EXTINCT = 'lynxExtinct'
+HARES_EXTINCT = 'haresExtinct'
+CAPACITY = 'capacity'
+CYCLE = 'cycle'
+
+
+class StoppingRule:
+    def __init__(self, extinction=True, capacity=None, capacityWindow=100, cycles=None, cycleTolerance=0.1,
+                 detector=None):
+        """
+        Conditions on which a run is decided and can stop before its last timestep:
+            extinction      the lynx or the hares died out
+            capacity        the hares stayed at or above capacity * maxHares for the last
+                            capacityWindow timesteps, None to switch it off
+            cycles          the periods and the heights of the last cycles hare peaks
+                            differ less than cycleTolerance relative to their mean,
+                            None to switch it off
+        The peaks are found during the run by the cycles.CycleDetector detector, a
+        default one when None, that keeps the cycle statistics of the run whatever
+        the conditions. start must be called with the model before the first check,
+        which also makes the rule and its detector ready for a new run.
+        """
+        self.extinction = extinction
+        self.capacity = capacity
+        self.capacityWindow = capacityWindow
+        self.cycles = cycles
+        self.cycleTolerance = cycleTolerance
+        self.detector = cycle_detection.CycleDetector() if detector is None else detector
+        if cycles is not None and cycles > self.detector.hares.keep:
+            raise ValueError(f'the detector keeps only {self.detector.hares.keep} peaks, {cycles} are needed')
+
+    def settings(self):
+        """
+        The settings of the rule and its detector as a dict, two rules with the same
+        settings stop a run at the same timestep.
+        """
+        return {'extinction': self.extinction, 'capacity': self.capacity, 'capacityWindow': self.capacityWindow,
+                'cycles': self.cycles, 'cycleTolerance': self.cycleTolerance, 'delta': self.detector.hares.delta,
+                'haresMinDelta': self.detector.hares.minDelta, 'lynxMinDelta': self.detector.lynx.minDelta,
+                'keep': self.detector.hares.keep}
+
+    def start(self, sim):
+        """
+        Resets the rule for a run of sim.
+        """
+        self.maxHares = sim.maxHares
+        self.atCapacity = 0
+        self.detector.reset()
+        self.steps = 0
+        self.reason = None
+
+    def check(self, nLynx, nHares):
+        """
+        Adds the populations after a timestep, returns the reason to stop or None to
+        go on. The reason is also kept in reason.
+        """
+        haresEvent, _ = self.detector.add(self.steps, nLynx, nHares)
+        self.steps += 1
+        if self.extinction and nLynx == 0:
+            self.reason = LYNX_EXTINCT
+        elif self.extinction and nHares == 0:
+            self.reason = HARES_EXTINCT
+        elif self.capacity is not None and self.at_capacity(nHares):
+            self.reason = CAPACITY
+        elif self.cycles is not None and haresEvent == cycle_detection.PEAK and self.cycling():
+            self.reason = CYCLE
+        return self.reason
+
+    def at_capacity(self, nHares):
+        """
+        Counts the timesteps in a row the hares are at capacity.
+        """
+        self.atCapacity = self.atCapacity + 1 if nHares >= self.capacity * self.maxHares else 0
+        return self.atCapacity >= self.capacityWindow
+
+    def cycling(self):
+        """
+        Whether the last cycles hare peaks are regular.
+        """
+        peaks = list(self.detector.hares.recent)[-self.cycles:]
+        if len(peaks) < self.cycles or np.isnan(peaks[0][2]):
+            return False
+        _, heights, periods, _ = np.array(peaks).T
+        return regular(periods, self.cycleTolerance) and regular(heights, self.cycleTolerance)
+
+
+def regular(values, tolerance):
+    """
+    Whether all values lie within tolerance of their mean, relative to the mean.
+    """
+    mean = np.mean(values)
+    return mean > 0 and np.max(np.abs(values - mean)) <= tolerance * mean
+
+
+def run(sim, timeSteps, stopping):
+    """
+    Runs sim for at most timeSteps timesteps without any visualization. Returns the
+    lynx and hare population of every timestep that was run, and the reason the run
+    stopped, None when it ran all timeSteps.
+    """
+    LynxAmount = np.zeros(timeSteps, dtype=int)
+    HaresAmount = np.zeros(timeSteps, dtype=int)
+    stopping.start(sim)
+    for t in range(timeSteps):
+        LynxAmount[t], HaresAmount[t] = sim.update()
+        if stopping.check(LynxAmount[t], HaresAmount[t]) is not None:
+            return LynxAmount[:t + 1], HaresAmount[:t + 1], stopping.reason
+    return LynxAmount, HaresAmount, None
@@ -0,0 +1,156 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+import simulation
+import simulation_vectorized
+import stopping as stopping_rules
+
+
+def make_model(params, seed, vectorized=True):
+    """
+    Creates the model for one run, params holds Model constructor arguments.
+    """
+    if vectorized:
+        return simulation_vectorized.VectorizedModel(seed=seed, **params)
+    return simulation.Model(seed=seed, **params)
+
+
+def run_single(params, timeSteps, seed, vectorized=True, stopping=None):
+    """
+    Runs one simulation without any visualization and returns the lynx and hare
+    population of every timestep. With a stopping.StoppingRule the run ends as soon
+    as the rule is met, then the populations of the timesteps that were run and the
+    reason it stopped are returned, see stopping.run.
+    """
+    sim = make_model(params, seed, vectorized)
+    if stopping is not None:
+        return stopping_rules.run(sim, timeSteps, stopping)
+    LynxAmount = np.zeros(timeSteps, dtype=int)
+    HaresAmount = np.zeros(timeSteps, dtype=int)
+    for t in range(timeSteps):
+        LynxAmount[t], HaresAmount[t] = sim.update()
+    return LynxAmount, HaresAmount
+
+
+def run_cycles(params, timeSteps, seed, vectorized=True, stopping=None):
+    """
+    Runs one simulation like run_single but keeps only the cycle statistics of the
+    populations, see cycles.CycleDetector.summary, so the trajectory is never stored.
+    The detector of the stopping.StoppingRule stopping is used, by default a rule that
+    only stops when the lynx or the hares died out. The summary also holds the
+    timesteps that were run as steps and the reason the run stopped as reason.
+    """
+    sim = make_model(params, seed, vectorized)
+    if stopping is None:
+        stopping = stopping_rules.StoppingRule()
+    stopping.start(sim)
+    for t in range(timeSteps):
+        if stopping.check(*sim.update()) is not None:
+            break
+    summary = stopping.detector.summary()
+    summary.update(steps=stopping.steps, reason=stopping.reason)
+    return summary
+
+
+def spawn_seeds(seed, n):
+    """
+    n independent seeds derived from one root seed, the same root seed always gives
+    the same seeds.
+    """
+    return np.random.SeedSequence(seed).spawn(n)
+
+
+def run_sweep(paramSets, timeSteps, seed=1, processes=None, vectorized=True, stopping=None, cache=None):
+    """
+    Runs one simulation for every parameter set, spread over a pool of worker processes.
+    Each parameter set is a dict of Model constructor arguments, e.g.
+    [{'killProb': 0.4}, {'killProb': 0.2, 'forestOn': True}].
+    Every run gets its own seed spawned from seed, so the sweep is reproducible and the
+    runs are statistically independent. processes defaults to the number of CPUs,
+    with processes=1 the runs are done one after another in this process.
+    Returns the lynx and hare populations as arrays of shape (len(paramSets), timeSteps).
+    With a stopping.StoppingRule every run ends as soon as the rule is met. The
+    populations are then masked arrays, masked after the last timestep of every run,
+    and the reasons the runs stopped are returned as a third value, None for the runs
+    that went on until timeSteps.
+    With a runcache.RunCache the runs that are in the cache are loaded instead of run,
+    and the new runs are added to it.
+    """
+    results = map_runs(run_single, paramSets, timeSteps, seed, processes, vectorized, stopping, cache)
+
+    if stopping is not None:
+        LynxAmount = np.ma.masked_all((len(paramSets), timeSteps), dtype=int)
+        HaresAmount = np.ma.masked_all((len(paramSets), timeSteps), dtype=int)
+        for i, (lynx, hares, _) in enumerate(results):
+            LynxAmount[i, :lynx.size] = lynx
+            HaresAmount[i, :hares.size] = hares
+        return LynxAmount, HaresAmount, [r[2] for r in results]
+
+    LynxAmount = np.array([r[0] for r in results]).reshape(len(paramSets), timeSteps)
+    HaresAmount = np.array([r[1] for r in results]).reshape(len(paramSets), timeSteps)
+    return LynxAmount, HaresAmount
+
+
+def run_cycle_sweep(paramSets, timeSteps, seed=1, processes=None, vectorized=True, stopping=None, cache=None):
+    """
+    run_sweep that keeps only the cycle statistics of every run, see run_cycles.
+    Returns a list with the summary of every parameter set.
+    """
+    return map_runs(run_cycles, paramSets, timeSteps, seed, processes, vectorized, stopping, cache)
+
+
+def map_runs(function, paramSets, timeSteps, seed, processes, vectorized, stopping, cache=None):
+    """
+    Calls function(params, timeSteps, seed, vectorized, stopping) for every parameter
+    set with the seeds spawned from seed, spread over processes worker processes.
+    With a runcache.RunCache only the runs that are not cached are made.
+    """
+    seeds = spawn_seeds(seed, len(paramSets))
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    results = [None] * len(paramSets)
+    keys = [None] * len(paramSets)
+    if cache is not None:
+        extra = {} if stopping is None else {'stopping': stopping.settings()}
+        for i, (params, s) in enumerate(zip(paramSets, seeds)):
+            keys[i] = cache.key(params, s, timeSteps, vectorized, function.__name__, extra)
+            cached = cache.get(keys[i][0])
+            if cached is not None:
+                results[i] = unpack(*cached)
+    missing = [i for i, result in enumerate(results) if result is None]
+
+    if processes == 1 or len(missing) < 2:
+        computed = [function(paramSets[i], timeSteps, seeds[i], vectorized, stopping) for i in missing]
+    else:
+        with ProcessPoolExecutor(max_workers=min(processes, len(missing))) as pool:
+            computed = list(pool.map(function, [paramSets[i] for i in missing], [timeSteps] * len(missing),
+                                     [seeds[i] for i in missing], [vectorized] * len(missing),
+                                     [stopping] * len(missing)))
+    for i, result in zip(missing, computed):
+        results[i] = result
+        if cache is not None:
+            cache.put(*keys[i], *pack(result))
+    return results
+
+
+def pack(result):
+    """
+    The columns and the meta of a result of run_single or run_cycles, to be cached.
+    """
+    if isinstance(result, dict):
+        return {}, {'summary': result}
+    columns = {'time': np.arange(len(result[0])), 'lynx': result[0], 'hares': result[1]}
+    return columns, ({'reason': result[2]} if len(result) == 3 else {})
+
+
+def unpack(columns, meta):
+    """
+    The result of run_single or run_cycles from the cached columns and meta.
+    """
+    if 'summary' in meta:
+        return meta['summary']
+    if 'reason' in meta:
+        return columns['lynx'], columns['hares'], meta['reason']
+    return columns['lynx'], columns['hares']
@@ -0,0 +1,48 @@
+import numpy as np
+
+"""
+Raster layers of the terrain. The mountains and forests never change during a run,
+so instead of scanning every mountain cell or tree for every lynx each timestep
+the models build these grids once and look up the value at the lynx position.
+"""
+
+
+def mountain_mask(positions, width, height):
+    """
+    Boolean grid that is True on every cell covered by a mountain.
+    """
+    mask = np.zeros((width, height), dtype=bool)
+    positions = np.asarray(positions, dtype=int).reshape(-1, 2)
+    mask[positions[:, 0], positions[:, 1]] = True
+    return mask
+
+
+def forest_counts(positions, width, height, forestDensityRange):
+    """
+    Grid with for every cell the number of trees at most forestDensityRange away
+    along both axes, the 'trees_nearby' of simulation.Model.update. Like there the
+    window does not wrap around the edges.
+    The sums over the windows are taken from a 2D prefix sum of the tree counts.
+    """
+    positions = np.asarray(positions, dtype=int).reshape(-1, 2)
+    trees = np.zeros((width, height), dtype=int)
+    np.add.at(trees, (positions[:, 0], positions[:, 1]), 1)
+
+    prefix = np.zeros((width + 1, height + 1), dtype=int)
+    prefix[1:, 1:] = trees.cumsum(axis=0).cumsum(axis=1)
+
+    lowX = np.clip(np.arange(width) - forestDensityRange, 0, width)
+    highX = np.clip(np.arange(width) + forestDensityRange + 1, 0, width)
+    lowY = np.clip(np.arange(height) - forestDensityRange, 0, height)
+    highY = np.clip(np.arange(height) + forestDensityRange + 1, 0, height)
+
+    return prefix[np.ix_(highX, highY)] - prefix[np.ix_(lowX, highY)] \
+        - prefix[np.ix_(highX, lowY)] + prefix[np.ix_(lowX, lowY)]
+
+
+def kill_probability_field(counts, killProb):
+    """
+    The kill probability of a lynx standing on each cell, the forest around the
+    lynx makes it harder to hunt: killProb / trees_nearby, or killProb without trees.
+    """
+    return killProb / np.maximum(counts, 1)
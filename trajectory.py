@@ -0,0 +1,245 @@
+import os
+import json
+import shutil
+import subprocess
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib.pyplot as plt
+
+import simulation_visualization
+from simulation_visualization import positions
+from simulation_vectorized import BABY, MALE, FEMALE
+
+"""
+State codes of the 'B', 'M' and 'F' states of simulation.Model, the same codes the
+state arrays of simulation_vectorized.VectorizedModel use.
+"""
+STATE_CODES = {'B': BABY, 'M': MALE, 'F': FEMALE}
+
+
+class TrajectoryRecorder:
+    def __init__(self, directory, width, height, Mountains=(), Forests=(), chunkSize=100):
+        """
+        Records the positions and states of all animals every timestep into the
+        directory, to replay the run later without simulating it again, see Replay.
+        The animals are not followed from step to step, so a timestep is stored as
+        the cells of the animals sorted by cell and delta encoded, with their states
+        in the same order. chunkSize timesteps are kept in memory and then written
+        together as a compressed .npz file. The terrain is stored once in meta.json.
+        """
+        self.directory = directory
+        self.height = height
+        self.cellType = np.uint16 if width * height <= 2**16 else np.uint32
+        self.nSteps = 0
+        self.nChunks = 0
+        self.steps = []
+
+        os.makedirs(directory, exist_ok=True)
+        self.meta = {'width': width, 'height': height, 'chunkSize': chunkSize, 'nSteps': 0,
+                     'Mountains': positions(Mountains).tolist(), 'Forests': positions(Forests).tolist()}
+        self.write_meta()
+
+    def record(self, t, sim):
+        """
+        Records the animals of sim at timestep t, sim is a simulation.Model or a
+        simulation_vectorized.VectorizedModel.
+        """
+        if hasattr(sim, 'lynxX'):
+            lynx = self.encode(sim.lynxX, sim.lynxY, sim.lynxState)
+            hares = self.encode(sim.hareX, sim.hareY, sim.hareState)
+        else:
+            lynx = self.encode_agents(sim.LynxPopulation)
+            hares = self.encode_agents(sim.HaresPopulation)
+        self.steps.append((t,) + lynx + hares)
+        self.nSteps += 1
+        if len(self.steps) == self.meta['chunkSize']:
+            self.write_chunk()
+
+    def encode_agents(self, agents):
+        xy = positions(agents)
+        return self.encode(xy[:, 0], xy[:, 1], [STATE_CODES[a.state] for a in agents])
+
+    def encode(self, x, y, states):
+        """
+        The sorted, delta encoded cells and the states of a population.
+        """
+        cells = np.asarray(x) * self.height + np.asarray(y)
+        order = np.argsort(cells, kind='stable')
+        return (np.diff(cells[order], prepend=0).astype(self.cellType),
+                np.asarray(states, dtype=np.uint8)[order])
+
+    def write_chunk(self):
+        """
+        Writes the buffered timesteps to the next chunk file.
+        """
+        if not self.steps:
+            return
+        t, lynxCells, lynxStates, hareCells, hareStates = zip(*self.steps)
+        np.savez_compressed(chunk_file(self.directory, self.nChunks), time=np.array(t),
+                            nLynx=np.array([c.size for c in lynxCells]),
+                            nHares=np.array([c.size for c in hareCells]),
+                            lynxCells=np.concatenate(lynxCells), lynxStates=np.concatenate(lynxStates),
+                            hareCells=np.concatenate(hareCells), hareStates=np.concatenate(hareStates))
+        self.nChunks += 1
+        self.steps = []
+        self.write_meta()
+
+    def write_meta(self):
+        """
+        Writes the terrain and the number of timesteps in the chunk files.
+        """
+        self.meta['nSteps'] = self.nSteps - len(self.steps)
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as file:
+            json.dump(self.meta, file)
+
+    def close(self):
+        self.write_chunk()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def chunk_file(directory, i):
+    return os.path.join(directory, 'chunk%06d.npz' % i)
+
+
+class Replay:
+    def __init__(self, directory, cacheSize=4):
+        """
+        Reads a trajectory written by TrajectoryRecorder. frame(i) gives the i-th
+        recorded timestep in the form Visualization.update takes, only the chunk that
+        holds it is read, and the last cacheSize chunks are kept decoded.
+        """
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json')) as file:
+            self.meta = json.load(file)
+        self.width = self.meta['width']
+        self.height = self.meta['height']
+        self.chunkSize = self.meta['chunkSize']
+        self.Mountains = np.array(self.meta['Mountains'], dtype=int).reshape(-1, 2)
+        self.Forests = np.array(self.meta['Forests'], dtype=int).reshape(-1, 2)
+        self.cacheSize = cacheSize
+        self.cache = OrderedDict()
+
+    def __len__(self):
+        return self.meta['nSteps']
+
+    def chunk(self, i):
+        """
+        The decoded chunk i, a list with per timestep (t, lynxPositions, lynxStates,
+        harePositions, hareStates).
+        """
+        if i in self.cache:
+            self.cache.move_to_end(i)
+            return self.cache[i]
+
+        with np.load(chunk_file(self.directory, i)) as data:
+            lynx = self.decode(data['lynxCells'], data['lynxStates'], data['nLynx'])
+            hares = self.decode(data['hareCells'], data['hareStates'], data['nHares'])
+            steps = [(t,) + l + h for t, l, h in zip(data['time'].tolist(), lynx, hares)]
+
+        self.cache[i] = steps
+        if len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+        return steps
+
+    def decode(self, cells, states, counts):
+        """
+        Undoes the delta encoding of every timestep in a chunk.
+        """
+        steps = []
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            c = np.cumsum(cells[start:end], dtype=np.int64)
+            steps.append((np.column_stack((c // self.height, c % self.height)), states[start:end]))
+        return steps
+
+    def step(self, i):
+        """
+        The i-th recorded timestep as (t, lynxPositions, lynxStates, harePositions,
+        hareStates), negative i counts from the end.
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f'The trajectory has {len(self)} timesteps')
+        return self.chunk(i // self.chunkSize)[i % self.chunkSize]
+
+    def frame(self, i):
+        """
+        The arguments of Visualization.update for the i-th recorded timestep.
+        """
+        t, LynxPopulation, _, HaresPopulation, _ = self.step(i)
+        return t, LynxPopulation, HaresPopulation, self.Mountains, self.Forests
+
+    def show(self, start=0, stop=None, renderEvery=1, targetFps=None):
+        """
+        Plays the recorded timesteps from start up to stop in a Visualization.
+        """
+        vis = simulation_visualization.Visualization(self.height, self.width, renderEvery=renderEvery,
+                                                     targetFps=targetFps)
+        for i in range(*slice(start, stop).indices(len(self))):
+            vis.update(*self.frame(i))
+        vis.persist()
+
+    def export_frames(self, directory, start=0, stop=None, every=1, processes=None, fileType='png'):
+        """
+        Saves every every-th recorded timestep from start up to stop as an image in
+        directory, rendered without a window by a pool of worker processes. Every
+        worker renders a consecutive block of frames, so it reads each chunk once.
+        Returns the file names in timestep order.
+        """
+        os.makedirs(directory, exist_ok=True)
+        frames = list(range(*slice(start, stop, every).indices(len(self))))
+        fileNames = [os.path.join(directory, 'frame%06d.%s' % (i, fileType)) for i in frames]
+        if processes is None:
+            processes = os.cpu_count() or 1
+        size = -(-len(frames) // processes) if frames else 1
+        blocks = [(self.directory, frames[k:k + size], fileNames[k:k + size]) for k in range(0, len(frames), size)]
+
+        if processes == 1:
+            for block in blocks:
+                render_frames(*block)
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                list(pool.map(render_frames, *zip(*blocks)))
+        return fileNames
+
+    def export_video(self, fileName, fps=25, start=0, stop=None, every=1, processes=None):
+        """
+        Renders the recorded timesteps to a video. A .gif is put together with Pillow,
+        other formats like .mp4 need the ffmpeg program.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            fileNames = self.export_frames(directory, start, stop, every, processes)
+            if fileName.lower().endswith('.gif'):
+                from PIL import Image
+                images = [Image.open(name) for name in fileNames]
+                images[0].save(fileName, save_all=True, append_images=images[1:], duration=1000 / fps, loop=0)
+                return
+
+            if shutil.which('ffmpeg') is None:
+                raise RuntimeError('Exporting a video other than .gif needs ffmpeg')
+            subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-framerate', str(fps),
+                            '-pattern_type', 'glob', '-i', os.path.join(directory, '*.png'), '-pix_fmt', 'yuv420p', fileName],
+                           check=True)
+
+
+def render_frames(directory, frames, fileNames):
+    """
+    Renders the recorded timesteps in frames to fileNames with the Agg backend, this
+    is what the worker processes of Replay.export_frames run.
+    """
+    plt.switch_backend('Agg')
+
+    replay = Replay(directory)
+    plt.figure()
+    vis = simulation_visualization.Visualization(replay.height, replay.width, blit=False)
+    for i, fileName in zip(frames, fileNames):
+        vis.save_frame(fileName, *replay.frame(i))
+    plt.close(vis.fig)